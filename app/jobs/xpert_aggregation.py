@@ -3,7 +3,7 @@ import logging
 
 from app import scheduler
 from app.xpert.service import xpert_service
-from config import JOB_SUBSCRIPTION_AGGREGATION_INTERVAL
+from config import XPERT_SOURCE_SCHEDULER_TICK_SEC
 
 logger = logging.getLogger(__name__)
 
@@ -19,10 +19,19 @@ def run_subscription_aggregation():
 
 
 async def _update_subscriptions():
-    """Обновление всех подписок"""
-    logger.info("Starting scheduled subscription aggregation...")
+    """Обновление источников, у которых подошел срок (интервал зависит от priority)"""
+    sources = xpert_service.get_enabled_sources()
+    due = xpert_service.get_due_sources(sources)
+    if not due:
+        # Источник выключили или удалили: запуск без загрузок убирает его конфиги
+        # (без включенных источников - очищает конфиги и снимок)
+        if not xpert_service.has_orphaned_configs(sources):
+            return
+        logger.info("Removing configs of disabled or deleted sources...")
+    else:
+        logger.info(f"Starting scheduled subscription aggregation for {len(due)} due sources...")
     try:
-        result = await xpert_service.update_subscription()
+        result = await xpert_service.update_subscription(trigger="schedule")
         logger.info(f"Subscription aggregation complete: {result}")
     except Exception as e:
         logger.error(f"Subscription aggregation failed: {e}")
@@ -31,10 +40,10 @@ async def _update_subscriptions():
 scheduler.add_job(
     run_subscription_aggregation,
     "interval",
-    seconds=JOB_SUBSCRIPTION_AGGREGATION_INTERVAL,
+    seconds=XPERT_SOURCE_SCHEDULER_TICK_SEC,
     id="xpert_subscription_aggregation",
     replace_existing=True,
     max_instances=1
 )
 
-logger.info(f"Xpert subscription aggregation job scheduled (interval: {JOB_SUBSCRIPTION_AGGREGATION_INTERVAL}s)")
+logger.info(f"Xpert subscription aggregation job scheduled (tick: {XPERT_SOURCE_SCHEDULER_TICK_SEC}s)")
@@ -0,0 +1,42 @@
+import asyncio
+import logging
+
+from app import scheduler
+from app.xpert.probe_scheduler import probe_scheduler
+from app.xpert.service import xpert_service
+from config import XPERT_REPROBE_TICK_SEC
+
+logger = logging.getLogger(__name__)
+
+
+def run_endpoint_reprobe():
+    """Плановая перепроверка endpoint'ов между запусками агрегации"""
+    if xpert_service.is_updating:
+        return
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    loop.run_until_complete(_reprobe_due_endpoints())
+
+
+async def _reprobe_due_endpoints():
+    try:
+        result = await probe_scheduler.run_due()
+        if result["probed"]:
+            logger.info(f"Endpoint re-probe complete: {result}")
+    except Exception as e:
+        logger.error(f"Endpoint re-probe failed: {e}")
+
+
+scheduler.add_job(
+    run_endpoint_reprobe,
+    "interval",
+    seconds=XPERT_REPROBE_TICK_SEC,
+    id="xpert_endpoint_reprobe",
+    replace_existing=True,
+    max_instances=1
+)
+
+logger.info(f"Xpert endpoint re-probe job scheduled (tick: {XPERT_REPROBE_TICK_SEC}s)")
@@ -0,0 +1,41 @@
+import asyncio
+import logging
+from datetime import datetime
+
+from app import scheduler
+from app.xpert.probe_engine import probe_engine
+from config import XPERT_TARGET_BASELINE_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+
+def run_target_baseline_refresh():
+    """Обновление baseline до Target IPs, которым пользуются все проверки endpoint'ов"""
+    try:
+        loop = asyncio.get_event_loop()
+    except RuntimeError:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+    loop.run_until_complete(_refresh_target_baseline())
+
+
+async def _refresh_target_baseline():
+    try:
+        ok, avg_ping = await probe_engine.refresh_target_baseline()
+        logger.debug(f"Target baseline refreshed: ok={ok}, avg_ping={avg_ping:.1f}ms")
+    except Exception as e:
+        logger.error(f"Target baseline refresh failed: {e}")
+
+
+scheduler.add_job(
+    run_target_baseline_refresh,
+    "interval",
+    seconds=XPERT_TARGET_BASELINE_INTERVAL,
+    id="xpert_target_baseline",
+    replace_existing=True,
+    max_instances=1,
+    coalesce=True,
+    next_run_time=datetime.now()
+)
+
+logger.info(f"Xpert target baseline job scheduled (interval: {XPERT_TARGET_BASELINE_INTERVAL}s)")
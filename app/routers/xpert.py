@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, Depends, Request
 from fastapi.responses import PlainTextResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, ValidationError
 from typing import List, Optional
 import requests
 import json
@@ -10,8 +10,10 @@ import redis
 from app.xpert.service import xpert_service
 from app.xpert.marzban_integration import marzban_integration
 from app.xpert.ping_stats import ping_stats_service
+from app.xpert.ping_ingest import ping_ingest_queue
 from app.xpert.direct_config_service import direct_config_service
 from app.xpert.checker import checker
+from app.xpert.probe_engine import probe_engine
 from app.xpert.hwid_lock_service import (
     set_required_hwid_for_subscription_url,
     set_hwid_limit_for_subscription_url,
@@ -85,6 +87,14 @@ class SourceCreate(BaseModel):
     name: str
     url: str
     priority: int = 1
+    refresh_interval: Optional[int] = Field(default=None, ge=60)
+    probe_budget: Optional[int] = Field(default=None, ge=0)
+
+
+class SourceSchedule(BaseModel):
+    priority: Optional[int] = None
+    refresh_interval: Optional[int] = Field(default=None, ge=60)
+    probe_budget: Optional[int] = Field(default=None, ge=0)
 
 
 class SourceResponse(BaseModel):
@@ -430,7 +440,13 @@ async def update_target_ips(data: TargetIPsUpdate, admin: Admin = Depends(Admin.
     """Обновление списка target IPs для проверок."""
     try:
         updated = xpert_service.set_target_ips(data.target_ips)
-        return {"message": "Target IPs updated", "target_ips": updated}
+        # Baseline по новому списку сразу, не дожидаясь тика задачи xpert_target_baseline
+        baseline_ok, baseline_ping = await probe_engine.refresh_target_baseline()
+        return {
+            "message": "Target IPs updated",
+            "target_ips": updated,
+            "baseline": {"ok": baseline_ok, "avg_ping": baseline_ping},
+        }
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
@@ -448,7 +464,16 @@ async def get_sources():
             "priority": s.priority,
             "config_count": s.config_count,
             "success_rate": s.success_rate,
-            "last_fetched": s.last_fetched
+            "last_fetched": s.last_fetched,
+            "breaker_state": s.breaker_state,
+            "failure_count": s.failure_count,
+            "next_attempt_at": s.next_attempt_at,
+            "last_error": s.last_error,
+            "refresh_interval": xpert_service.get_refresh_interval(s),
+            "probe_budget": xpert_service.get_probe_budget(s),
+            "next_refresh_at": s.next_refresh_at,
+            "duplicate_count": s.duplicate_count,
+            "cross_duplicate_count": s.cross_duplicate_count
         }
         for s in sources
     ]
@@ -458,7 +483,9 @@ async def get_sources():
 async def add_source(source: SourceCreate):
     """Добавление источника подписки"""
     try:
-        s = xpert_service.add_source(source.name, source.url, source.priority)
+        s = xpert_service.add_source(
+            source.name, source.url, source.priority, source.refresh_interval, source.probe_budget
+        )
         return {
             "id": s.id,
             "name": s.name,
@@ -489,20 +516,42 @@ async def toggle_source(source_id: int):
     raise HTTPException(status_code=404, detail="Source not found")
 
 
+@router.put("/sources/{source_id}/schedule")
+async def set_source_schedule(source_id: int, schedule: SourceSchedule):
+    """Приоритет, интервал обновления и бюджет проверок источника (null - вывод из приоритета)"""
+    source = xpert_service.set_source_schedule(
+        source_id, schedule.priority, schedule.refresh_interval, schedule.probe_budget
+    )
+    if source is None:
+        raise HTTPException(status_code=404, detail="Source not found")
+    return {
+        "success": True,
+        "priority": source.priority,
+        "refresh_interval": xpert_service.get_refresh_interval(source),
+        "probe_budget": xpert_service.get_probe_budget(source),
+        "next_refresh_at": source.next_refresh_at
+    }
+
+
 @router.post("/update")
 async def force_update():
-    """Принудительное обновление подписок"""
+    """Принудительное обновление подписок: запуск в фоне, прогресс - /update/status"""
     try:
-        # Увеличиваем таймаут для долгих операций
-        import asyncio
-        result = await asyncio.wait_for(xpert_service.update_subscription(), timeout=300)  # 5 минут
-        return {"success": True, **result}
-    except asyncio.TimeoutError:
-        raise HTTPException(status_code=408, detail="Update timeout - operation took too long")
+        run, joined = xpert_service.start_update(trigger="api")
+        return {"success": True, "job_id": run.job_id, "joined": joined, "status": run.status}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/update/status")
+async def get_update_status(job_id: Optional[str] = None):
+    """Прогресс запуска агрегации (по job_id, иначе активный или последний)"""
+    run = xpert_service.get_update_run(job_id)
+    if run is None:
+        raise HTTPException(status_code=404, detail="Update job not found")
+    return run.to_dict()
+
+
 @router.get("/configs")
 async def get_configs():
     """Получение списка конфигураций"""
@@ -522,6 +571,12 @@ async def get_configs():
     ]
 
 
+@router.get("/configs/changes")
+async def get_config_changes():
+    """Изменения конфигураций за последний запуск агрегации (added/removed/updated ID)"""
+    return xpert_service.get_change_set().to_dict()
+
+
 @router.post("/test-url")
 async def test_subscription_url(url_data: dict):
     """Тестирование URL подписки перед добавлением"""
@@ -573,6 +628,58 @@ async def report_ping(ping_data: PingReport, user_id: int = 1):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/ping-report/batch")
+async def report_pings_batch(request: Request, user_id: int = 1):
+    """Пачка результатов пинга: JSON-массив или NDJSON; запись идет в фоне через очередь"""
+    max_bytes = config.XPERT_PING_BATCH_MAX_BYTES
+    too_large = HTTPException(status_code=413, detail=f"Batch body too large (max {max_bytes} bytes)")
+    try:
+        declared = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    if declared > max_bytes:
+        raise too_large
+    # Content-Length может отсутствовать (chunked) - лимит проверяется и при чтении
+    chunks = []
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_bytes:
+            raise too_large
+        chunks.append(chunk)
+    body = b"".join(chunks).decode("utf-8", errors="replace").strip()
+    try:
+        if body.startswith("["):
+            items = json.loads(body)
+        else:
+            items = [json.loads(line) for line in body.splitlines() if line.strip()]
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    if not isinstance(items, list) or not items:
+        raise HTTPException(status_code=400, detail="Expected a non-empty array of ping reports")
+    if len(items) > config.XPERT_PING_BATCH_MAX_REPORTS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many reports in one batch (max {config.XPERT_PING_BATCH_MAX_REPORTS})"
+        )
+
+    records = []
+    for index, item in enumerate(items):
+        try:
+            report = PingReport.model_validate(item)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=f"Report #{index}: {e.errors()}")
+        records.append((report.server, report.port, report.protocol, user_id, report.ping_ms, report.success))
+
+    if not ping_ingest_queue.submit(records):
+        raise HTTPException(
+            status_code=429,
+            detail="Ping report queue is full, retry later",
+            headers={"Retry-After": "1"}
+        )
+    return {"success": True, "accepted": len(records)}
+
+
 @router.get("/server-health/{server}/{port}/{protocol}")
 async def get_server_health(server: str, port: int, protocol: str):
     """Получение статистики здоровья сервера"""
@@ -587,7 +694,7 @@ async def get_server_health(server: str, port: int, protocol: str):
 async def get_ping_stats():
     """Получение сводной статистики пингов"""
     try:
-        return ping_stats_service.get_stats_summary()
+        return {**ping_stats_service.get_stats_summary(), "ingest": ping_ingest_queue.get_stats()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -606,48 +713,17 @@ async def cleanup_ping_stats(days: int = 7):
 async def get_top_configs(limit: int = 10):
     """Получение топ-N конфигов с их score"""
     try:
-        configs = xpert_service.get_active_configs()
-        
         # Получаем топ конфиги с score
         try:
-            from app.xpert.ping_stats import ping_stats_service
+            from app.xpert.leaderboard import leaderboard
             import config as app_config
             
-            # Фильтруем здоровые
-            healthy_configs = ping_stats_service.get_healthy_configs(configs)
-            
-            # Получаем топ с score
             top_limit = min(limit, app_config.XPERT_TOP_SERVERS_LIMIT)
-            top_configs = ping_stats_service.get_top_configs(healthy_configs, top_limit)
-            
-            # Добавляем score для отображения
-            result = []
-            for config in top_configs:
-                health = ping_stats_service.get_server_health(config.server, config.port, config.protocol)
-                score = 0
-                
-                if health['healthy'] is None:
-                    score = ping_stats_service._calculate_original_score(config)
-                elif health['healthy']:
-                    score = ping_stats_service._calculate_stats_score(health, config)
-                
-                result.append({
-                    "id": config.id,
-                    "protocol": config.protocol,
-                    "server": config.server,
-                    "port": config.port,
-                    "remarks": config.remarks,
-                    "ping_ms": config.ping_ms,
-                    "packet_loss": config.packet_loss,
-                    "is_active": config.is_active,
-                    "score": round(score, 2),
-                    "health": health
-                })
-            
-            return {"configs": result, "total": len(result)}
+            return leaderboard.get_top(top_limit)
             
         except Exception as e:
             # Если статистика недоступна, возвращаем базовые конфиги
+            configs = xpert_service.get_active_configs()
             return {"configs": configs[:limit], "total": len(configs[:limit])}
             
     except Exception as e:
@@ -658,28 +734,12 @@ async def get_top_configs(limit: int = 10):
 async def get_queue_configs():
     """Получение конфигов в очереди (не попавших в топ)"""
     try:
-        configs = xpert_service.get_active_configs()
-        
-        # Получаем топ конфиги
+        # Очередь = все здоровые минус топ
         try:
-            from app.xpert.ping_stats import ping_stats_service
+            from app.xpert.leaderboard import leaderboard
             import config as app_config
             
-            # Фильтруем здоровые
-            healthy_configs = ping_stats_service.get_healthy_configs(configs)
-            
-            # Получаем топ
-            top_limit = app_config.XPERT_TOP_SERVERS_LIMIT
-            top_configs = ping_stats_service.get_top_configs(healthy_configs, top_limit)
-            
-            # Очередь = все здоровые минус топ
-            top_servers = {(c.server, c.port, c.protocol) for c in top_configs}
-            queue_configs = [
-                c for c in healthy_configs 
-                if (c.server, c.port, c.protocol) not in top_servers
-            ]
-            
-            return {"configs": queue_configs, "total": len(queue_configs)}
+            return leaderboard.get_queue(app_config.XPERT_TOP_SERVERS_LIMIT)
             
         except Exception as e:
             # Если статистика недоступна, возвращаем пустую очередь
@@ -805,7 +865,7 @@ async def get_direct_configs():
 async def refresh_direct_configs_ping(admin: Admin = Depends(Admin.get_current)):
     """Ручное обновление ping/status для Direct Configurations."""
     try:
-        direct_config_service.refresh_all_pings(force=True)
+        direct_config_service.refresh_all_pings(force=True, force_probe=True)
         return {"message": "Direct configs ping refreshed"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1057,7 +1117,7 @@ async def validate_direct_config(config_data: dict, admin: Admin = Depends(Admin
         import logging
         logging.info(f"Validating config: {raw_config[:100]}...")
         
-        result = checker.process_config(raw_config)
+        result = await probe_engine.process_config(raw_config, force=bool(config_data.get('force')))
         logging.info(f"Validation result: {result}")
         
         if result:
@@ -218,27 +218,28 @@ def replace_server_names_with_flags(config_raw: str) -> str:
             logger.info("Country flags disabled in config, returning original")
             return config_raw
             
+        from app.xpert.config_parser import parse_link, parsed_config_cache
+
+        # Значения name=/remark=/ps= найдены при разборе ссылки (один раз на ссылку, см. ParsedConfig);
+        # строки вида "name=<remark>" не ссылки - разбираем без кеша, чтобы не вытеснять из него конфиги
+        parsed = parsed_config_cache.get(config_raw) if "://" in config_raw else parse_link(config_raw)
+        if not parsed.name_spans:
+            return config_raw
+
         from app.xpert.geo_service import geo_service
-        import re
         import logging
         import urllib.parse
         logger = logging.getLogger(__name__)
         
         logger.info(f"Processing config for flags replacement, length: {len(config_raw)}")
         
-        # Регулярное выражение для поиска имен серверов в различных форматах
-        name_pattern = r'(name="?([^"=,]+)"?)'
-        
-        def replace_name(match):
-            full_match = match.group(1)
-            server_name = match.group(2)
-            
+        def replace_name(server_name: str) -> str:
             logger.debug(f"Processing server name: {server_name}")
             
             # Если имя уже содержит флаг (emoji), не меняем его
             if any(ord(char) > 127 for char in server_name):
                 logger.debug(f"Server {server_name} already has flag, skipping")
-                return full_match
+                return server_name
             
             # Пробуем определить страну по имени сервера
             if '.' in server_name and not server_name.startswith('http'):
@@ -252,29 +253,28 @@ def replace_server_names_with_flags(config_raw: str) -> str:
                     new_name = f"{flag_encoded} {code}"
                     
                     logger.info(f"Replaced '{server_name}' with '{new_name}' (flag: {flag})")
-                    return full_match.replace(server_name, new_name)
+                    return new_name
                 except Exception as e:
                     logger.debug(f"Failed to get country for {server_name}: {e}")
             else:
                 logger.debug(f"Server name {server_name} doesn't look like domain, skipping")
             
             # Если не удалось определить, оставляем как есть
-            return full_match
-        
-        # Применяем замену
-        result = re.sub(name_pattern, replace_name, config_raw)
-        
-        # Дополнительная обработка для remark полей
-        remark_pattern = r'(remark="?([^"=,]+)"?)'
-        result = re.sub(remark_pattern, replace_name, result)
-        
-        # Дополнительная обработка для других полей
-        other_patterns = [
-            r'(ps="?([^"=,]+)"?)',  # ps field
-        ]
+            return server_name
         
-        for pattern in other_patterns:
-            result = re.sub(pattern, replace_name, result)
+        # Замена по известным позициям, с конца - чтобы не сдвигать еще не обработанные;
+        # позиции отсчитаны от parsed.raw без пробелов по краям, сдвигаем их в исходную строку
+        raw = config_raw
+        offset = len(config_raw) - len(config_raw.lstrip())
+        parts = []
+        end = len(raw)
+        for start, stop in reversed(parsed.name_spans):
+            start, stop = start + offset, stop + offset
+            parts.append(raw[stop:end])
+            parts.append(replace_name(raw[start:stop]))
+            end = start
+        parts.append(raw[:end])
+        result = "".join(reversed(parts))
         
         logger.info(f"Processed config with Happ-compatible flags")
         return result
@@ -350,7 +350,7 @@ def generate_v2ray_links(proxies: dict, inbounds: dict, extra_data: dict, revers
         
         # Получаем все конфиги из Xpert
         if not app_config.XPERT_REQUIRE_ACTIVE_STATUS:
-            xpert_configs = xpert_service.get_active_configs()
+            xpert_configs = xpert_service.get_active_snapshot().configs
         else:
             # Если пользователь неактивен, не добавляем Xpert конфиги
             if user_status not in ['active', 'on_hold']:
@@ -364,7 +364,7 @@ def generate_v2ray_links(proxies: dict, inbounds: dict, extra_data: dict, revers
             if expire is not None and expire > 0 and expire <= 0:
                 return conf.render(reverse=reverse)
             
-            xpert_configs = xpert_service.get_active_configs()
+            xpert_configs = xpert_service.get_active_snapshot().configs
         
         # ВСЕГДА фильтруем сервера по разрешенным хостам
         if xpert_configs:
@@ -1,136 +1,92 @@
 import asyncio
-import base64
-import json
-import re
+import hashlib
+import math
 import socket
 import ssl
-import subprocess
+import statistics
 import time
 import logging
-from typing import List, Tuple, Optional
-from urllib.parse import urlparse, parse_qs, unquote
+from dataclasses import dataclass, field
+from typing import AsyncIterator, List, Tuple, Optional
 import httpx
 
 import config
+from app.xpert.config_parser import parsed_config_cache
+from app.xpert.dns_cache import dns_cache
+from app.xpert.feed_decoder import FeedDecoder
+from app.xpert.probe_cache import probe_cache
 
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class FetchResult:
+    """Результат загрузки одного источника подписки"""
+    ok: bool = False
+    not_modified: bool = False
+    configs: List[str] = field(default_factory=list)
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    error: Optional[str] = None
+
+
+def summarize_samples(samples: List[Optional[float]]) -> Tuple[float, float, float, float]:
+    """(median, p90, jitter, loss %) по серии замеров; None - неудачная попытка.
+
+    Jitter - среднее абсолютное изменение задержки между соседними удачными замерами.
+    """
+    pings = [float(s) for s in samples if s is not None]
+    if not pings:
+        return 999.0, 999.0, 0.0, 100.0
+    ordered = sorted(pings)
+    median = statistics.median(ordered)
+    p90 = ordered[max(0, math.ceil(0.9 * len(ordered)) - 1)]
+    jitter = statistics.mean(abs(b - a) for a, b in zip(pings, pings[1:])) if len(pings) > 1 else 0.0
+    loss = (len(samples) - len(pings)) / len(samples) * 100
+    return median, p90, jitter, loss
+
+
 class ConfigChecker:
     """Проверка и парсинг VPN конфигураций"""
+
+    # Улучшенные заголовки для GitHub и других сервисов
+    fetch_headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+        "Accept": "text/plain, application/octet-stream, */*",
+        "Accept-Encoding": "gzip, deflate",
+        "Cache-Control": "no-cache",
+        "Pragma": "no-cache"
+    }
     
     def __init__(self):
         self.max_ping = config.XPERT_MAX_PING_MS
         self.target_ips = config.XPERT_TARGET_CHECK_IPS
         self.timeout = 3
+        # Baseline до Target IPs публикует фоновая задача (app/jobs/xpert_target_baseline.py):
+        # словарь заменяется целиком, читатели никогда его не обновляют.
         self._target_probe_cache = {
             "ts": 0.0,
             "ok": False,
             "avg_ping": 999.0,
             "success_count": 0,
         }
-        self._target_probe_ttl_sec = 30.0
+        self._target_baseline_max_age = config.XPERT_TARGET_BASELINE_INTERVAL * 3
     
     def parse_config(self, raw: str) -> Tuple[str, str, int, str]:
-        """Парсинг конфигурации VPN"""
-        raw = raw.strip()
-        protocol = ""
-        server = ""
-        port = 0
-        remarks = ""
-        
-        logger.info(f"Parsing config: {raw[:50]}...")
-        
-        try:
-            if raw.startswith("vless://"):
-                protocol = "vless"
-                server, port, remarks = self._parse_vless(raw)
-                logger.info(f"VLESS parsed: server={server}, port={port}")
-            elif raw.startswith("vmess://"):
-                protocol = "vmess"
-                server, port, remarks = self._parse_vmess(raw)
-                logger.info(f"VMESS parsed: server={server}, port={port}")
-            elif raw.startswith("trojan://"):
-                protocol = "trojan"
-                server, port, remarks = self._parse_trojan(raw)
-                logger.info(f"TROJAN parsed: server={server}, port={port}")
-            elif raw.startswith("ss://"):
-                protocol = "shadowsocks"
-                server, port, remarks = self._parse_shadowsocks(raw)
-                logger.info(f"SS parsed: server={server}, port={port}")
-            elif raw.startswith("ssr://"):
-                protocol = "ssr"
-                server, port, remarks = self._parse_ssr(raw)
-                logger.info(f"SSR parsed: server={server}, port={port}")
-            else:
-                logger.warning(f"Unknown protocol: {raw[:20]}...")
-        except Exception as e:
-            logger.error(f"Failed to parse config: {e}")
-        
-        return protocol, server, port, remarks
-    
-    def _parse_vless(self, raw: str) -> Tuple[str, int, str]:
-        try:
-            parsed = urlparse(raw)
-            server = parsed.hostname or ""
-            port = parsed.port or 443
-            remarks = unquote(parsed.fragment) if parsed.fragment else ""
-            return server, port, remarks
-        except:
-            return "", 0, ""
-    
-    def _parse_vmess(self, raw: str) -> Tuple[str, int, str]:
-        try:
-            import json
-            encoded = raw.replace("vmess://", "")
-            padding = 4 - len(encoded) % 4
-            if padding != 4:
-                encoded += "=" * padding
-            decoded = base64.b64decode(encoded).decode('utf-8')
-            data = json.loads(decoded)
-            server = data.get("add", "")
-            port = int(data.get("port", 443))
-            remarks = data.get("ps", "")
-            return server, port, remarks
-        except:
-            return "", 0, ""
-    
-    def _parse_trojan(self, raw: str) -> Tuple[str, int, str]:
-        try:
-            parsed = urlparse(raw)
-            server = parsed.hostname or ""
-            port = parsed.port or 443
-            remarks = unquote(parsed.fragment) if parsed.fragment else ""
-            return server, port, remarks
-        except:
-            return "", 0, ""
-    
-    def _parse_shadowsocks(self, raw: str) -> Tuple[str, int, str]:
-        try:
-            parsed = urlparse(raw)
-            server = parsed.hostname or ""
-            port = parsed.port or 443
-            remarks = unquote(parsed.fragment) if parsed.fragment else ""
-            return server, port, remarks
-        except:
-            return "", 0, ""
-    
-    def _parse_ssr(self, raw: str) -> Tuple[str, int, str]:
-        try:
-            encoded = raw.replace("ssr://", "")
-            padding = 4 - len(encoded) % 4
-            if padding != 4:
-                encoded += "=" * padding
-            decoded = base64.urlsafe_b64decode(encoded).decode('utf-8')
-            parts = decoded.split(":")
-            if len(parts) >= 2:
-                server = parts[0]
-                port = int(parts[1])
-                return server, port, ""
-        except:
-            pass
-        return "", 0, ""
+        """Парсинг конфигурации VPN (через общий кеш разобранных ссылок)"""
+        parsed = parsed_config_cache.get(raw)
+        if not parsed.protocol:
+            logger.warning(f"Unknown protocol: {parsed.raw[:20]}...")
+        return parsed.protocol, parsed.host, parsed.port, parsed.remark
     
+    def fingerprint(self, raw: str) -> str:
+        """Канонический отпечаток конфига (без remark) для стабильных ID между запусками.
+
+        Тот же хеш канонической формы, по которому агрегация убирает дубликаты (ParsedConfig.canonical).
+        """
+        return parsed_config_cache.get(raw).canonical
+
     async def check_connectivity(self, host: str, port: int) -> Tuple[bool, float]:
         """Комплексная проверка доступности сервера"""
         try:
@@ -177,10 +133,13 @@ class ConfigChecker:
     def check_connectivity_sync(self, host: str, port: int, timeout: float = 2.5) -> Tuple[bool, float]:
         """Синхронная TCP-проверка доступности для вызова из API-хендлеров."""
         try:
+            address = dns_cache.resolve_blocking(host, timeout=timeout)
+            if not address:
+                return False, 999.0
             start_time = time.time()
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock = socket.socket(socket.AF_INET6 if ":" in address else socket.AF_INET, socket.SOCK_STREAM)
             sock.settimeout(timeout)
-            result = sock.connect_ex((host, port))
+            result = sock.connect_ex((address, port))
             end_time = time.time()
             sock.close()
 
@@ -196,8 +155,11 @@ class ConfigChecker:
         raw_sock = None
         tls_sock = None
         try:
+            address = dns_cache.resolve_blocking(host, timeout=timeout)
+            if not address:
+                return False, 999.0
             start_time = time.time()
-            raw_sock = socket.create_connection((host, port), timeout=timeout)
+            raw_sock = socket.create_connection((address, port), timeout=timeout)
             context = ssl.create_default_context()
             context.check_hostname = False
             context.verify_mode = ssl.CERT_NONE
@@ -224,114 +186,79 @@ class ConfigChecker:
 
     def should_use_tls_probe(self, raw: str, protocol: str, port: int) -> bool:
         """Определяет, нужен ли TLS-handshake probe."""
-        p = (protocol or "").lower()
-        r = (raw or "").lower()
-
         if port in [443, 8443, 2053, 2083, 2087, 2096]:
             return True
-
-        if p == "trojan":
+        if (protocol or "").lower() == "trojan":
             return True
-        if p == "vmess" and self._vmess_uses_tls(raw):
-            return True
-
-        tls_markers = [
-            "security=tls",
-            "security=reality",
-            "tls=1",
-            "type=grpc",
-            "sni=",
-            "alpn=",
-        ]
-        return any(m in r for m in tls_markers)
-
-    def _vmess_uses_tls(self, raw: str) -> bool:
-        try:
-            if not raw.startswith("vmess://"):
-                return False
-            encoded = raw.replace("vmess://", "")
-            padding = 4 - len(encoded) % 4
-            if padding != 4:
-                encoded += "=" * padding
-            data = json.loads(base64.b64decode(encoded).decode("utf-8"))
-            tls_val = str(data.get("tls", "")).lower()
-            scy_val = str(data.get("scy", "")).lower()
-            if tls_val in ["tls", "reality", "1", "true"]:
-                return True
-            if scy_val in ["tls", "reality"]:
-                return True
-            return any(bool(data.get(k)) for k in ["sni", "alpn", "fp", "pbk"])
-        except Exception:
-            return False
-
-    def _probe_target_ips_tls_cached(self, timeout: float = 2.0) -> Tuple[bool, float]:
-        now = time.time()
-        if (now - self._target_probe_cache["ts"]) < self._target_probe_ttl_sec:
-            return self._target_probe_cache["ok"], self._target_probe_cache["avg_ping"]
+        return parsed_config_cache.get(raw).tls
 
-        pings = []
-        for ip in self.target_ips or []:
-            ip = str(ip).strip()
-            if not ip:
-                continue
-            ok, ping_ms = self.check_tls_handshake_sync(ip, 443, timeout=timeout)
-            if ok:
-                pings.append(float(ping_ms))
+    def get_target_baseline(self) -> Tuple[bool, float]:
+        """Последний опубликованный baseline (ok, avg_ping); устаревший считается недоступным"""
+        baseline = self._target_probe_cache
+        if not baseline["ok"] or (time.time() - baseline["ts"]) > self._target_baseline_max_age:
+            return False, 999.0
+        return True, float(baseline["avg_ping"])
 
+    def publish_target_baseline(self, pings: List[float]):
+        """Атомарная публикация нового baseline по удачным handshake до Target IPs"""
         ok = len(pings) > 0
-        avg_ping = (sum(pings) / len(pings)) if ok else 999.0
         self._target_probe_cache = {
-            "ts": now,
+            "ts": time.time(),
             "ok": ok,
-            "avg_ping": float(avg_ping),
+            "avg_ping": float(sum(pings) / len(pings)) if ok else 999.0,
             "success_count": len(pings),
         }
-        return ok, float(avg_ping)
 
-    def probe_endpoint_sync(self, raw: str, protocol: str, host: str, port: int, timeout: float = 2.5) -> Tuple[bool, float]:
-        """Унифицированная проверка endpoint: TLS-handshake или TCP connect."""
-        if self.should_use_tls_probe(raw, protocol, port):
-            cfg_ok, cfg_ping = self.check_tls_handshake_sync(host, port, timeout=timeout)
-        else:
-            cfg_ok, cfg_ping = self.check_connectivity_sync(host, port, timeout=timeout)
-
-        # Дополнительно учитываем TLS-handshake до Target IPs (кешировано).
-        target_ok, target_ping = self._probe_target_ips_tls_cached(timeout=min(2.0, timeout))
-        if cfg_ok and target_ok:
-            mixed = (float(cfg_ping) * 0.7) + (float(target_ping) * 0.3)
-            return True, max(1.0, mixed)
-        return cfg_ok, float(cfg_ping)
+    def probe_endpoint_sync(self, raw: str, protocol: str, host: str, port: int, timeout: float = 2.5,
+                            force: bool = False) -> Tuple[bool, float]:
+        """Унифицированная проверка endpoint: (ok, median) по серии замеров measure_endpoint_sync.
+
+        Одиночный замер в общий кеш не кладется - агрегатор читает оттуда p90/jitter/loss.
+        """
+        ok, median, _, _, _ = self.measure_endpoint_sync(raw, protocol, host, port, timeout=timeout, force=force)
+        return ok, median
     
+    def measure_endpoint_sync(self, raw: str, protocol: str, host: str, port: int,
+                              timeout: float = 2.5, force: bool = False) -> Tuple[bool, float, float, float, float]:
+        """Серия замеров endpoint'а: (ok, median, p90, jitter, loss %)"""
+        use_tls = self.should_use_tls_probe(raw, protocol, port)
+        cached = probe_cache.get(host, port, use_tls, force=force)
+        if cached is not None:
+            median, p90, jitter, loss = cached
+        else:
+            samples: List[Optional[float]] = []
+            for attempt in range(max(1, config.XPERT_PROBE_SAMPLES)):
+                if attempt:
+                    time.sleep(config.XPERT_PROBE_SAMPLE_INTERVAL_MS / 1000)
+                started = time.monotonic()
+                if use_tls:
+                    ok, ping_ms = self.check_tls_handshake_sync(host, port, timeout=timeout)
+                else:
+                    ok, ping_ms = self.check_connectivity_sync(host, port, timeout=timeout)
+                samples.append(ping_ms if ok else None)
+                # Первый замер упал по таймауту - endpoint мертв, остальные попытки только тратят время
+                if not ok and attempt == 0 and time.monotonic() - started >= timeout * 0.9:
+                    break
+
+            median, p90, jitter, loss = summarize_samples(samples)
+            probe_cache.put(host, port, use_tls, (median, p90, jitter, loss))
+        ok = loss < 100.0
+        target_ok, target_ping = self.get_target_baseline()
+        if ok and target_ok:
+            median = max(1.0, (median * 0.7) + (float(target_ping) * 0.3))
+            p90 = max(1.0, (p90 * 0.7) + (float(target_ping) * 0.3))
+        return ok, median, p90, jitter, loss
+
     async def check_ping(self, host: str) -> Tuple[float, float, float]:
-        """Улучшенная проверка пинга с fallback на connectivity"""
-        try:
-            # Сначала пробуем ICMP ping
-            process = await asyncio.create_subprocess_exec(
-                "ping", "-c", "2", "-W", "2", host,  # Уменьшили количество и таймаут
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE
-            )
-            stdout, _ = await asyncio.wait_for(process.communicate(), timeout=5)
-            output = stdout.decode()
-            
-            times = re.findall(r'time[=<](\d+\.?\d*)', output)
-            if times:
-                pings = [float(t) for t in times]
-                avg_ping = sum(pings) / len(pings)
-                jitter = max(pings) - min(pings) if len(pings) > 1 else 0
-                
-                loss_match = re.search(r'(\d+)% packet loss', output)
-                loss = float(loss_match.group(1)) if loss_match else 0
-                
-                logger.debug(f"ICMP ping to {host}: {avg_ping:.2f}ms, loss: {loss}%")
-                return avg_ping, jitter, loss
-                
-        except Exception as e:
-            logger.debug(f"ICMP ping failed for {host}: {e}")
-        
-        # Fallback: если ICMP не работает, возвращаем высокие значения
-        # Но проверка connectivity будет в основном методе
-        return 999.0, 0.0, 100.0
+        """Задержка до хоста по серии TLS-handshake на 443 (без запуска ping): (median, jitter, loss %)"""
+        from app.xpert.probe_engine import probe_engine
+
+        address = await dns_cache.resolve(host)
+        if not address:
+            return 999.0, 0.0, 100.0
+        median, _, jitter, loss = await probe_engine.measure(address, host, 443, True, timeout=2.0)
+        logger.debug(f"TLS ping to {host}: {median:.2f}ms, jitter: {jitter:.2f}ms, loss: {loss:.0f}%")
+        return median, jitter, loss
     
     def check_port(self, host: str, port: int) -> bool:
         """Проверка доступности порта"""
@@ -344,81 +271,86 @@ class ConfigChecker:
         except:
             return False
     
-    async def fetch_subscription(self, url: str) -> List[str]:
+    def build_http_client(self) -> httpx.AsyncClient:
+        """Общий пул соединений для загрузки подписок"""
+        return httpx.AsyncClient(
+            timeout=30,
+            follow_redirects=True,
+            verify=False,  # Отключаем проверку SSL для проблемных сертификатов
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        )
+
+    async def _iter_feed(self, response: httpx.Response, url: str, digest) -> AsyncIterator[str]:
+        """Ссылки из тела ответа по мере получения; тело целиком в памяти не держится"""
+        decoder = FeedDecoder(config.XPERT_FEED_MAX_BYTES, config.XPERT_FEED_MAX_LINES)
+        async for chunk in response.aiter_bytes():
+            digest.update(chunk)
+            for link in decoder.feed(chunk):
+                yield link
+            if decoder.truncated:
+                break
+        for link in decoder.close():
+            yield link
+        if decoder.truncated:
+            logger.warning(
+                f"Feed {url} truncated after {decoder.bytes_read} bytes / {decoder.lines} configs"
+            )
+
+    async def fetch_subscription_conditional(
+        self,
+        client: httpx.AsyncClient,
+        url: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+    ) -> FetchResult:
+        """Условная загрузка подписки (If-None-Match / If-Modified-Since) через общий клиент"""
+        headers = dict(self.fetch_headers)
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        async with client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304:
+                logger.info(f"Not modified: {url}")
+                return FetchResult(ok=True, not_modified=True, etag=etag, last_modified=last_modified)
+
+            if response.status_code != 200:
+                logger.error(f"HTTP {response.status_code} for {url}")
+                return FetchResult(ok=False, error=f"HTTP {response.status_code}")
+
+            digest = hashlib.sha256()
+            configs = [link async for link in self._iter_feed(response, url, digest)]
+
+        logger.info(f"Fetched {len(configs)} configs from {url}")
+        return FetchResult(
+            ok=True,
+            configs=configs,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+            content_hash=digest.hexdigest(),
+        )
+
+    async def fetch_subscription(self, url: str, client: Optional[httpx.AsyncClient] = None) -> List[str]:
         """Получение конфигураций из URL подписки"""
-        configs = []
         try:
-            # Улучшенные заголовки для GitHub и других сервисов
-            headers = {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-                "Accept": "text/plain, application/octet-stream, */*",
-                "Accept-Encoding": "gzip, deflate",
-                "Cache-Control": "no-cache",
-                "Pragma": "no-cache"
-            }
-            
-            # Настройки клиента с поддержкой SSL
-            async with httpx.AsyncClient(
-                timeout=30, 
-                follow_redirects=True,
-                verify=False  # Отключаем проверку SSL для проблемных сертификатов
-            ) as client:
-                response = await client.get(url, headers=headers)
-                
-                if response.status_code == 200:
-                    content = response.text
-                    
-                    # Проверяем если контент уже содержит готовые конфиги
-                    if any(proto in content for proto in ['vless://', 'vmess://', 'trojan://', 'ss://', 'ssr://']):
-                        # Это готовые конфиги, используем как есть
-                        final_content = content
-                        logger.info(f"Detected direct configs from {url}")
-                    else:
-                        # Попробуем декодировать base64
-                        decoded_content = content
-                        for attempt in range(3):
-                            try:
-                                # Убираем возможные пробелы и переносы
-                                clean_content = content.strip().replace('\n', '').replace('\r', '')
-                                # Добавляем padding если нужно
-                                padding_needed = len(clean_content) % 4
-                                if padding_needed:
-                                    clean_content += '=' * (4 - padding_needed)
-                                
-                                decoded = base64.b64decode(clean_content).decode('utf-8')
-                                decoded_content = decoded
-                                logger.info(f"Successfully decoded base64 from {url}")
-                                break
-                            except Exception as e:
-                                if attempt == 2:  # Последняя попытка
-                                    logger.debug(f"Base64 decode failed after 3 attempts: {e}")
-                                continue
-                        
-                        # Используем декодированный контент или оригинал
-                        final_content = decoded_content if decoded_content != content else content
-                    
-                    # Разбиваем на строки и фильтруем
-                    for line in final_content.split('\n'):
-                        line = line.strip()
-                        if line and any(line.startswith(p) for p in ['vless://', 'vmess://', 'trojan://', 'ss://', 'ssr://']):
-                            configs.append(line)
-                    
-                    logger.info(f"Fetched {len(configs)} configs from {url}")
-                    
-                else:
-                    logger.error(f"HTTP {response.status_code} for {url}")
-                    
+            if client is not None:
+                result = await self.fetch_subscription_conditional(client, url)
+            else:
+                async with self.build_http_client() as own_client:
+                    result = await self.fetch_subscription_conditional(own_client, url)
+            return result.configs
         except httpx.SSLError as e:
             logger.error(f"SSL error for {url}: {e}")
         except httpx.TimeoutException as e:
             logger.error(f"Timeout for {url}: {e}")
         except Exception as e:
             logger.error(f"Failed to fetch subscription {url}: {e}")
-        
-        return configs
+
+        return []
     
-    def process_config(self, raw: str) -> Optional[dict]:
-        """Обработка одной конфигурации с TCP-проверкой доступности."""
+    def process_config(self, raw: str, force: bool = False) -> Optional[dict]:
+        """Обработка одной конфигурации: серия TCP/TLS-замеров доступности."""
         protocol, server, port, remarks = self.parse_config(raw)
         
         if not server or not port:
@@ -427,13 +359,9 @@ class ConfigChecker:
         
         logger.info(f"Added config: {protocol}://{server}:{port} - {remarks[:30]}...")
         
-        ok, tcp_ping = self.probe_endpoint_sync(raw, protocol, server, port, timeout=2.5)
-        if ok:
-            is_active = True
-            ping, jitter, loss = tcp_ping, 0.0, 0.0
-        else:
-            is_active = False
-            ping, jitter, loss = 999.0, 0.0, 100.0
+        is_active, ping, p90, jitter, loss = self.measure_endpoint_sync(
+            raw, protocol, server, port, timeout=2.5, force=force
+        )
         
         return {
             "raw": raw,
@@ -442,6 +370,7 @@ class ConfigChecker:
             "port": port,
             "remarks": remarks or f"{protocol.upper()}-{server[:15]}",
             "ping_ms": ping,
+            "ping_p90_ms": p90,
             "jitter_ms": jitter,
             "packet_loss": loss,
             "is_active": is_active
@@ -0,0 +1,218 @@
+"""
+Разбор ссылок на конфиги с кешем
+Каждая уникальная ссылка декодируется один раз; checker, HostFilter и генерация подписок читают готовую запись
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Tuple
+from urllib.parse import parse_qs, parse_qsl, unquote, urlparse
+
+import config as app_config
+
+logger = logging.getLogger(__name__)
+
+_TLS_MARKERS = ("security=tls", "security=reality", "tls=1", "type=grpc", "sni=", "alpn=")
+# По шаблону на поле: значение remark= может захватить "...&name", а name= все равно должен найтись
+_NAME_FIELDS = tuple(re.compile(rf'{name}="?([^"=,]+)') for name in ("name", "remark", "ps"))
+
+
+@dataclass(frozen=True)
+class ParsedConfig:
+    """Результат однократного разбора ссылки"""
+    raw: str  # ссылка без пробелов по краям
+    protocol: str = ""
+    host: str = ""
+    port: int = 0
+    remark: str = ""
+    tls: bool = False  # признаки TLS/Reality в самой ссылке (без учета порта)
+    sni: str = ""
+    # (start, end) значений name=/remark=/ps= в raw - места для замены имени сервера на флаг
+    name_spans: Tuple[Tuple[int, int], ...] = ()
+    canonical: str = ""  # хеш канонической формы без remark: одинаков у копий сервера из разных фидов
+
+    @property
+    def has_name_fields(self) -> bool:
+        return bool(self.name_spans)
+
+
+def _b64decode(encoded: str, urlsafe: bool = False) -> str:
+    encoded = encoded.strip()
+    encoded += "=" * (-len(encoded) % 4)
+    if urlsafe:
+        return base64.urlsafe_b64decode(encoded).decode("utf-8")
+    return base64.b64decode(encoded).decode("utf-8")
+
+
+def _parse_url(raw: str) -> Tuple[str, int, str, str]:
+    """host, port, remark, sni для vless/trojan/ss (SIP002)"""
+    parsed = urlparse(raw)
+    query = parse_qs(parsed.query)
+    sni = (query.get("sni") or query.get("peer") or [""])[0]
+    remark = unquote(parsed.fragment) if parsed.fragment else ""
+    return parsed.hostname or "", parsed.port or 443, remark, sni
+
+
+def _parse_vmess(raw: str) -> Tuple[str, int, str, str, bool]:
+    data = json.loads(_b64decode(raw[len("vmess://"):]))
+    tls_val = str(data.get("tls", "")).lower()
+    scy_val = str(data.get("scy", "")).lower()
+    tls = (
+        tls_val in ["tls", "reality", "1", "true"]
+        or scy_val in ["tls", "reality"]
+        or any(bool(data.get(k)) for k in ["sni", "alpn", "fp", "pbk"])
+    )
+    return data.get("add", ""), int(data.get("port", 443)), data.get("ps", ""), str(data.get("sni") or ""), tls
+
+
+def _parse_shadowsocks(raw: str) -> Tuple[str, int, str, str]:
+    body = raw[len("ss://"):].split("#", 1)[0].split("?", 1)[0].rstrip("/")
+    if "@" in body:
+        return _parse_url(raw)
+    # Старый формат: ss://BASE64(method:password@host:port)#remark
+    decoded = _b64decode(body)
+    host_port = decoded.rsplit("@", 1)[-1]
+    host, _, port = host_port.rpartition(":")
+    remark = unquote(raw.split("#", 1)[1]) if "#" in raw else ""
+    return host.strip("[]"), int(port), remark, ""
+
+
+def _parse_ssr(raw: str) -> Tuple[str, int]:
+    parts = _b64decode(raw[len("ssr://"):], urlsafe=True).split(":")
+    if len(parts) < 2:
+        return "", 0
+    return parts[0], int(parts[1])
+
+
+def _canonical_query(query: str) -> str:
+    pairs = [(k.lower(), v) for k, v in parse_qsl(query, keep_blank_values=False)]
+    return "&".join(f"{k}={v}" for k, v in sorted(pairs))
+
+
+def _canonical_url(raw: str, protocol: str, host: str, port: int) -> str:
+    parsed = urlparse(raw)
+    userinfo = unquote(parsed.netloc.rpartition("@")[0]) if "@" in parsed.netloc else ""
+    if protocol == "shadowsocks" and userinfo and ":" not in userinfo:
+        # SIP002: userinfo - base64url(method:password)
+        try:
+            userinfo = _b64decode(userinfo, urlsafe=True)
+        except Exception:
+            pass
+    return f"{protocol}|{userinfo}|{host}|{port}|{parsed.path.rstrip('/')}|{_canonical_query(parsed.query)}"
+
+
+def _canonical_vmess(raw: str) -> str:
+    data = json.loads(_b64decode(raw[len("vmess://"):]))
+    data.pop("ps", None)
+    normalized = {str(k).lower(): str(v) for k, v in data.items() if v not in ("", None)}
+    normalized["add"] = normalized.get("add", "").lower()
+    normalized["id"] = normalized.get("id", "").lower()
+    normalized.pop("v", None)
+    return "vmess|" + json.dumps(normalized, sort_keys=True, separators=(",", ":"))
+
+
+def canonical_form(raw: str, protocol: str, host: str, port: int) -> str:
+    """Каноническая форма ссылки: протокол, адрес, порт, учетные данные и транспорт без remark"""
+    try:
+        if protocol == "vmess":
+            return _canonical_vmess(raw)
+        if protocol in ("vless", "trojan") or (protocol == "shadowsocks" and "@" in raw.split("#", 1)[0]):
+            return _canonical_url(raw, protocol, host.lower(), port)
+        if protocol == "shadowsocks":
+            body = raw[len("ss://"):].split("#", 1)[0].split("?", 1)[0].rstrip("/")
+            return f"shadowsocks|{_b64decode(body).rsplit('@', 1)[0]}|{host.lower()}|{port}||"
+        if protocol == "ssr":
+            # remarks/group внутри base64 - ссылки сравниваются целиком
+            return "ssr|" + _b64decode(raw[len("ssr://"):], urlsafe=True)
+    except Exception:
+        pass
+    return raw.split("#", 1)[0]
+
+
+def parse_link(raw: str) -> ParsedConfig:
+    """Разбор ссылки без кеша"""
+    raw = (raw or "").strip()
+    protocol, host, port, remark, sni, tls = "", "", 0, "", "", False
+    try:
+        if raw.startswith("vless://"):
+            protocol = "vless"
+            host, port, remark, sni = _parse_url(raw)
+        elif raw.startswith("vmess://"):
+            protocol = "vmess"
+            host, port, remark, sni, tls = _parse_vmess(raw)
+        elif raw.startswith("trojan://"):
+            protocol = "trojan"
+            host, port, remark, sni = _parse_url(raw)
+            tls = True
+        elif raw.startswith("ss://"):
+            protocol = "shadowsocks"
+            host, port, remark, sni = _parse_shadowsocks(raw)
+        elif raw.startswith("ssr://"):
+            protocol = "ssr"
+            host, port = _parse_ssr(raw)
+    except Exception as e:
+        logger.debug(f"Failed to parse config {raw[:50]}: {e}")
+        host, port = "", 0
+
+    lowered = raw.lower()
+    return ParsedConfig(
+        raw=raw,
+        protocol=protocol,
+        host=host,
+        port=port,
+        remark=remark,
+        tls=tls or any(m in lowered for m in _TLS_MARKERS),
+        sni=sni,
+        name_spans=tuple(sorted({m.span(1) for pattern in _NAME_FIELDS for m in pattern.finditer(raw)})),
+        canonical=hashlib.blake2b(
+            canonical_form(raw, protocol, host, port).encode("utf-8"), digest_size=16
+        ).hexdigest(),
+    )
+
+
+class ParsedConfigCache:
+    """Ограниченный LRU разобранных ссылок, ключ - хеш ссылки"""
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, max_size)
+        self._entries: "OrderedDict[bytes, ParsedConfig]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(raw: str) -> bytes:
+        return hashlib.blake2b((raw or "").strip().encode("utf-8"), digest_size=16).digest()
+
+    def get(self, raw: str) -> ParsedConfig:
+        """Запись из кеша; при промахе ссылка разбирается и кешируется"""
+        key = self._key(raw)
+        with self._lock:
+            parsed = self._entries.get(key)
+            if parsed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return parsed
+            self.misses += 1
+
+        parsed = parse_link(raw)
+        with self._lock:
+            self._entries[key] = parsed
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return parsed
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+# Глобальный экземпляр кеша
+parsed_config_cache = ParsedConfigCache(app_config.XPERT_PARSE_CACHE_SIZE)
@@ -3,20 +3,23 @@
 Обход белого списка и прямая синхронизация с Marzban
 """
 
+import atexit
 import logging
-import json
-import os
 import base64
 import random
 import re
 import time
 import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import replace
 from typing import List, Optional, Dict
 from urllib.parse import quote, urlparse, urlunparse
 from datetime import datetime
 
 from app.xpert.models import DirectConfig
+from app.xpert.direct_config_store import DirectConfigStore
 from app.xpert.checker import checker
+import config as app_config
 
 logger = logging.getLogger(__name__)
 
@@ -27,14 +30,23 @@ class DirectConfigService:
     def __init__(self):
         self.storage_file = "data/direct_configs.json"
         self.configs: List[DirectConfig] = []
+        self._index: Dict[int, DirectConfig] = {}
         self.next_id = 1
         self._lock = threading.RLock()
+        self._store = DirectConfigStore(
+            "data/direct_configs.db",
+            snapshot=self._store_snapshot,
+            flush_delay=app_config.XPERT_DIRECT_FLUSH_DELAY_MS / 1000,
+        )
+        self._refresh_lock = threading.Lock()
         self._last_ping_refresh_ts = 0.0
         # Refresh pings in background every 30 minutes. Manual refresh can still force.
         self._ping_refresh_interval_sec = 30 * 60
         self._auto_ping_interval_sec = 30 * 60
         self._stop_event = threading.Event()
         self._load_configs()
+        self._store.start()
+        atexit.register(self._store.close)
         self._apply_auto_names(save=True)
         self._start_auto_ping()
 
@@ -53,48 +65,32 @@ class DirectConfigService:
             self._stop_event.wait(self._auto_ping_interval_sec)
     
     def _load_configs(self):
-        """Загрузка конфигураций из файла"""
+        """Загрузка конфигураций из хранилища (при первом запуске - импорт direct_configs.json)"""
         try:
-            os.makedirs(os.path.dirname(self.storage_file), exist_ok=True)
-            
-            if os.path.exists(self.storage_file):
-                with open(self.storage_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    
-                with self._lock:
-                    self.configs = [DirectConfig.from_dict(config_data) for config_data in data.get('configs', [])]
-                    self.next_id = data.get('next_id', 1)
-                
-                logger.info(f"Loaded {len(self.configs)} direct configs")
-            else:
-                with self._lock:
-                    self.configs = []
-                    self.next_id = 1
-                
+            configs, next_id = self._store.load(legacy_json=self.storage_file)
+            with self._lock:
+                self.configs = configs
+                self._index = {c.id: c for c in configs}
+                self.next_id = next_id
+            logger.info(f"Loaded {len(self.configs)} direct configs")
         except Exception as e:
             logger.error(f"Failed to load direct configs: {e}")
             with self._lock:
                 self.configs = []
+                self._index = {}
                 self.next_id = 1
-    
+
+    def _store_snapshot(self):
+        with self._lock:
+            return [config.to_dict() for config in self.configs], self.next_id
+
     def _save_configs(self):
-        """Сохранение конфигураций в файл"""
-        try:
-            os.makedirs(os.path.dirname(self.storage_file), exist_ok=True)
-            
-            with self._lock:
-                data = {
-                    'configs': [config.to_dict() for config in self.configs],
-                    'next_id': self.next_id
-                }
-            
-            with open(self.storage_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=2, ensure_ascii=False)
-                
-            logger.info(f"Saved {len(self.configs)} direct configs")
-            
-        except Exception as e:
-            logger.error(f"Failed to save direct configs: {e}")
+        """Отложенное сохранение: хранилище запишет только изменившиеся строки"""
+        self._store.schedule()
+
+    def flush(self) -> int:
+        """Немедленная запись накопленных изменений"""
+        return self._store.flush()
     
     _flag_codes = [
         "AE", "AZ", "BY", "BE", "BR", "CA", "CH", "CN", "CZ", "DE",
@@ -203,7 +199,9 @@ class DirectConfigService:
             )
             
             with self._lock:
+                config.id = self.next_id
                 self.configs.append(config)
+                self._index[config.id] = config
                 self.next_id += 1
             self._save_configs()
             self._apply_auto_names(save=True)
@@ -228,12 +226,12 @@ class DirectConfigService:
     def get_config_by_id(self, config_id: int) -> Optional[DirectConfig]:
         """Получение конфигурации по ID"""
         with self._lock:
-            return next((config for config in self.configs if config.id == config_id), None)
+            return self._index.get(config_id)
     
     def toggle_config(self, config_id: int) -> Optional[DirectConfig]:
         """Переключение статуса конфигурации"""
         with self._lock:
-            config = next((c for c in self.configs if c.id == config_id), None)
+            config = self._index.get(config_id)
             if config:
                 config.is_active = not config.is_active
                 self._save_configs()
@@ -243,7 +241,7 @@ class DirectConfigService:
     def delete_config(self, config_id: int) -> bool:
         """Удаление конфигурации"""
         with self._lock:
-            config = next((c for c in self.configs if c.id == config_id), None)
+            config = self._index.pop(config_id, None)
             if config:
                 self.configs.remove(config)
                 self._save_configs()
@@ -255,7 +253,7 @@ class DirectConfigService:
     def update_config(self, config_id: int, raw: Optional[str] = None, remarks: Optional[str] = None, added_by: Optional[str] = None) -> Optional[DirectConfig]:
         """Обновление прямой конфигурации"""
         with self._lock:
-            config = next((c for c in self.configs if c.id == config_id), None)
+            config = self._index.get(config_id)
             if not config:
                 return None
 
@@ -360,33 +358,64 @@ class DirectConfigService:
     def update_config_ping(self, config_id: int, ping_ms: float, packet_loss: float = 0.0):
         """Обновление пинга и потерь для конфигурации"""
         with self._lock:
-            config = next((c for c in self.configs if c.id == config_id), None)
+            config = self._index.get(config_id)
             if config:
                 config.ping_ms = ping_ms
                 config.packet_loss = packet_loss
                 self._save_configs()
 
-    def refresh_all_pings(self, force: bool = False) -> None:
-        """Переизмеряет ping/status для direct configs с ограничением частоты."""
+    def _probe_snapshot(self, snapshot: List[DirectConfig], force_probe: bool) -> Dict[int, tuple]:
+        """Параллельная проверка копий конфигов без блокировки сервиса: id -> (ok, ping_ms)"""
+        def probe(config: DirectConfig):
+            try:
+                return checker.probe_endpoint_sync(
+                    config.raw, config.protocol, config.server, config.port, timeout=2.5, force=force_probe
+                )
+            except Exception as e:
+                logger.debug(f"Ping refresh failed for config {config.id}: {e}")
+                return None
+
+        workers = max(1, min(app_config.XPERT_DIRECT_PING_CONCURRENCY, len(snapshot)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="direct-ping") as executor:
+            results = executor.map(probe, snapshot)
+            return {config.id: result for config, result in zip(snapshot, results) if result is not None}
+
+    def refresh_all_pings(self, force: bool = False, force_probe: bool = False) -> None:
+        """Переизмеряет ping/status для direct configs с ограничением частоты.
+
+        force - без ограничения частоты; force_probe - мимо общего кеша замеров (probe_cache).
+        Проверки идут параллельно вне self._lock, результаты применяются одним коротким блоком.
+        """
         now = time.time()
         if not force and (now - self._last_ping_refresh_ts) < self._ping_refresh_interval_sec:
             return
 
-        disabled_ids: List[int] = []
-        changed = False
-        with self._lock:
-            for config in self.configs:
-                try:
-                    prev_active = bool(config.is_active)
-                    ok, ping_ms = checker.probe_endpoint_sync(
-                        config.raw, config.protocol, config.server, config.port, timeout=2.5
-                    )
+        # Одно обновление за раз; параллельный вызов ждет его и делает свое
+        with self._refresh_lock:
+            if not force and (time.time() - self._last_ping_refresh_ts) < self._ping_refresh_interval_sec:
+                return
+            self._last_ping_refresh_ts = now
+
+            with self._lock:
+                snapshot = [replace(c) for c in self.configs]
+            results = self._probe_snapshot(snapshot, force_probe)
+
+            changed = False
+            with self._lock:
+                for before in snapshot:
+                    config = self._index.get(before.id)
+                    result = results.get(before.id)
+                    if config is None or result is None:
+                        continue  # удален за время проверки или проверка упала
+                    if config.raw != before.raw and checker.fingerprint(config.raw) != checker.fingerprint(before.raw):
+                        # Ссылку изменили за время проверки - результат относится к старой
+                        # (смена одного имени при автонумерации результат не отменяет)
+                        continue
+                    ok, ping_ms = result
                     new_ping = float(ping_ms if ok else 999.0)
                     new_loss = 0.0 if ok else 100.0
-                    new_active = bool(ok)
-
-                    if prev_active and not new_active:
-                        disabled_ids.append(config.id)
+                    # Статус, переключенный вручную за время проверки, не перезаписывается
+                    new_active = bool(ok) if config.is_active == before.is_active else config.is_active
 
                     if (
                         config.ping_ms != new_ping
@@ -397,21 +426,18 @@ class DirectConfigService:
                         config.packet_loss = new_loss
                         config.is_active = new_active
                         changed = True
-                except Exception as e:
-                    logger.debug(f"Ping refresh failed for config {config.id}: {e}")
-
-            # Ensure all inactive configs (including ping=999) are grouped at the bottom.
-            # This guarantees "disabled configs go to the end" even if they were disabled earlier.
-            active_list = [c for c in self.configs if bool(c.is_active)]
-            inactive_list = [c for c in self.configs if not bool(c.is_active)]
-            new_list = active_list + inactive_list
-            if [c.id for c in new_list] != [c.id for c in self.configs]:
-                self.configs = new_list
-                changed = True
-
-        self._last_ping_refresh_ts = now
-        if changed:
-            self._save_configs()
+
+                # Ensure all inactive configs (including ping=999) are grouped at the bottom.
+                # This guarantees "disabled configs go to the end" even if they were disabled earlier.
+                active_list = [c for c in self.configs if bool(c.is_active)]
+                inactive_list = [c for c in self.configs if not bool(c.is_active)]
+                new_list = active_list + inactive_list
+                if [c.id for c in new_list] != [c.id for c in self.configs]:
+                    self.configs = new_list
+                    changed = True
+
+            if changed:
+                self._save_configs()
     
     def get_configs_for_subscription(self) -> List[DirectConfig]:
         """Получение конфигураций для подписки (только активные)"""
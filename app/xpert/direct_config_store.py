@@ -0,0 +1,273 @@
+"""
+Хранилище прямых конфигураций (SQLite)
+Строки с явным sort_key и отложенная запись: сохраняются только изменившиеся строки
+"""
+
+import bisect
+import json
+import logging
+import os
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Float,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    create_engine,
+    delete,
+    insert,
+    select,
+    update,
+)
+
+from app.xpert.models import DirectConfig
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+direct_configs_table = Table(
+    "xpert_direct_configs",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("sort_key", Float, nullable=False, index=True),
+    Column("raw", Text, nullable=False),
+    Column("protocol", String(32), nullable=False, default=""),
+    Column("server", String(255), nullable=False, default=""),
+    Column("port", Integer, nullable=False, default=0),
+    Column("remarks", Text, nullable=False, default=""),
+    Column("ping_ms", Float, nullable=False, default=999.0),
+    Column("jitter_ms", Float, nullable=False, default=0.0),
+    Column("packet_loss", Float, nullable=False, default=0.0),
+    Column("is_active", Boolean, nullable=False, default=True, index=True),
+    Column("bypass_whitelist", Boolean, nullable=False, default=True),
+    Column("auto_sync_to_marzban", Boolean, nullable=False, default=True),
+    Column("added_at", String(64), nullable=False, default=""),
+    Column("added_by", String(255), nullable=False, default="admin"),
+)
+
+direct_meta_table = Table(
+    "xpert_direct_meta",
+    metadata,
+    Column("key", String(64), primary_key=True),
+    Column("value", Text, nullable=False),
+)
+
+# Шаг sort_key при перенумерации; между соседями помещается ~50 вставок до следующей
+KEY_STEP = 1024.0
+MIN_KEY_GAP = 1e-9
+
+Snapshot = Tuple[List[dict], int]
+
+
+def _stable_rows(keys: List[Optional[float]]) -> set:
+    """Индексы строк, чьи sort_key уже идут по возрастанию (наибольшая возрастающая подпоследовательность).
+
+    Остальные строки получают новые ключи - при перемещении одной строки это только она.
+    """
+    tails: List[float] = []
+    tail_index: List[int] = []
+    parent: List[int] = [-1] * len(keys)
+    for i, key in enumerate(keys):
+        if key is None:
+            continue
+        pos = bisect.bisect_left(tails, key)
+        if pos == len(tails):
+            tails.append(key)
+            tail_index.append(i)
+        else:
+            tails[pos] = key
+            tail_index[pos] = i
+        parent[i] = tail_index[pos - 1] if pos else -1
+    stable = set()
+    i = tail_index[-1] if tail_index else -1
+    while i != -1:
+        stable.add(i)
+        i = parent[i]
+    return stable
+
+
+class DirectConfigStore:
+    """Строки direct configs в SQLite; flush() пишет одной транзакцией только отличия от записанного"""
+
+    def __init__(self, db_path: str, snapshot: Callable[[], Snapshot], flush_delay: float = 0.5):
+        self.db_path = db_path
+        # snapshot() - (конфиги по порядку в виде dict, next_id), снимается под блокировкой сервиса
+        self._snapshot = snapshot
+        self.flush_delay = flush_delay
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False})
+        metadata.create_all(self.engine)
+        # id -> (sort_key, записанная строка)
+        self._persisted: Dict[int, Tuple[float, dict]] = {}
+        self._persisted_next_id = 0
+        self._flush_lock = threading.Lock()
+        self._dirty = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.writes = 0
+
+    def load(self, legacy_json: Optional[str] = None) -> Tuple[List[DirectConfig], int]:
+        """Конфиги по sort_key и next_id; при пустой таблице однократно импортирует legacy JSON"""
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(direct_configs_table).order_by(direct_configs_table.c.sort_key)).all()
+            meta = dict(conn.execute(select(direct_meta_table)).all())
+
+        if not rows and legacy_json and "imported_at" not in meta and os.path.exists(legacy_json):
+            return self._import_json(legacy_json)
+
+        configs = []
+        for row in rows:
+            data = dict(row._mapping)
+            sort_key = data.pop("sort_key")
+            config = DirectConfig.from_dict(data)
+            configs.append(config)
+            self._persisted[config.id] = (sort_key, config.to_dict())
+        next_id = int(meta.get("next_id", max((c.id for c in configs), default=0) + 1))
+        self._persisted_next_id = next_id
+        return configs, next_id
+
+    def _import_json(self, path: str) -> Tuple[List[DirectConfig], int]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            configs = [DirectConfig.from_dict(d) for d in data.get("configs", [])]
+            next_id = int(data.get("next_id", max((c.id for c in configs), default=0) + 1))
+        except Exception as e:
+            logger.error(f"Failed to import direct configs from {path}: {e}")
+            return [], 1
+
+        with self._flush_lock, self.engine.begin() as conn:
+            if configs:
+                conn.execute(insert(direct_configs_table), [
+                    {**c.to_dict(), "sort_key": (i + 1) * KEY_STEP} for i, c in enumerate(configs)
+                ])
+            conn.execute(insert(direct_meta_table), [
+                {"key": "next_id", "value": str(next_id)},
+                {"key": "imported_at", "value": datetime.utcnow().isoformat()},
+            ])
+            for i, config in enumerate(configs):
+                self._persisted[config.id] = ((i + 1) * KEY_STEP, config.to_dict())
+            self._persisted_next_id = next_id
+        logger.info(f"Imported {len(configs)} direct configs from {path}")
+        return configs, next_id
+
+    def start(self):
+        """Фоновая запись: изменения копятся flush_delay секунд и пишутся одной транзакцией"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, name="direct-configs-flush", daemon=True)
+            self._thread.start()
+
+    def schedule(self):
+        """Отметить, что в памяти есть незаписанные изменения"""
+        self._dirty.set()
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._dirty.wait()
+            if self._stop.wait(self.flush_delay):
+                break
+            self._dirty.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush direct configs: {e}")
+                self._dirty.set()
+
+    def close(self):
+        """Остановка фоновой записи с финальным flush"""
+        self._stop.set()
+        self._dirty.set()
+        self.flush()
+
+    def _assign_keys(self, rows: List[dict]) -> List[float]:
+        """sort_key для строк в текущем порядке; меняются только ключи строк, нарушающих порядок"""
+        keys = [self._persisted[r["id"]][0] if r["id"] in self._persisted else None for r in rows]
+        stable = _stable_rows(keys)
+        result: List[float] = list(keys)
+        i = 0
+        while i < len(rows):
+            if i in stable:
+                i += 1
+                continue
+            # Серия строк без ключа между двумя стабильными соседями
+            start = i
+            while i < len(rows) and i not in stable:
+                i += 1
+            low = result[start - 1] if start > 0 else None
+            high = result[i] if i < len(rows) else None
+            count = i - start
+            for offset in range(count):
+                if low is None and high is None:
+                    result[start + offset] = (offset + 1) * KEY_STEP
+                elif high is None:
+                    result[start + offset] = low + (offset + 1) * KEY_STEP
+                elif low is None:
+                    result[start + offset] = high - (count - offset) * KEY_STEP
+                else:
+                    result[start + offset] = low + (high - low) * (offset + 1) / (count + 1)
+            if low is not None and high is not None and (high - low) / (count + 1) < MIN_KEY_GAP:
+                # Ключи исчерпались: перенумерация всех строк
+                return [(n + 1) * KEY_STEP for n in range(len(rows))]
+        return result
+
+    def flush(self) -> int:
+        """Запись отличий от последнего flush; возвращает число затронутых строк"""
+        with self._flush_lock:
+            rows, next_id = self._snapshot()
+            keys = self._assign_keys(rows)
+            current_ids = set()
+            inserts, updates = [], []
+            for row, key in zip(rows, keys):
+                current_ids.add(row["id"])
+                persisted = self._persisted.get(row["id"])
+                if persisted is None:
+                    inserts.append({**row, "sort_key": key})
+                elif persisted[0] != key or persisted[1] != row:
+                    updates.append({**row, "sort_key": key})
+            deleted = [config_id for config_id in self._persisted if config_id not in current_ids]
+            if not inserts and not updates and not deleted and next_id == self._persisted_next_id:
+                return 0
+
+            with self.engine.begin() as conn:
+                if deleted:
+                    conn.execute(delete(direct_configs_table).where(direct_configs_table.c.id.in_(deleted)))
+                if inserts:
+                    conn.execute(insert(direct_configs_table), inserts)
+                for values in updates:
+                    conn.execute(
+                        update(direct_configs_table)
+                        .where(direct_configs_table.c.id == values["id"])
+                        .values(**values)
+                    )
+                if next_id != self._persisted_next_id:
+                    result = conn.execute(
+                        update(direct_meta_table)
+                        .where(direct_meta_table.c.key == "next_id")
+                        .values(value=str(next_id))
+                    )
+                    if not result.rowcount:
+                        conn.execute(insert(direct_meta_table).values(key="next_id", value=str(next_id)))
+
+            for config_id in deleted:
+                del self._persisted[config_id]
+            for values in inserts + updates:
+                data = dict(values)
+                key = data.pop("sort_key")
+                self._persisted[data["id"]] = (key, data)
+            self._persisted_next_id = next_id
+            touched = len(inserts) + len(updates) + len(deleted)
+            self.writes += touched
+            logger.debug(
+                f"Flushed direct configs: +{len(inserts)} ~{len(updates)} -{len(deleted)}"
+            )
+            return touched
@@ -0,0 +1,152 @@
+"""
+Общий кеш DNS для Xpert
+Асинхронное разрешение с положительным/отрицательным TTL; синхронные читатели не блокируются
+"""
+
+import asyncio
+import ipaddress
+import logging
+import socket
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, Optional, Tuple
+
+import config as app_config
+
+logger = logging.getLogger(__name__)
+
+
+class DnsCache:
+    """Кеш разрешения имен, общий для checker, GeoService и HostFilter"""
+
+    def __init__(self):
+        self.positive_ttl = app_config.XPERT_DNS_TTL
+        self.negative_ttl = app_config.XPERT_DNS_NEGATIVE_TTL
+        self.max_size = max(1, app_config.XPERT_DNS_CACHE_SIZE)
+        # host -> (address или None для отрицательного ответа, время истечения); LRU-порядок
+        self._entries: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self._pending: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="xpert-dns")
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _is_ip(host: str) -> bool:
+        try:
+            ipaddress.ip_address(host)
+            return True
+        except ValueError:
+            return False
+
+    def _lookup(self, host: str) -> Tuple[bool, Optional[str]]:
+        """(найдено в кеше, адрес); считает попадания и промахи"""
+        with self._lock:
+            entry = self._entries.get(host)
+            if entry and entry[1] > time.monotonic():
+                self._entries.move_to_end(host)
+                self.hits += 1
+                return True, entry[0]
+            self.misses += 1
+            return False, None
+
+    def _resolve_now(self, host: str) -> Optional[str]:
+        try:
+            infos = socket.getaddrinfo(host, None, type=socket.SOCK_STREAM)
+        except Exception:
+            infos = []
+        # IPv4 в приоритете: с ним сравниваются белые списки и работают sync-проверки.
+        address = next((i[4][0] for i in infos if i[0] == socket.AF_INET), None)
+        if address is None and infos:
+            address = infos[0][4][0]
+
+        ttl = self.positive_ttl if address else self.negative_ttl
+        with self._lock:
+            self._entries[host] = (address, time.monotonic() + ttl)
+            self._entries.move_to_end(host)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+            self._pending.pop(host, None)
+        return address
+
+    def _submit(self, host: str) -> Future:
+        """Одно разрешение на хост одновременно, независимо от потока и event loop"""
+        with self._lock:
+            future = self._pending.get(host)
+            if future is None:
+                future = self._executor.submit(self._resolve_now, host)
+                self._pending[host] = future
+            return future
+
+    @staticmethod
+    def _normalize(host: str) -> str:
+        return (host or "").strip().strip("[]").lower()
+
+    async def resolve(self, host: str) -> Optional[str]:
+        """Асинхронное разрешение с использованием кеша"""
+        host = self._normalize(host)
+        if not host:
+            return None
+        if self._is_ip(host):
+            return host
+        found, address = self._lookup(host)
+        if found:
+            return address
+        return await asyncio.wrap_future(self._submit(host))
+
+    def resolve_blocking(self, host: str, timeout: float = 3.0) -> Optional[str]:
+        """Синхронное разрешение с кешем для фоновых потоков и sync-проверок"""
+        host = self._normalize(host)
+        if not host:
+            return None
+        if self._is_ip(host):
+            return host
+        found, address = self._lookup(host)
+        if found:
+            return address
+        try:
+            return self._submit(host).result(timeout=timeout)
+        except Exception:
+            return None
+
+    def peek(self, host: str) -> Optional[str]:
+        """Адрес из кеша без ожидания; при промахе разрешение запускается в фоне"""
+        host = self._normalize(host)
+        if not host:
+            return None
+        if self._is_ip(host):
+            return host
+        found, address = self._lookup(host)
+        if not found:
+            self._submit(host)
+        return address
+
+    async def prefetch(self, hosts: Iterable[str]) -> Dict[str, Optional[str]]:
+        """Пакетное разрешение хостов (например, в начале агрегации)"""
+        unique = list({h for h in hosts if h})
+        started = time.perf_counter()
+        resolved = await asyncio.gather(*(self.resolve(h) for h in unique))
+        if unique:
+            logger.info(
+                f"DNS prefetch: {len(unique)} hosts in {time.perf_counter() - started:.1f}s "
+                f"({self.hits} hits / {self.misses} misses total)"
+            )
+        return dict(zip(unique, resolved))
+
+    def get_stats(self) -> dict:
+        """Счетчики попаданий/промахов кеша"""
+        with self._lock:
+            now = time.monotonic()
+            live = [a for a, expires in self._entries.values() if expires > now]
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(live),
+                "negative_entries": len([a for a in live if a is None]),
+            }
+
+
+# Глобальный экземпляр кеша
+dns_cache = DnsCache()
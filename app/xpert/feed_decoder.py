@@ -0,0 +1,210 @@
+"""
+Потоковый декодер тела подписки
+Обычный текст, base64 и gzip разбираются по частям, без буферизации всего тела
+"""
+
+import base64
+import binascii
+import logging
+import zlib
+from typing import Iterable, Iterator, List
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PREFIXES = ("vless://", "vmess://", "trojan://", "ss://", "ssr://")
+
+_BASE64_ALPHABET = frozenset(
+    b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=-_"
+)
+_URLSAFE_TO_STD = bytes.maketrans(b"-_", b"+/")
+_GZIP_MAGIC = b"\x1f\x8b"
+# Сколько байт смотреть, чтобы отличить base64 от обычного списка ссылок
+_SNIFF_BYTES = 4096
+# Короткая первая строка из "base64-символов" скорее заголовок обычного списка
+_MIN_BASE64_LINE = 16
+# Порция распаковки gzip: защищает от "gzip-бомб"
+_INFLATE_CHUNK = 64 * 1024
+
+
+class FeedDecoder:
+    """Инкрементальный разбор подписки: feed() принимает байты и возвращает готовые ссылки.
+
+    Лимиты считаются по распакованным данным. При превышении max_bytes или max_lines
+    разбор останавливается, уже найденные ссылки сохраняются, выставляется truncated.
+    """
+
+    def __init__(self, max_bytes: int, max_lines: int, max_line_length: int = 64 * 1024):
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.max_line_length = max_line_length
+        self.bytes_read = 0
+        self.lines = 0
+        self.truncated = False
+        self.mode = None  # plain | base64
+        self._sniffed_gzip = False
+        self._magic = b""
+        self._gzip = None
+        self._head = bytearray()
+        self._b64 = bytearray()
+        self._line = bytearray()
+        self._skip_line = False
+        self._out: List[str] = []
+
+    def feed(self, chunk: bytes) -> List[str]:
+        """Обработка очередной части тела"""
+        if chunk and not self.truncated:
+            self._feed(chunk)
+        return self._take()
+
+    def close(self) -> List[str]:
+        """Завершение разбора: дочитываются хвосты буферов"""
+        if not self.truncated:
+            if not self._sniffed_gzip and self._magic:
+                self._sniffed_gzip = True
+                self._accept(self._magic)
+            if self._gzip is not None:
+                try:
+                    self._accept(self._gzip.flush())
+                except zlib.error as e:
+                    logger.warning(f"Truncated gzip feed: {e}")
+            if self.mode is None and self._head:
+                self._decide_mode(final=True)
+                head = bytes(self._head)
+                self._head.clear()
+                self._decode(head)
+            if self.mode == "base64" and self._b64:
+                tail = bytes(self._b64)
+                self._b64.clear()
+                self._decode_base64(tail + b"=" * (-len(tail) % 4))
+            if self._line and not self._skip_line:
+                self._emit(bytes(self._line))
+        self._line.clear()
+        return self._take()
+
+    def _take(self) -> List[str]:
+        out, self._out = self._out, []
+        return out
+
+    def _feed(self, chunk: bytes):
+        if not self._sniffed_gzip:
+            self._magic += chunk
+            if len(self._magic) < len(_GZIP_MAGIC):
+                return
+            chunk, self._magic = self._magic, b""
+            self._sniffed_gzip = True
+            if chunk.startswith(_GZIP_MAGIC):
+                self._gzip = zlib.decompressobj(wbits=31)
+
+        if self._gzip is None:
+            self._accept(chunk)
+            return
+
+        try:
+            data = self._gzip.decompress(chunk, _INFLATE_CHUNK)
+            self._accept(data)
+            while self._gzip.unconsumed_tail and not self.truncated:
+                data = self._gzip.decompress(self._gzip.unconsumed_tail, _INFLATE_CHUNK)
+                self._accept(data)
+        except zlib.error as e:
+            logger.warning(f"Invalid gzip feed: {e}")
+            self.truncated = True
+
+    def _accept(self, data: bytes):
+        """Учет лимита размера и передача данных в декодер формата"""
+        if not data or self.truncated:
+            return
+        allowed = self.max_bytes - self.bytes_read
+        if len(data) > allowed:
+            data = data[:max(0, allowed)]
+            self.bytes_read += len(data)
+            self._decode(data)
+            logger.warning(f"Feed exceeds {self.max_bytes} bytes, truncated")
+            self.truncated = True
+            return
+        self.bytes_read += len(data)
+        self._decode(data)
+
+    def _decode(self, data: bytes):
+        if self.mode is None:
+            self._head += data
+            if not self._decide_mode(final=False):
+                return
+            data = bytes(self._head)
+            self._head.clear()
+
+        if self.mode == "plain":
+            self._split(data)
+        elif self.mode == "base64":
+            self._b64 += data.translate(_URLSAFE_TO_STD, b" \t\r\n")
+            usable = len(self._b64) - len(self._b64) % 4
+            if usable:
+                block = bytes(self._b64[:usable])
+                del self._b64[:usable]
+                self._decode_base64(block)
+
+    def _decide_mode(self, final: bool) -> bool:
+        """Формат определяется по первой непустой строке"""
+        head = bytes(self._head).lstrip()
+        newline = head.find(b"\n")
+        if newline < 0 and not final and len(head) < _SNIFF_BYTES:
+            return False
+        first = (head if newline < 0 else head[:newline]).strip()[:_SNIFF_BYTES]
+        if not first:
+            if not final:
+                return False
+            self.mode = "plain"
+        elif (b"://" in first or len(first) < _MIN_BASE64_LINE
+              or any(b not in _BASE64_ALPHABET for b in first)):
+            self.mode = "plain"
+        else:
+            self.mode = "base64"
+            logger.debug("Detected base64 feed")
+        return True
+
+    def _decode_base64(self, block: bytes):
+        try:
+            decoded = base64.b64decode(block)
+        except (binascii.Error, ValueError) as e:
+            logger.warning(f"Base64 feed decode failed: {e}")
+            self.truncated = True
+            return
+        self._split(decoded)
+
+    def _split(self, data: bytes):
+        start = 0
+        while start < len(data) and not self.truncated:
+            newline = data.find(b"\n", start)
+            end = len(data) if newline < 0 else newline
+            if not self._skip_line:
+                self._line += data[start:end]
+                if len(self._line) > self.max_line_length:
+                    self._line.clear()
+                    self._skip_line = True
+            if newline < 0:
+                return
+            if not self._skip_line:
+                self._emit(bytes(self._line))
+            self._line.clear()
+            self._skip_line = False
+            start = newline + 1
+
+    def _emit(self, line: bytes):
+        text = line.decode("utf-8", "ignore").strip()
+        if not text.startswith(CONFIG_PREFIXES):
+            return
+        if self.lines >= self.max_lines:
+            logger.warning(f"Feed exceeds {self.max_lines} configs, truncated")
+            self.truncated = True
+            return
+        self.lines += 1
+        self._out.append(text)
+
+
+def decode_feed(chunks: Iterable[bytes], max_bytes: int, max_lines: int) -> Iterator[str]:
+    """Разбор уже полученных частей тела (например, из файла или строки)"""
+    decoder = FeedDecoder(max_bytes, max_lines)
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+        if decoder.truncated:
+            break
+    yield from decoder.close()
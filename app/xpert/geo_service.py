@@ -1,9 +1,10 @@
 import re
-import socket
 from typing import Optional, Dict
 import requests
 import logging
 
+from app.xpert.dns_cache import dns_cache
+
 logger = logging.getLogger(__name__)
 
 class GeoService:
@@ -80,11 +81,8 @@ class GeoService:
         }
 
     def get_server_ip(self, server: str) -> Optional[str]:
-        """Получить IP адрес сервера по доменному имени"""
-        try:
-            return socket.gethostbyname(server)
-        except:
-            return None
+        """Получить IP адрес сервера по доменному имени (только из DNS-кеша, без ожидания)"""
+        return dns_cache.peek(server)
 
     def get_country_info(self, server: str) -> Dict[str, str]:
         """Получить информацию о стране сервера"""
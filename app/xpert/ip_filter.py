@@ -1,8 +1,8 @@
 import logging
-import re
 from typing import List, Set
-from urllib.parse import urlparse
 from app.xpert.cluster_service import whitelist_service
+from app.xpert.config_parser import parsed_config_cache
+from app.xpert.dns_cache import dns_cache
 
 logger = logging.getLogger(__name__)
 
@@ -11,88 +11,23 @@ class HostFilter:
     
     def __init__(self):
         self.allowed_hosts: Set[str] = set()
+        self.allowed_addresses: Set[str] = set()
     
     def update_allowed_hosts(self):
         """Обновляет кэш разрешенных хостов"""
         self.allowed_hosts = whitelist_service.get_all_allowed_hosts()
+        # Адреса доменов из белого списка берутся только из DNS-кеша, без ожидания.
+        self.allowed_addresses = {
+            address for address in (dns_cache.peek(h) for h in self.allowed_hosts) if address
+        }
         logger.info(f"Updated allowed hosts cache: {len(self.allowed_hosts)} hosts")
     
     def extract_address_from_config(self, config: str) -> str:
         """Извлекает address (IP или домен) из конфигурации"""
-        try:
-            # Пробуем разные форматы конфигов
-            
-            # VLESS/VLESS/TROJAN: vless://uuid@ADDRESS:PORT?...
-            if config.startswith(('vless://', 'trojan://')):
-                match = re.search(r'@([^:]+):', config)
-                if match:
-                    address = match.group(1)
-                    logger.debug(f"Extracted address {address} from VLESS/Trojan config")
-                    return address
-            
-            # VMESS: vmess://BASE64
-            elif config.startswith('vmess://'):
-                import base64
-                try:
-                    decoded = base64.b64decode(config[8:]).decode('utf-8')
-                    data = eval(decoded)  # В реальном коде нужно использовать json.loads
-                    address = data.get('add', '')
-                    if address:
-                        logger.debug(f"Extracted address {address} from VMESS config")
-                        return address
-                except:
-                    pass
-            
-            # Shadowsocks: ss://BASE64
-            elif config.startswith('ss://'):
-                import base64
-                try:
-                    # Убираем префикс и декодируем
-                    encoded = config[5:]
-                    if encoded.endswith('/'):
-                        encoded = encoded[:-1]
-                    
-                    # Добавляем padding если нужно
-                    padding_needed = len(encoded) % 4
-                    if padding_needed:
-                        encoded += '=' * (4 - padding_needed)
-                    
-                    decoded = base64.b64decode(encoded).decode('utf-8')
-                    
-                    # Формат: method:password@ADDRESS:PORT
-                    if '@' in decoded:
-                        match = re.search(r'@([^:]+):', decoded)
-                        if match:
-                            address = match.group(1)
-                            logger.debug(f"Extracted address {address} from SS config")
-                            return address
-                except:
-                    pass
-            
-            # SSR: ssr://BASE64
-            elif config.startswith('ssr://'):
-                import base64
-                try:
-                    encoded = config[6:]
-                    padding_needed = len(encoded) % 4
-                    if padding_needed:
-                        encoded += '=' * (4 - padding_needed)
-                    
-                    decoded = base64.urlsafe_b64decode(encoded).decode('utf-8')
-                    parts = decoded.split(':')
-                    if len(parts) >= 2:
-                        address = parts[0]
-                        logger.debug(f"Extracted address {address} from SSR config")
-                        return address
-                except:
-                    pass
-            
+        address = parsed_config_cache.get(config).host
+        if not address:
             logger.warning(f"Could not extract address from config: {config[:50]}...")
-            return ""
-            
-        except Exception as e:
-            logger.error(f"Error extracting address from config: {e}")
-            return ""
+        return address
     
     def is_address_allowed(self, address: str) -> bool:
         """Проверяет разрешен ли address (IP или домен)"""
@@ -103,7 +38,12 @@ class HostFilter:
         if not self.allowed_hosts:
             self.update_allowed_hosts()
         
-        return address in self.allowed_hosts
+        if address in self.allowed_hosts:
+            return True
+
+        # Домен из конфига против IP в белом списке и наоборот (по DNS-кешу)
+        resolved = dns_cache.peek(address)
+        return bool(resolved) and (resolved in self.allowed_hosts or resolved in self.allowed_addresses)
     
     def filter_servers(self, server_configs: List[str]) -> List[str]:
         """Фильтрует сервера, оставляя только с разрешенными адресами"""
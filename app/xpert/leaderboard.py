@@ -0,0 +1,175 @@
+"""
+Рейтинг активных конфигов для /top-configs и /queue-configs
+Отсортированный индекс по score обновляется точечно: пересчитываются только endpoint'ы с новыми отчетами
+"""
+
+import bisect
+import heapq
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from app.xpert.models import AggregatedConfig
+from app.xpert.ping_stats import PingStatsService, StatKey, ping_stats_service
+from app.xpert.snapshot import ActiveConfigSnapshot, active_snapshots
+import config as app_config
+
+logger = logging.getLogger(__name__)
+
+# (-score, позиция в снимке): по убыванию score, при равенстве - порядок снимка (по пингу)
+RankKey = Tuple[float, int]
+
+
+class ConfigLeaderboard:
+    """Рейтинг конфигов текущего снимка; ответы кешируются по версии (снимок.ревизия рейтинга)"""
+
+    def __init__(self, snapshot_source: Callable[[], ActiveConfigSnapshot], stats: PingStatsService):
+        self._snapshot_source = snapshot_source
+        self._stats = stats
+        self._lock = threading.Lock()
+        self._snapshot: Optional[ActiveConfigSnapshot] = None
+        self._revision = 0
+        self._ranked: List[RankKey] = []  # только конфиги, прошедшие фильтр здоровья
+        self._keys: Dict[int, RankKey] = {}  # позиция -> ключ в _ranked
+        self._scores: Dict[int, float] = {}
+        self._by_endpoint: Dict[StatKey, List[int]] = {}
+        self._health: Dict[StatKey, Dict] = {}
+        self._cache: Dict[object, dict] = {}
+        # (момент устаревания статистики, endpoint): без новых отчетов score меняется только в этот момент
+        self._expiry: List[Tuple[float, StatKey]] = []
+        # Endpoint'ы с новыми отчетами; отдельная блокировка - слушатель вызывается под блокировкой статистики
+        self._dirty: Set[StatKey] = set()
+        self._dirty_lock = threading.Lock()
+        stats.add_listener(self._mark_dirty)
+
+    def _mark_dirty(self, key: StatKey):
+        with self._dirty_lock:
+            self._dirty.add(key)
+
+    @property
+    def version(self) -> str:
+        return f"{self._snapshot.version if self._snapshot else 0}.{self._revision}"
+
+    def _score(self, config: AggregatedConfig, health: Dict) -> float:
+        """Score как в PingStatsService.get_top_configs; -1 - конфиг не проходит фильтр здоровья"""
+        if health['healthy'] is None:
+            # Нет статистики - используем оригинальные метрики
+            return self._stats._calculate_original_score(config) if config.is_active else -1
+        if health['healthy']:
+            return self._stats._calculate_stats_score(health, config)
+        return -1
+
+    def _rescore(self, key: StatKey):
+        """Пересчет конфигов одного endpoint'а и их мест в индексе"""
+        positions = self._by_endpoint.get(key)
+        if not positions:
+            return
+        health = self._stats.get_server_health(*key, min_users=app_config.XPERT_MIN_USERS_FOR_STATS)
+        self._health[key] = health
+        expires_at = self._stats.health_expires_at(*key)
+        if expires_at is not None and health['healthy'] is not None:
+            heapq.heappush(self._expiry, (expires_at, key))
+        dynamic = app_config.XPERT_USE_DYNAMIC_FILTERING
+        for position in positions:
+            config = self._snapshot.configs[position]
+            score = self._score(config, health)
+            self._scores[position] = score
+            old_key = self._keys.pop(position, None)
+            if old_key is not None:
+                del self._ranked[bisect.bisect_left(self._ranked, old_key)]
+            if not dynamic:
+                # Без динамической фильтрации порядок снимка, score только для отображения
+                new_key = (0.0, position)
+            elif score > 0:
+                new_key = (-score, position)
+            else:
+                continue
+            bisect.insort(self._ranked, new_key)
+            self._keys[position] = new_key
+
+    def _rebuild(self, snapshot: ActiveConfigSnapshot):
+        self._snapshot = snapshot
+        self._ranked, self._keys, self._scores, self._health = [], {}, {}, {}
+        self._by_endpoint = {}
+        self._expiry = []
+        for position, config in enumerate(snapshot.configs):
+            self._by_endpoint.setdefault((config.server, config.port, config.protocol), []).append(position)
+        with self._dirty_lock:
+            self._dirty.clear()
+        for key in self._by_endpoint:
+            self._rescore(key)
+        logger.debug(f"Leaderboard rebuilt for snapshot v{snapshot.version}: {len(self._ranked)} ranked")
+
+    def _sync(self):
+        """Догоняет текущий снимок и накопленные отчеты (вызывается под self._lock)"""
+        snapshot = self._snapshot_source()
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        now = time.time()
+        while self._expiry and self._expiry[0][0] <= now:
+            dirty.add(heapq.heappop(self._expiry)[1])
+        if self._snapshot is None or snapshot.version != self._snapshot.version:
+            self._rebuild(snapshot)
+        elif dirty:
+            for key in dirty:
+                self._rescore(key)
+            if len(self._expiry) > 4 * len(self._by_endpoint) + 16:
+                # Пересчеты оставляют устаревшие записи; при разрастании кучи - только последние по endpoint'у
+                latest = {}
+                for expires_at, key in self._expiry:
+                    latest[key] = max(expires_at, latest.get(key, 0.0))
+                self._expiry = [(expires_at, key) for key, expires_at in latest.items()]
+                heapq.heapify(self._expiry)
+        else:
+            return
+        self._revision += 1
+        self._cache = {}
+
+    def _entry(self, position: int) -> dict:
+        config = self._snapshot.configs[position]
+        return {
+            "id": config.id,
+            "protocol": config.protocol,
+            "server": config.server,
+            "port": config.port,
+            "remarks": config.remarks,
+            "ping_ms": config.ping_ms,
+            "packet_loss": config.packet_loss,
+            "is_active": config.is_active,
+            "score": round(max(self._scores[position], 0), 2),
+            "health": self._health[(config.server, config.port, config.protocol)]
+        }
+
+    def get_top(self, limit: int) -> dict:
+        """Топ-N с score; повторный запрос без изменений отдает закешированный ответ"""
+        with self._lock:
+            self._sync()
+            cached = self._cache.get(("top", limit))
+            if cached is None:
+                configs = [self._entry(position) for _, position in self._ranked[:limit]]
+                cached = {"configs": configs, "total": len(configs), "version": self.version}
+                self._cache[("top", limit)] = cached
+            return cached
+
+    def get_queue(self, top_limit: int) -> dict:
+        """Здоровые конфиги вне топа (без endpoint'ов из топа) в порядке снимка"""
+        with self._lock:
+            self._sync()
+            cached = self._cache.get(("queue", top_limit))
+            if cached is None:
+                configs = self._snapshot.configs
+                top_servers = {
+                    (configs[p].server, configs[p].port, configs[p].protocol) for _, p in self._ranked[:top_limit]
+                }
+                queue_configs = [
+                    configs[p] for p in sorted(self._keys)
+                    if (configs[p].server, configs[p].port, configs[p].protocol) not in top_servers
+                ]
+                cached = {"configs": queue_configs, "total": len(queue_configs), "version": self.version}
+                self._cache[("queue", top_limit)] = cached
+            return cached
+
+
+# Глобальный экземпляр рейтинга
+leaderboard = ConfigLeaderboard(active_snapshots.get, ping_stats_service)
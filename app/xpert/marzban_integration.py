@@ -12,7 +12,7 @@ from config import XRAY_FALLBACKS_INBOUND_TAG
 from app.db.crud import add_host, get_or_create_inbound
 from app.db.models import ProxyInbound, ProxyHost
 from app.models.proxy import ProxyHost as ProxyHostModify
-from app.xpert.models import AggregatedConfig, DirectConfig
+from app.xpert.models import AggregatedConfig, ChangeSet, DirectConfig
 from app.xpert.storage import storage
 from app import db
 
@@ -101,7 +101,40 @@ class MarzbanIntegration:
             if not active_configs:
                 logger.info("No active configs to sync")
                 return {"status": "no_configs", "count": 0}
+
+            return self._sync_configs(active_configs)
             
+        except Exception as e:
+            logger.error(f"Marzban integration failed: {e}")
+            return {
+                "status": "error",
+                "error": str(e)
+            }
+
+    def sync_changed_configs_to_marzban(self, change_set: ChangeSet) -> Dict:
+        """Синхронизация только добавленных и изменившихся активных конфигов"""
+        try:
+            changed_ids = set(change_set.added) | set(change_set.updated)
+            if not changed_ids:
+                logger.info("No changed configs to sync")
+                return {"status": "no_changes", "count": 0}
+
+            changed_configs = [c for c in storage.get_active_configs() if c.id in changed_ids]
+            if not changed_configs:
+                return {"status": "no_configs", "count": 0}
+
+            return self._sync_configs(changed_configs)
+
+        except Exception as e:
+            logger.error(f"Marzban integration failed: {e}")
+            return {
+                "status": "error",
+                "error": str(e)
+            }
+
+    def _sync_configs(self, active_configs: List[AggregatedConfig]) -> Dict:
+        """Добавление хостов для переданных конфигов"""
+        try:
             # Группируем по протоколам и портам
             configs_by_inbound = {}
             for config in active_configs:
@@ -43,6 +43,35 @@ class UserPingStats:
         return cls(**data)
 
 
+@dataclass
+class EndpointHealth:
+    """Накопительная статистика endpoint'а, обновляется с каждым отчетом"""
+    server: str = ""
+    port: int = 0
+    protocol: str = ""
+    success_weight: float = 0.0  # Успехи с экспоненциальным затуханием
+    fail_weight: float = 0.0
+    ewma_ping: Optional[float] = None  # EWMA пинга по успешным отчетам
+    total_pings: int = 0
+    updated_at: float = 0.0  # unix time последнего отчета
+    registers: bytearray = field(default_factory=bytearray)  # HyperLogLog по user_id
+    # Точный список пользователей, пока их немного (None - переполнен, считается по registers)
+    sparse_users: Optional[List[int]] = field(default_factory=list)
+    unique_users: int = 0
+
+    def to_dict(self):
+        data = asdict(self)
+        data['registers'] = self.registers.hex()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        data = dict(data)
+        data['registers'] = bytearray.fromhex(data.get('registers', ''))
+        data.setdefault('sparse_users', None)  # сохранено до точного режима - только registers
+        return cls(**data)
+
+
 @dataclass
 class SubscriptionSource:
     id: int = 0
@@ -54,6 +83,22 @@ class SubscriptionSource:
     config_count: int = 0
     success_rate: float = 0.0
     created_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+    # Валидаторы HTTP-кеша и хеш тела для условной загрузки
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    content_hash: Optional[str] = None
+    # Circuit breaker: closed -> open (после серии ошибок) -> half_open (пробный запрос)
+    breaker_state: str = "closed"
+    failure_count: int = 0
+    next_attempt_at: Optional[str] = None
+    last_error: Optional[str] = None
+    # Расписание обновления: None - значение выводится из priority
+    refresh_interval: Optional[int] = None  # секунды между загрузками
+    probe_budget: Optional[int] = None  # максимум проверок за одно обновление (0 - без ограничения)
+    next_refresh_at: Optional[str] = None
+    # Отброшенные дубликаты: внутри фида и копии, уже пришедшие из источника с большим priority
+    duplicate_count: int = 0
+    cross_duplicate_count: int = 0
     
     def to_dict(self):
         return asdict(self)
@@ -72,11 +117,13 @@ class AggregatedConfig:
     port: int = 0
     remarks: str = ""
     source_id: int = 0
-    ping_ms: float = 999.0
+    ping_ms: float = 999.0  # медиана серии замеров
     jitter_ms: float = 0.0
     packet_loss: float = 0.0
     is_active: bool = False
     last_check: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+    fingerprint: str = ""
+    ping_p90_ms: float = 999.0
     
     def to_dict(self):
         return asdict(self)
@@ -86,6 +133,27 @@ class AggregatedConfig:
         return cls(**data)
 
 
+@dataclass
+class ChangeSet:
+    """Изменения агрегированных конфигов за один запуск агрегации"""
+    version: int = 0
+    added: List[int] = field(default_factory=list)
+    removed: List[int] = field(default_factory=list)
+    updated: List[int] = field(default_factory=list)  # Изменился raw или статус активности
+    created_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+
+    @property
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.updated)
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(**data)
+
+
 @dataclass
 class DirectConfig:
     """Одиночная конфигурация, добавляемая напрямую в обход белого списка"""
@@ -110,3 +178,51 @@ class DirectConfig:
     @classmethod
     def from_dict(cls, data: dict):
         return cls(**data)
+
+
+@dataclass
+class EndpointState:
+    """Состояние endpoint'а для планировщика перепроверок"""
+    key: str = ""  # адрес:port:tls (без разрешенного адреса - имя хоста)
+    last_ok: Optional[bool] = None
+    last_ping: float = 999.0
+    streak: int = 0  # Сколько проверок подряд с тем же результатом
+    flap_count: int = 0  # Смены состояния, постепенно забываются на стабильной серии
+    last_probe_at: float = 0.0
+    next_probe_at: float = 0.0
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(**data)
+
+
+@dataclass
+class AggregationRun:
+    """Запуск агрегации и его прогресс"""
+    job_id: str = ""
+    trigger: str = ""  # api | schedule | delete_source
+    status: str = "running"  # running | completed | failed
+    stage: str = "fetching"  # fetching | probing | saving | done
+    started_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+    finished_at: Optional[str] = None
+    joined: int = 0  # Сколько запросов присоединилось к уже идущему запуску
+    sources_total: int = 0
+    sources_fetched: int = 0
+    configs_to_probe: int = 0
+    endpoints_total: int = 0
+    endpoints_probed: int = 0
+    endpoints_active: int = 0
+    active_configs: int = 0
+    total_configs: int = 0
+    skipped_configs: int = 0  # Не проверены из-за дедлайна
+    error: Optional[str] = None
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        return cls(**data)
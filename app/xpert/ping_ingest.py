@@ -0,0 +1,79 @@
+"""
+Очередь приема отчетов о пингах
+Эндпоинт только кладет проверенные отчеты в очередь; фоновый потребитель пачками передает их в ping_stats_service
+"""
+
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+from app.xpert.ping_stats import ping_stats_service
+import config as app_config
+
+logger = logging.getLogger(__name__)
+
+# (server, port, protocol, user_id, ping_ms, success)
+PingRecord = Tuple[str, int, str, int, float, bool]
+
+
+class PingIngestQueue:
+    """Ограниченная очередь отчетов; при переполнении новые пачки отклоняются целиком"""
+
+    def __init__(self, max_size: int, batch_size: int):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._consumer: Optional[asyncio.Task] = None
+        self.accepted = 0
+        self.rejected = 0
+        self.applied = 0
+
+    def _ensure_consumer(self):
+        """Очередь и потребитель создаются в цикле событий приложения при первом отчете"""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+        if self._consumer is None or self._consumer.done():
+            self._consumer = asyncio.get_running_loop().create_task(self._consume())
+
+    def submit(self, records: List[PingRecord]) -> bool:
+        """Поставить пачку в очередь; False - места нет, ничего не поставлено"""
+        self._ensure_consumer()
+        if self.max_size - self._queue.qsize() < len(records):
+            self.rejected += len(records)
+            return False
+        for record in records:
+            self._queue.put_nowait(record)
+        self.accepted += len(records)
+        return True
+
+    async def _consume(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                # Запись идет под блокировкой сервиса статистики - не держим цикл событий
+                await loop.run_in_executor(None, ping_stats_service.record_pings, batch)
+                self.applied += len(batch)
+            except Exception as e:
+                logger.error(f"Failed to apply {len(batch)} ping reports: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def get_stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "max_size": self.max_size,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "applied": self.applied,
+        }
+
+
+# Глобальный экземпляр очереди
+ping_ingest_queue = PingIngestQueue(
+    max_size=app_config.XPERT_PING_INGEST_QUEUE_SIZE,
+    batch_size=app_config.XPERT_PING_INGEST_BATCH_SIZE,
+)
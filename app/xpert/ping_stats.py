@@ -2,132 +2,367 @@
 Сервис сбора и анализа статистики пингов от пользователей
 """
 
+import atexit
+import hashlib
 import json
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Callable, List, Dict, Optional, Set, Tuple
 from collections import defaultdict
 
-from app.xpert.models import UserPingStats, AggregatedConfig
+from app.xpert.models import UserPingStats, AggregatedConfig, EndpointHealth
 from app.xpert.storage import storage
 import config as app_config
 
 logger = logging.getLogger(__name__)
 
 
+StatKey = Tuple[str, int, str]  # (server, port, protocol)
+
+# HyperLogLog: 256 регистров (~6.5% погрешности); на малых числах - линейный подсчет, почти точный
+HLL_BITS = 8
+HLL_REGISTERS = 1 << HLL_BITS
+HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+# До этого числа пользователи endpoint'а считаются точно: порог min_users не зависит от коллизий
+HLL_SPARSE_LIMIT = 64
+
+
+def _hll_add(registers: bytearray, user_id: int) -> bool:
+    """Добавление user_id в скетч; True - регистр изменился и оценку нужно пересчитать"""
+    if not registers:
+        registers.extend(bytes(HLL_REGISTERS))
+    x = int.from_bytes(hashlib.blake2b(str(user_id).encode(), digest_size=8).digest(), 'big')
+    index = x & (HLL_REGISTERS - 1)
+    w = x >> HLL_BITS
+    rank = (64 - HLL_BITS) - w.bit_length() + 1
+    if rank > registers[index]:
+        registers[index] = rank
+        return True
+    return False
+
+
+def _hll_count(registers: bytearray) -> int:
+    if not registers:
+        return 0
+    zeros = registers.count(0)
+    estimate = HLL_ALPHA * HLL_REGISTERS ** 2 / sum(2.0 ** -r for r in registers)
+    if estimate <= 2.5 * HLL_REGISTERS and zeros:
+        estimate = HLL_REGISTERS * math.log(HLL_REGISTERS / zeros)
+    return int(round(estimate))
+
+
+def _add_user(health: EndpointHealth, user_id: int):
+    """Учет пользователя в оценке уникальных; unique_users пересчитывается только при изменениях"""
+    changed = _hll_add(health.registers, user_id)
+    if health.sparse_users is not None:
+        if user_id in health.sparse_users:
+            return
+        health.sparse_users.append(user_id)
+        if len(health.sparse_users) <= HLL_SPARSE_LIMIT:
+            health.unique_users = len(health.sparse_users)
+            return
+        health.sparse_users = None
+        changed = True
+    if changed:
+        health.unique_users = _hll_count(health.registers)
+
+
+def _to_unix(timestamp: str) -> float:
+    return datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp()
+
+
 class PingStatsService:
-    """Сервис управления статистикой пингов"""
+    """Сервис управления статистикой пингов.
+
+    Статистика индексирована в памяти по endpoint'у и пользователю: запись отчета - O(1).
+    Отчеты пачками дописываются в журнал (JSONL) по таймеру; журнал периодически
+    сворачивается в снимок xpert_ping_stats.json.
+    """
     
     def __init__(self):
         self.stats_file = "xpert_ping_stats.json"
-        self.stats_data = self._load_stats()
-    
-    def _load_stats(self) -> Dict:
-        """Загрузка статистики из файла"""
+        self.log_file = "xpert_ping_stats.log"
+        self.flush_interval = app_config.XPERT_PING_STATS_FLUSH_SEC
+        self.compact_interval = app_config.XPERT_PING_STATS_COMPACT_SEC
+        self.compact_max_lines = app_config.XPERT_PING_STATS_COMPACT_LINES
+        self.half_life = app_config.XPERT_PING_HEALTH_HALF_LIFE_HOURS * 3600
+        self.ewma_alpha = app_config.XPERT_PING_HEALTH_EWMA_ALPHA
+        self.min_weight = app_config.XPERT_PING_HEALTH_MIN_WEIGHT
+        self._lock = threading.RLock()
+        # (server, port, protocol) -> {user_id: UserPingStats}
+        self._by_server: Dict[StatKey, Dict[int, UserPingStats]] = {}
+        # user_id -> endpoint'ы, о которых он сообщал
+        self._by_user: Dict[int, Set[StatKey]] = defaultdict(set)
+        # Накопительные агрегаты endpoint'ов: get_server_health не перебирает строки
+        self._health: Dict[StatKey, EndpointHealth] = {}
+        # Подписчики на изменение агрегата endpoint'а (вызываются под self._lock, должны быть быстрыми)
+        self._listeners: List[Callable[[StatKey], None]] = []
+        self._pending: List[str] = []
+        self._seq = 0  # номер последнего отчета в журнале
+        self._log_lines = 0
+        self._last_compact = time.monotonic()
+        self.last_cleanup = datetime.utcnow().isoformat()
+        self._load_stats()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._flush_loop, name="ping-stats-flush", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def _index(self, stat: UserPingStats):
+        key = (stat.server, stat.port, stat.protocol)
+        self._by_server.setdefault(key, {})[stat.user_id] = stat
+        self._by_user[stat.user_id].add(key)
+
+    def _decay(self, elapsed: float) -> float:
+        """Множитель затухания весов за elapsed секунд"""
+        if not self.half_life or elapsed <= 0:
+            return 1.0
+        return 0.5 ** (elapsed / self.half_life)
+
+    def _update_health(self, key: StatKey, user_id: int, ping_ms: float, success: bool, at: float):
+        health = self._health.get(key)
+        if health is None:
+            health = self._health[key] = EndpointHealth(server=key[0], port=key[1], protocol=key[2], updated_at=at)
+        factor = self._decay(at - health.updated_at)
+        health.success_weight = health.success_weight * factor + (1.0 if success else 0.0)
+        health.fail_weight = health.fail_weight * factor + (0.0 if success else 1.0)
+        if success:
+            # Пинг неуспешного отчета не измеряет задержку и в EWMA не идет
+            health.ewma_ping = ping_ms if health.ewma_ping is None else (
+                self.ewma_alpha * ping_ms + (1 - self.ewma_alpha) * health.ewma_ping
+            )
+        health.total_pings += 1
+        health.updated_at = max(health.updated_at, at)
+        _add_user(health, user_id)
+        for listener in self._listeners:
+            listener(key)
+
+    def add_listener(self, listener: Callable[[StatKey], None]):
+        """Подписка на изменения статистики endpoint'ов"""
+        self._listeners.append(listener)
+
+    def _aggregate_rows(self, key: StatKey, users: Dict[int, UserPingStats]) -> EndpointHealth:
+        """Агрегат по строкам пользователей; счетчики строки затухают от ее последнего отчета"""
+        health = EndpointHealth(server=key[0], port=key[1], protocol=key[2])
+        stats = sorted(users.values(), key=lambda stat: stat.last_ping)
+        if stats:
+            health.updated_at = _to_unix(stats[-1].last_ping)
+        for stat in stats:
+            factor = self._decay(health.updated_at - _to_unix(stat.last_ping))
+            health.success_weight += stat.success_count * factor
+            health.fail_weight += stat.fail_count * factor
+            health.total_pings += stat.success_count + stat.fail_count
+            if stat.success_count:
+                health.ewma_ping = stat.ping_ms if health.ewma_ping is None else (
+                    self.ewma_alpha * stat.ping_ms + (1 - self.ewma_alpha) * health.ewma_ping
+                )
+            _add_user(health, stat.user_id)
+        return health
+
+    def _rebuild_health(self):
+        """Агрегаты из строк пользователей - для снимков, сохраненных до появления агрегатов"""
+        self._health = {key: self._aggregate_rows(key, users) for key, users in self._by_server.items()}
+
+    def _apply(self, server: str, port: int, protocol: str, user_id: int,
+               ping_ms: float, success: bool, timestamp: str):
+        """Учет одного отчета в индексах (вызывается под self._lock)"""
+        key = (server, port, protocol)
+        self._update_health(key, user_id, ping_ms, success, _to_unix(timestamp))
+        existing_stat = self._by_server.get(key, {}).get(user_id)
+        if existing_stat:
+            existing_stat.ping_ms = ping_ms
+            existing_stat.last_ping = timestamp
+            if success:
+                existing_stat.success_count += 1
+            else:
+                existing_stat.fail_count += 1
+        else:
+            self._index(UserPingStats(
+                server=server,
+                port=port,
+                protocol=protocol,
+                user_id=user_id,
+                ping_ms=ping_ms,
+                success_count=1 if success else 0,
+                fail_count=0 if success else 1,
+                last_ping=timestamp,
+                created_at=timestamp
+            ))
+
+    def _load_stats(self):
+        """Загрузка снимка и досчет отчетов из журнала, записанных после него"""
+        snapshot_seq = 0
         try:
             with open(self.stats_file, 'r') as f:
                 data = json.load(f)
-                return {
-                    'user_stats': [UserPingStats.from_dict(item) for item in data.get('user_stats', [])],
-                    'last_cleanup': data.get('last_cleanup', datetime.utcnow().isoformat())
-                }
+            for item in data.get('user_stats', []):
+                self._index(UserPingStats.from_dict(item))
+            self.last_cleanup = data.get('last_cleanup', self.last_cleanup)
+            if 'endpoint_health' in data:
+                for item in data['endpoint_health']:
+                    health = EndpointHealth.from_dict(item)
+                    self._health[(health.server, health.port, health.protocol)] = health
+            else:
+                self._rebuild_health()
+            snapshot_seq = int(data.get('log_seq', 0))
         except (FileNotFoundError, json.JSONDecodeError):
-            return {'user_stats': [], 'last_cleanup': datetime.utcnow().isoformat()}
-    
-    def _save_stats(self):
-        """Сохранение статистики в файл"""
+            pass
+        except Exception as e:
+            logger.error(f"Failed to load ping stats: {e}")
+
+        self._seq = snapshot_seq
+        replayed = 0
         try:
-            data = {
-                'user_stats': [stat.to_dict() for stat in self.stats_data['user_stats']],
-                'last_cleanup': self.stats_data['last_cleanup']
-            }
-            with open(self.stats_file, 'w') as f:
-                json.dump(data, f, indent=2)
+            with open(self.log_file, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # оборванная последняя строка
+                    self._log_lines += 1
+                    self._seq = max(self._seq, entry['seq'])
+                    if entry['seq'] <= snapshot_seq:
+                        continue  # уже в снимке (сбой между снимком и очисткой журнала)
+                    self._apply(entry['server'], entry['port'], entry['protocol'], entry['user_id'],
+                                entry['ping_ms'], entry['success'], entry['ts'])
+                    replayed += 1
+        except FileNotFoundError:
+            pass
         except Exception as e:
-            logger.error(f"Failed to save ping stats: {e}")
+            logger.error(f"Failed to replay ping stats log: {e}")
+        if replayed:
+            logger.info(f"Replayed {replayed} ping reports from {self.log_file}")
+
+    def _flush_loop(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+                if (time.monotonic() - self._last_compact >= self.compact_interval
+                        or self._log_lines >= self.compact_max_lines):
+                    self.compact()
+            except Exception as e:
+                logger.error(f"Failed to persist ping stats: {e}")
+
+    def flush(self):
+        """Дописывает накопленные отчеты в журнал одной записью"""
+        with self._lock:
+            if not self._pending:
+                return
+            lines, self._pending = self._pending, []
+            with open(self.log_file, 'a') as f:
+                f.write(''.join(lines))
+            self._log_lines += len(lines)
+
+    def _save_stats(self):
+        """Снимок всей статистики; журнал после него очищается"""
+        data = {
+            'user_stats': [stat.to_dict() for users in self._by_server.values() for stat in users.values()],
+            'endpoint_health': [health.to_dict() for health in self._health.values()],
+            'last_cleanup': self.last_cleanup,
+            'log_seq': self._seq
+        }
+        tmp_file = f"{self.stats_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmp_file, self.stats_file)
+        open(self.log_file, 'w').close()
+        self._log_lines = 0
+        self._last_compact = time.monotonic()
+
+    def compact(self):
+        """Сворачивание журнала в снимок"""
+        with self._lock:
+            self._pending = []  # все, что в _pending, уже учтено в индексах и попадет в снимок
+            try:
+                self._save_stats()
+            except Exception as e:
+                logger.error(f"Failed to save ping stats: {e}")
+
+    def close(self):
+        self._stop.set()
+        self.flush()
     
+    def _record(self, server: str, port: int, protocol: str, user_id: int,
+                ping_ms: float, success: bool, timestamp: str):
+        """Учет отчета и постановка строки журнала (вызывается под self._lock)"""
+        self._apply(server, port, protocol, user_id, ping_ms, success, timestamp)
+        self._seq += 1
+        self._pending.append(json.dumps({
+            'seq': self._seq, 'server': server, 'port': port, 'protocol': protocol,
+            'user_id': user_id, 'ping_ms': ping_ms, 'success': success, 'ts': timestamp
+        }, separators=(',', ':')) + '\n')
+
     def record_ping(self, server: str, port: int, protocol: str, user_id: int, 
                    ping_ms: float, success: bool):
         """Запись результата пинга от пользователя"""
         try:
-            # Ищем существующую статистику
-            existing_stat = None
-            for stat in self.stats_data['user_stats']:
-                if (stat.server == server and 
-                    stat.port == port and 
-                    stat.protocol == protocol and 
-                    stat.user_id == user_id):
-                    existing_stat = stat
-                    break
-            
-            if existing_stat:
-                # Обновляем существующую статистику
-                existing_stat.ping_ms = ping_ms
-                existing_stat.last_ping = datetime.utcnow().isoformat()
-                if success:
-                    existing_stat.success_count += 1
-                else:
-                    existing_stat.fail_count += 1
-            else:
-                # Создаем новую запись
-                new_stat = UserPingStats(
-                    server=server,
-                    port=port,
-                    protocol=protocol,
-                    user_id=user_id,
-                    ping_ms=ping_ms,
-                    success_count=1 if success else 0,
-                    fail_count=0 if success else 1
-                )
-                self.stats_data['user_stats'].append(new_stat)
-            
-            self._save_stats()
+            timestamp = datetime.utcnow().isoformat()
+            with self._lock:
+                self._record(server, port, protocol, user_id, ping_ms, success, timestamp)
             logger.debug(f"Recorded ping: {server}:{port} - {ping_ms}ms - {'success' if success else 'fail'}")
             
         except Exception as e:
             logger.error(f"Failed to record ping: {e}")
+
+    def record_pings(self, records: List[Tuple[str, int, str, int, float, bool]]) -> int:
+        """Пачка отчетов (server, port, protocol, user_id, ping_ms, success) под одной блокировкой"""
+        timestamp = datetime.utcnow().isoformat()
+        recorded = 0
+        with self._lock:
+            for server, port, protocol, user_id, ping_ms, success in records:
+                try:
+                    self._record(server, port, protocol, user_id, ping_ms, success, timestamp)
+                    recorded += 1
+                except Exception as e:
+                    logger.error(f"Failed to record ping: {e}")
+        logger.debug(f"Recorded {recorded} pings")
+        return recorded
     
     def get_server_health(self, server: str, port: int, protocol: str, 
                          min_users: int = 3) -> Dict:
-        """Получение статистики здоровья сервера"""
-        server_stats = [
-            stat for stat in self.stats_data['user_stats']
-            if (stat.server == server and 
-                stat.port == port and 
-                stat.protocol == protocol)
-        ]
+        """Получение статистики здоровья сервера (O(1) по накопленному агрегату)"""
+        with self._lock:
+            health = self._health.get((server, port, protocol))
+            if health is None:
+                success_weight = fail_weight = 0.0
+                ewma_ping, total_pings, unique_users = None, 0, 0
+            else:
+                # Веса затухают до текущего момента: давно не подтвержденная статистика перестает учитываться
+                factor = self._decay(time.time() - health.updated_at)
+                success_weight, fail_weight = health.success_weight * factor, health.fail_weight * factor
+                ewma_ping, total_pings, unique_users = health.ewma_ping, health.total_pings, health.unique_users
         
-        if len(server_stats) < min_users:
+        if unique_users < min_users or (health is not None and success_weight + fail_weight < self.min_weight):
             return {
                 'healthy': None,  # Недостаточно данных
                 'avg_ping': 999.0,
                 'success_rate': 0.0,
-                'total_pings': len(server_stats),
-                'unique_users': len(set(stat.user_id for stat in server_stats))
+                'total_pings': total_pings,
+                'unique_users': unique_users
             }
         
-        # Агрегируем статистику
-        total_success = sum(stat.success_count for stat in server_stats)
-        total_fail = sum(stat.fail_count for stat in server_stats)
-        total_pings = total_success + total_fail
-        
-        if total_pings == 0:
+        weight = success_weight + fail_weight
+        if weight <= 0:
             return {
                 'healthy': False,
                 'avg_ping': 999.0,
                 'success_rate': 0.0,
                 'total_pings': 0,
-                'unique_users': len(set(stat.user_id for stat in server_stats))
+                'unique_users': unique_users
             }
         
-        success_rate = (total_success / total_pings) * 100
-        avg_ping = sum(stat.ping_ms for stat in server_stats) / len(server_stats)
+        success_rate = (success_weight / weight) * 100
+        avg_ping = ewma_ping if ewma_ping is not None else 999.0
         
         # Проверяем здоровье
         healthy = (
             success_rate >= 70.0 and  # Минимум 70% успехов
             avg_ping <= 1000.0 and     # Максимум 1000мс пинг
-            len(set(stat.user_id for stat in server_stats)) >= min_users
+            unique_users >= min_users
         )
         
         return {
@@ -135,8 +370,24 @@ class PingStatsService:
             'avg_ping': avg_ping,
             'success_rate': success_rate,
             'total_pings': total_pings,
-            'unique_users': len(set(stat.user_id for stat in server_stats))
+            'unique_users': unique_users
         }
+
+    def health_expires_at(self, server: str, port: int, protocol: str) -> Optional[float]:
+        """Момент (unix time), когда затухший вес endpoint'а упадет ниже порога и данных станет недостаточно"""
+        with self._lock:
+            health = self._health.get((server, port, protocol))
+            if health is None or not self.half_life:
+                return None
+            weight = health.success_weight + health.fail_weight
+            if weight <= self.min_weight:
+                return health.updated_at
+            return health.updated_at + self.half_life * math.log2(weight / self.min_weight)
+
+    def get_user_stats(self, user_id: int) -> List[UserPingStats]:
+        """Статистика пингов одного пользователя по всем endpoint'ам"""
+        with self._lock:
+            return [self._by_server[key][user_id] for key in self._by_user.get(user_id, ())]
     
     def get_top_configs(self, configs: List[AggregatedConfig], limit: int = 10) -> List[AggregatedConfig]:
         """Получение топ-N конфигов на основе статистики"""
@@ -233,17 +484,31 @@ class PingStatsService:
         """Очистка старой статистики"""
         try:
             cutoff_date = datetime.utcnow() - timedelta(days=days)
-            original_count = len(self.stats_data['user_stats'])
-            
-            self.stats_data['user_stats'] = [
-                stat for stat in self.stats_data['user_stats']
-                if datetime.fromisoformat(stat.created_at) > cutoff_date
-            ]
+            cleaned_count = 0
+            with self._lock:
+                for key, users in list(self._by_server.items()):
+                    touched = False
+                    for user_id, stat in list(users.items()):
+                        if datetime.fromisoformat(stat.created_at) <= cutoff_date:
+                            del users[user_id]
+                            self._by_user[user_id].discard(key)
+                            cleaned_count += 1
+                            touched = True
+                    if not touched:
+                        continue
+                    if users:
+                        # Удаленные пользователи не должны оставаться в весах и скетче уникальных
+                        self._health[key] = self._aggregate_rows(key, users)
+                    else:
+                        del self._by_server[key]
+                        self._health.pop(key, None)
+                    for listener in self._listeners:
+                        listener(key)
+                for user_id in [u for u, keys in self._by_user.items() if not keys]:
+                    del self._by_user[user_id]
+                self.last_cleanup = datetime.utcnow().isoformat()
+            self.compact()
             
-            self.stats_data['last_cleanup'] = datetime.utcnow().isoformat()
-            self._save_stats()
-            
-            cleaned_count = original_count - len(self.stats_data['user_stats'])
             if cleaned_count > 0:
                 logger.info(f"Cleaned up {cleaned_count} old ping stats (older than {days} days)")
                 
@@ -252,19 +517,13 @@ class PingStatsService:
     
     def get_stats_summary(self) -> Dict:
         """Получение сводной статистики"""
-        total_stats = len(self.stats_data['user_stats'])
-        unique_servers = len(set(
-            (stat.server, stat.port, stat.protocol) 
-            for stat in self.stats_data['user_stats']
-        ))
-        unique_users = len(set(stat.user_id for stat in self.stats_data['user_stats']))
-        
-        return {
-            'total_ping_records': total_stats,
-            'unique_servers': unique_servers,
-            'unique_users': unique_users,
-            'last_cleanup': self.stats_data['last_cleanup']
-        }
+        with self._lock:
+            return {
+                'total_ping_records': sum(len(users) for users in self._by_server.values()),
+                'unique_servers': len(self._by_server),
+                'unique_users': len(self._by_user),
+                'last_cleanup': self.last_cleanup
+            }
 
 
 # Глобальный экземпляр сервиса
@@ -0,0 +1,89 @@
+"""
+Общий кеш результатов проверок endpoint'ов
+Агрегация, перепроверки, прямые конфигурации и валидация не проверяют один host:port повторно в пределах TTL
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+import config as app_config
+
+logger = logging.getLogger(__name__)
+
+ProbeKey = Tuple[str, int, bool]
+# (median, p90, jitter, loss %) - замер без учета baseline до Target IPs
+Measurement = Tuple[float, float, float, float]
+
+
+class ProbeResultCache:
+    """Кеш замеров по (host, port, TLS); неудачные замеры живут меньше удачных"""
+
+    def __init__(self, ttl: float, negative_ttl: float, max_size: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max(1, max_size)
+        # key -> (замер, время истечения)
+        self._entries: "OrderedDict[ProbeKey, Tuple[Measurement, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.forced = 0
+
+    @staticmethod
+    def _key(host: str, port: int, use_tls: bool) -> ProbeKey:
+        return (host or "").strip().strip("[]").lower(), int(port), bool(use_tls)
+
+    def get(self, host: str, port: int, use_tls: bool, force: bool = False) -> Optional[Measurement]:
+        """Свежий замер из кеша; force - всегда None (нужна новая проверка)"""
+        if self.ttl <= 0:
+            return None
+        if force:
+            with self._lock:
+                self.forced += 1
+            return None
+        key = self._key(host, port, use_tls)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[1] > time.monotonic():
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+            return None
+
+    def put(self, host: str, port: int, use_tls: bool, measurement: Measurement):
+        if self.ttl <= 0:
+            return
+        ttl = self.ttl if measurement[3] < 100.0 else self.negative_ttl
+        key = self._key(host, port, use_tls)
+        with self._lock:
+            self._entries[key] = (tuple(measurement), time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "forced": self.forced,
+                # Каждое попадание - несостоявшаяся серия замеров endpoint'а
+                "saved_probes": self.hits,
+                "ttl": self.ttl,
+            }
+
+
+# Глобальный экземпляр кеша
+probe_cache = ProbeResultCache(
+    app_config.XPERT_PROBE_CACHE_TTL,
+    app_config.XPERT_PROBE_CACHE_NEGATIVE_TTL,
+    app_config.XPERT_PROBE_CACHE_SIZE,
+)
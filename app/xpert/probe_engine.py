@@ -0,0 +1,331 @@
+"""
+Асинхронный движок проверки endpoint'ов
+Неблокирующие TCP/TLS-проверки на asyncio с адаптивным лимитом параллельности
+"""
+
+import asyncio
+import logging
+import ssl
+import time
+from collections import deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import config as app_config
+from app.xpert.checker import checker, summarize_samples
+from app.xpert.dns_cache import dns_cache
+from app.xpert.probe_cache import probe_cache
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveLimiter:
+    """Глобальный лимит одновременных проверок с AIMD-подстройкой по доле таймаутов"""
+
+    def __init__(self, max_limit: int, min_limit: int, limit: int, window: int = 50,
+                 backoff_ratio: float = 0.3, increase_ratio: float = 0.05):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = max(self.min_limit, min(limit, self.max_limit))
+        self.in_flight = 0
+        self.backoff_ratio = backoff_ratio
+        self.increase_ratio = increase_ratio
+        self._window = deque(maxlen=max(1, window))
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._cond:
+            self.in_flight -= 1
+            self._cond.notify_all()
+
+    async def record(self, timed_out: bool):
+        """Учитывает результат проверки и при необходимости меняет лимит"""
+        self._window.append(timed_out)
+        if len(self._window) < self._window.maxlen:
+            return
+
+        ratio = sum(self._window) / len(self._window)
+        new_limit = self.limit
+        if ratio >= self.backoff_ratio:
+            new_limit = max(self.min_limit, self.limit // 2)
+        elif ratio <= self.increase_ratio:
+            new_limit = min(self.max_limit, self.limit + max(1, self.limit // 10))
+        self._window.clear()
+
+        if new_limit != self.limit:
+            logger.info(f"Probe concurrency {self.limit} -> {new_limit} (timeouts: {ratio:.0%})")
+            async with self._cond:
+                self.limit = new_limit
+                self._cond.notify_all()
+
+
+class AsyncProbeEngine:
+    """Параллельная проверка конфигураций без блокировки event loop"""
+
+    def __init__(self):
+        self.timeout = app_config.XPERT_PROBE_TIMEOUT
+        self.max_concurrency = app_config.XPERT_PROBE_CONCURRENCY
+        self.min_concurrency = app_config.XPERT_PROBE_MIN_CONCURRENCY
+        self.per_host_limit = app_config.XPERT_PROBE_PER_HOST_LIMIT
+        self.samples = max(1, app_config.XPERT_PROBE_SAMPLES)
+        self.sample_interval = app_config.XPERT_PROBE_SAMPLE_INTERVAL_MS / 1000
+        # Последний подобранный лимит переживает запуск, чтобы не начинать с пика заново.
+        self._last_limit = self.max_concurrency
+        self._ssl_context = ssl.create_default_context()
+        self._ssl_context.check_hostname = False
+        self._ssl_context.verify_mode = ssl.CERT_NONE
+
+    async def _close_writer(self, writer: Optional[asyncio.StreamWriter]):
+        if writer is None:
+            return
+        try:
+            writer.close()
+            await asyncio.wait_for(writer.wait_closed(), timeout=1.0)
+        except Exception:
+            pass
+
+    async def check_connectivity(self, host: str, port: int, timeout: float) -> Tuple[bool, float, bool]:
+        """TCP connect. Возвращает (ok, ping_ms, timed_out)"""
+        writer = None
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=timeout)
+            return True, max(1.0, (time.perf_counter() - start) * 1000), False
+        except asyncio.TimeoutError:
+            return False, 999.0, True
+        except Exception:
+            return False, 999.0, False
+        finally:
+            await self._close_writer(writer)
+
+    async def check_tls_handshake(self, host: str, port: int, timeout: float,
+                                  server_hostname: Optional[str] = None) -> Tuple[bool, float, bool]:
+        """TCP+TLS handshake. Возвращает (ok, ping_ms, timed_out)"""
+        writer = None
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(
+                asyncio.open_connection(
+                    host, port,
+                    ssl=self._ssl_context,
+                    server_hostname=server_hostname or host,
+                    ssl_handshake_timeout=timeout,
+                ),
+                timeout=timeout,
+            )
+            return True, max(1.0, (time.perf_counter() - start) * 1000), False
+        except asyncio.TimeoutError:
+            return False, 999.0, True
+        except Exception as e:
+            # EOF во время TLS handshake показываем отдельным значением, как в sync-версии.
+            err = str(e).lower()
+            if isinstance(e, (ssl.SSLEOFError, ConnectionResetError)) or "eof" in err:
+                return False, 1200.0, False
+            return False, 999.0, False
+        finally:
+            await self._close_writer(writer)
+
+    async def refresh_target_baseline(self, timeout: float = 2.0) -> Tuple[bool, float]:
+        """TLS-handshake до всех Target IPs параллельно и публикация baseline в checker"""
+        targets = [str(ip).strip() for ip in (checker.target_ips or []) if str(ip).strip()]
+        results = await asyncio.gather(
+            *(self.check_tls_handshake(ip, 443, timeout) for ip in targets)
+        )
+        checker.publish_target_baseline([float(ping) for ok, ping, _ in results if ok])
+        return checker.get_target_baseline()
+
+    async def probe_endpoint(self, raw: str, protocol: str, host: str, port: int,
+                             timeout: Optional[float] = None) -> Tuple[bool, float, bool]:
+        """Async-аналог checker.probe_endpoint_sync без учета Target IPs"""
+        use_tls = checker.should_use_tls_probe(raw, protocol, port)
+        return await self._probe(host, host, port, use_tls, timeout or self.timeout)
+
+    async def _probe(self, address: str, host: str, port: int, use_tls: bool,
+                     timeout: float) -> Tuple[bool, float, bool]:
+        """Проверка по уже разрешенному адресу; host используется как SNI"""
+        if use_tls:
+            return await self.check_tls_handshake(address, port, timeout, server_hostname=host)
+        return await self.check_connectivity(address, port, timeout)
+
+    async def measure(self, address: str, host: str, port: int, use_tls: bool, timeout: float,
+                      limiter: Optional[AdaptiveLimiter] = None,
+                      slot: Optional[asyncio.Semaphore] = None,
+                      force: bool = False) -> Tuple[float, float, float, float]:
+        """Серия разнесенных по времени замеров: (median, p90, jitter, loss %).
+
+        Слоты лимитера и хоста занимаются только на время одного замера, не на паузы.
+        Если первый замер упал по таймауту, остальные не делаются (loss 100%).
+        Свежий замер того же host:port из probe_cache используется без подключения (кроме force).
+        """
+        cached = probe_cache.get(host, port, use_tls, force=force)
+        if cached is not None:
+            return cached
+        samples: List[Optional[float]] = []
+        for attempt in range(self.samples):
+            if attempt:
+                await asyncio.sleep(self.sample_interval)
+            if slot is not None:
+                await slot.acquire()
+            try:
+                if limiter is not None:
+                    await limiter.acquire()
+                try:
+                    ok, ping_ms, timed_out = await self._probe(address, host, port, use_tls, timeout)
+                finally:
+                    if limiter is not None:
+                        await limiter.release()
+            finally:
+                if slot is not None:
+                    slot.release()
+            if limiter is not None:
+                await limiter.record(timed_out)
+            samples.append(ping_ms if ok else None)
+            if not ok and timed_out and attempt == 0:
+                break
+        measurement = summarize_samples(samples)
+        probe_cache.put(host, port, use_tls, measurement)
+        return measurement
+
+    async def process_configs(self, raws: List[str],
+                              progress: Optional[Callable[[int, int, int], None]] = None,
+                              on_result: Optional[Callable[[int, dict], None]] = None,
+                              deadline: Optional[float] = None,
+                              force: bool = False) -> List[Optional[dict]]:
+        """Пакетный async-аналог checker.process_config; порядок результатов совпадает с raws.
+
+        Конфиги, указывающие на один endpoint (адрес, порт, режим TLS), проверяются
+        одним соединением, результат копируется на всю группу.
+        progress(done, total, active) вызывается по мере проверки endpoint'ов,
+        on_result(index, result) - для каждого конфига сразу после проверки его endpoint'а.
+        deadline - бюджет в секундах: не успевшие endpoint'ы возвращаются с "probed": False.
+        force - не использовать probe_cache, проверить все endpoint'ы заново.
+        """
+        if not raws:
+            return []
+
+        started = time.perf_counter()
+        parsed = []
+        for raw in raws:
+            protocol, server, port, remarks = checker.parse_config(raw)
+            if not server or not port:
+                logger.warning(f"Failed to parse server/port from: {raw}")
+                parsed.append(None)
+                continue
+            use_tls = checker.should_use_tls_probe(raw, protocol, port)
+            parsed.append((protocol, server, port, remarks, use_tls))
+
+        addresses = await dns_cache.prefetch(p[1] for p in parsed if p)
+
+        # endpoint -> хост для SNI/подключения (первый встретившийся в группе) и индексы конфигов
+        endpoints: Dict[Tuple[str, int, bool], str] = {}
+        members: Dict[Tuple[str, int, bool], List[int]] = {}
+        # Имя не разрешилось (в т.ч. отрицательная запись кеша): без подключения, чтобы
+        # open_connection не разрешал его заново в обход negative TTL
+        unresolved = set()
+        for index, item in enumerate(parsed):
+            if item:
+                _, server, port, _, use_tls = item
+                address = addresses.get(server)
+                key = (address or server.lower(), port, use_tls)
+                if address is None:
+                    unresolved.add(key)
+                endpoints.setdefault(key, server)
+                members.setdefault(key, []).append(index)
+
+        def build(index: int, ok: bool, ping_ms: float, p90: float, jitter: float, loss: float,
+                  probed: bool = True) -> dict:
+            protocol, server, port, remarks, _ = parsed[index]
+            return {
+                "raw": raws[index],
+                "protocol": protocol,
+                "server": server,
+                "port": port,
+                "remarks": remarks or f"{protocol.upper()}-{server[:15]}",
+                "ping_ms": ping_ms,
+                "ping_p90_ms": p90,
+                "jitter_ms": jitter,
+                "packet_loss": loss,
+                "is_active": ok,
+                "probed": probed,
+            }
+
+        limiter = AdaptiveLimiter(
+            max_limit=self.max_concurrency,
+            min_limit=self.min_concurrency,
+            limit=self._last_limit,
+        )
+        host_slots: Dict[str, asyncio.Semaphore] = {}
+        target_ok, target_ping = checker.get_target_baseline()
+        processed: List[Optional[dict]] = [None] * len(raws)
+        counters = {"done": 0, "active": 0}
+
+        def publish(key: Tuple[str, int, bool], outcome: Tuple[bool, float, float, float, float]):
+            counters["done"] += 1
+            counters["active"] += int(outcome[0])
+            for index in members[key]:
+                processed[index] = build(index, *outcome)
+                if on_result:
+                    on_result(index, processed[index])
+            if progress:
+                progress(counters["done"], len(endpoints), counters["active"])
+
+        async def probe_one(key: Tuple[str, int, bool], host: str):
+            if key in unresolved:
+                publish(key, (False, 999.0, 999.0, 0.0, 100.0))
+                return
+            address, port, use_tls = key
+            slot = host_slots.setdefault(address, asyncio.Semaphore(self.per_host_limit))
+            try:
+                median, p90, jitter, loss = await self.measure(
+                    address, host, port, use_tls, self.timeout, limiter=limiter, slot=slot, force=force
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.debug(f"Probe failed for {key}: {e}")
+                median, p90, jitter, loss = 999.0, 999.0, 0.0, 100.0
+            ok = loss < 100.0
+            if ok and target_ok:
+                median = max(1.0, (median * 0.7) + (float(target_ping) * 0.3))
+                p90 = max(1.0, (p90 * 0.7) + (float(target_ping) * 0.3))
+            publish(key, (ok, median, p90, jitter, loss))
+
+        keys = list(endpoints)
+        if progress:
+            progress(0, len(keys), 0)
+        tasks = [asyncio.ensure_future(probe_one(key, endpoints[key])) for key in keys]
+        skipped = 0
+        if tasks:
+            _, pending = await asyncio.wait(tasks, timeout=deadline)
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+        self._last_limit = limiter.limit
+
+        # Не успевшие к дедлайну: разобранные, но не проверенные
+        for index, item in enumerate(parsed):
+            if item and processed[index] is None:
+                skipped += 1
+                processed[index] = build(index, False, 999.0, 999.0, 0.0, 100.0, probed=False)
+
+        active = sum(1 for r in processed if r and r["is_active"])
+        logger.info(
+            f"Probed {len(raws) - skipped} configs via {counters['done']}/{len(keys)} endpoints in "
+            f"{time.perf_counter() - started:.1f}s: {active} active, concurrency limit {limiter.limit}"
+            + (f", {skipped} skipped by deadline" if skipped else "")
+        )
+        return processed
+
+    async def process_config(self, raw: str, force: bool = False) -> Optional[dict]:
+        """Async-аналог checker.process_config для одной конфигурации"""
+        results = await self.process_configs([raw], force=force)
+        return results[0]
+
+
+# Глобальный экземпляр движка
+probe_engine = AsyncProbeEngine()
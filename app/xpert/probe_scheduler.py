@@ -0,0 +1,253 @@
+"""
+Планировщик перепроверок агрегированных конфигов
+Новые и нестабильные endpoint'ы проверяются часто, стабильные и мертвые - с экспоненциальным backoff
+"""
+
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import config as app_config
+from app.xpert.checker import checker
+from app.xpert.dns_cache import dns_cache
+from app.xpert.marzban_integration import marzban_integration
+from app.xpert.models import AggregatedConfig, ChangeSet, EndpointState
+from app.xpert.probe_engine import probe_engine
+from app.xpert.storage import storage
+from app.xpert.snapshot import active_snapshots
+
+logger = logging.getLogger(__name__)
+
+# (server, port, use_tls) конфига; ключ endpoint'а получается из него после разрешения имени
+Endpoint = Tuple[str, int, bool]
+
+
+class ProbeScheduler:
+    """Перепроверка endpoint'ов по расписанию, зависящему от их истории"""
+
+    def __init__(self):
+        self.state_file = os.path.join(storage.data_dir, "probe_state.json")
+        self.min_interval = app_config.XPERT_REPROBE_MIN_INTERVAL
+        self.healthy_max_interval = app_config.XPERT_REPROBE_HEALTHY_MAX_INTERVAL
+        self.dead_max_interval = app_config.XPERT_REPROBE_DEAD_MAX_INTERVAL
+        self.batch_size = app_config.XPERT_REPROBE_BATCH
+        self._lock = threading.Lock()
+        # Агрегация перезаписывает все конфиги: результаты перепроверки, начатой до или во время
+        # запуска агрегации, не применяются (иначе save_configs молча затрет их или они - ее данные)
+        self._apply_lock = threading.Lock()
+        self._aggregating = 0
+        self._generation = 0
+        self.states: Dict[str, EndpointState] = self._load_states()
+        # ID конфига -> endpoint; обновляется агрегацией, чтобы тик не читал все конфиги из хранилища
+        self._index: Optional[Dict[int, Endpoint]] = None
+
+    def _load_states(self) -> Dict[str, EndpointState]:
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return {d["key"]: EndpointState.from_dict(d) for d in data}
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            logger.warning(f"Failed to load probe state: {e}")
+            return {}
+
+    def _save_states(self):
+        try:
+            with self._lock:
+                data = [s.to_dict() for s in self.states.values()]
+            with open(self.state_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"Failed to save probe state: {e}")
+
+    @staticmethod
+    def _key(endpoint: Endpoint, address: Optional[str]) -> str:
+        """Ключ как у группировки в probe_engine: хосты с общим адресом - один endpoint"""
+        server, port, use_tls = endpoint
+        return f"{address or server.lower()}:{port}:{'tls' if use_tls else 'tcp'}"
+
+    @staticmethod
+    def _endpoint(config: AggregatedConfig) -> Endpoint:
+        return config.server, config.port, checker.should_use_tls_probe(config.raw, config.protocol, config.port)
+
+    def endpoint_key(self, config: AggregatedConfig) -> str:
+        return self._key(self._endpoint(config), dns_cache.peek(config.server))
+
+    def _build_index(self, configs: List[AggregatedConfig]) -> Dict[int, Endpoint]:
+        return {c.id: self._endpoint(c) for c in configs if c.server and c.port}
+
+    async def _group_ids(self) -> Dict[str, List[int]]:
+        """ID конфигов по endpoint'ам; адреса из DNS-кеша, промахи разрешаются"""
+        if self._index is None:
+            self._index = self._build_index(storage.get_configs())
+        index = self._index
+        hosts = list({server for server, _, _ in index.values()})
+        addresses = dict(zip(hosts, await asyncio.gather(*(dns_cache.resolve(h) for h in hosts))))
+        groups: Dict[str, List[int]] = {}
+        for config_id, endpoint in index.items():
+            groups.setdefault(self._key(endpoint, addresses.get(endpoint[0])), []).append(config_id)
+        return groups
+
+    def _interval(self, state: EndpointState) -> float:
+        """Интервал до следующей проверки по тиру endpoint'а (с разбросом ±15%)"""
+        if state.last_ok is None or state.streak < 2 or state.flap_count >= 2:
+            interval = self.min_interval
+        elif state.last_ok:
+            interval = min(self.healthy_max_interval, self.min_interval * 2 ** (state.streak - 1))
+        else:
+            interval = min(self.dead_max_interval, self.min_interval * 2 ** (state.streak - 1))
+        return interval * random.uniform(0.85, 1.15)
+
+    def _record(self, state: EndpointState, ok: bool, ping_ms: float, now: float):
+        if state.last_ok is not None and state.last_ok != ok:
+            state.flap_count += 1
+            state.streak = 1
+        else:
+            state.streak += 1
+            if state.streak % 5 == 0 and state.flap_count > 0:
+                state.flap_count -= 1
+        state.last_ok = ok
+        state.last_ping = float(ping_ms)
+        state.last_probe_at = now
+        state.next_probe_at = now + self._interval(state)
+
+    def _sync_states(self, groups: Dict[str, List[int]], now: float):
+        """Новые endpoint'ы получают случайный сдвиг, исчезнувшие удаляются"""
+        for key in groups:
+            if key not in self.states:
+                self.states[key] = EndpointState(
+                    key=key, next_probe_at=now + random.uniform(0, self.min_interval)
+                )
+        for key in [k for k in self.states if k not in groups]:
+            del self.states[key]
+
+    def begin_aggregation(self):
+        """Агрегация начинается; ждет применения уже идущей перепроверки"""
+        with self._apply_lock:
+            self._aggregating += 1
+            self._generation += 1
+
+    def end_aggregation(self):
+        with self._apply_lock:
+            self._aggregating = max(0, self._aggregating - 1)
+
+    def observe(self, configs: List[AggregatedConfig], probed: List[AggregatedConfig]):
+        """Учет результатов, полученных агрегацией; новые и исчезнувшие endpoint'ы - на следующем тике"""
+        now = time.time()
+        index = self._build_index(configs)
+        with self._lock:
+            self._index = index
+            seen = set()
+            for config in probed:
+                if not config.server or not config.port:
+                    continue
+                # Адреса проверенных хостов только что разрешены probe_engine и есть в кеше
+                key = self.endpoint_key(config)
+                if key in seen:
+                    continue
+                seen.add(key)
+                state = self.states.setdefault(key, EndpointState(key=key))
+                self._record(state, config.is_active, config.ping_ms, now)
+        self._save_states()
+
+    async def run_due(self) -> dict:
+        """Проверка endpoint'ов, у которых подошел срок"""
+        with self._apply_lock:
+            if self._aggregating:
+                return {"probed": 0, "changed": 0}
+            generation = self._generation
+        group_ids = await self._group_ids()
+        now = time.time()
+        with self._lock:
+            self._sync_states(group_ids, now)
+            due = sorted(
+                (s for s in self.states.values() if s.next_probe_at <= now),
+                key=lambda s: s.next_probe_at,
+            )[:self.batch_size]
+
+        if not due:
+            return {"probed": 0, "changed": 0}
+
+        # Из хранилища читаются только конфиги endpoint'ов, которым пора
+        rows = {c.id: c for c in storage.get_configs_by_ids(i for s in due for i in group_ids[s.key])}
+        groups = {s.key: [rows[i] for i in group_ids[s.key] if i in rows] for s in due}
+        due = [s for s in due if groups[s.key]]
+        if not due:
+            return {"probed": 0, "changed": 0}
+
+        results = await probe_engine.process_configs([groups[s.key][0].raw for s in due])
+
+        with self._apply_lock:
+            if self._aggregating or self._generation != generation:
+                # Конфиги уже перезаписаны или будут перезаписаны агрегацией со своими замерами
+                logger.info(f"Re-probe of {len(due)} endpoints discarded: aggregation ran meanwhile")
+                return {"probed": len(due), "changed": 0, "discarded": True}
+
+            now = time.time()
+            checked_at = datetime.utcnow().isoformat()
+            updated: List[AggregatedConfig] = []
+            flipped = set()
+            with self._lock:
+                for state, result in zip(due, results):
+                    ok = bool(result and result["is_active"])
+                    ping_ms = result["ping_ms"] if result else 999.0
+                    self._record(state, ok, ping_ms, now)
+                    for config in groups[state.key]:
+                        if config.is_active != ok:
+                            flipped.add(config.id)
+                        config.is_active = ok
+                        config.ping_ms = ping_ms
+                        config.ping_p90_ms = result["ping_p90_ms"] if result else 999.0
+                        config.jitter_ms = result["jitter_ms"] if result else 0.0
+                        config.packet_loss = result["packet_loss"] if result else 100.0
+                        config.last_check = checked_at
+                        updated.append(config)
+            applied = storage.update_configs(updated)
+        self._save_states()
+
+        if applied:
+            active_snapshots.publish(storage.get_configs())
+        changed_ids = sorted(c.id for c in applied if c.id in flipped)
+        if changed_ids:
+            # Изменения перепроверки добавляются к изменениям последней агрегации, а не заменяют их
+            pending = storage.get_change_set()
+            delta = ChangeSet(version=pending.version + 1, updated=changed_ids)
+            added = set(pending.added)
+            storage.save_change_set(ChangeSet(
+                version=delta.version,
+                added=list(pending.added),
+                removed=list(pending.removed),
+                updated=sorted((set(pending.updated) | set(changed_ids)) - added),
+            ))
+            try:
+                marzban_integration.sync_changed_configs_to_marzban(delta)
+            except Exception as e:
+                logger.error(f"Marzban integration failed: {e}")
+
+        logger.info(f"Re-probed {len(due)} endpoints ({len(applied)} configs), {len(changed_ids)} changed status")
+        return {"probed": len(due), "changed": len(changed_ids)}
+
+    def get_stats(self) -> dict:
+        """Распределение endpoint'ов по тирам"""
+        with self._lock:
+            states = list(self.states.values())
+        now = time.time()
+        return {
+            "endpoints": len(states),
+            "new": len([s for s in states if s.last_ok is None]),
+            "flapping": len([s for s in states if s.flap_count >= 2]),
+            "healthy": len([s for s in states if s.last_ok and s.flap_count < 2]),
+            "dead": len([s for s in states if s.last_ok is False and s.flap_count < 2]),
+            "due": len([s for s in states if s.next_probe_at <= now]),
+        }
+
+
+# Глобальный экземпляр планировщика
+probe_scheduler = ProbeScheduler()
@@ -0,0 +1,99 @@
+"""
+Менеджер запусков агрегации
+Одновременно идет не больше одного запуска; остальные запросы присоединяются к нему
+"""
+
+import asyncio
+import logging
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Awaitable, Callable, Optional, Tuple
+
+from app.xpert.models import AggregationRun
+
+logger = logging.getLogger(__name__)
+
+RunFactory = Callable[[AggregationRun], Awaitable[dict]]
+
+
+class AggregationRunManager:
+    """Single-flight для update_subscription из API, планировщика и удаления источников.
+
+    Запуск выполняется в event loop того, кто его начал; присоединившиеся ждут
+    concurrent.futures.Future, поэтому это работает и из других потоков/loop'ов.
+    """
+
+    def __init__(self, history_size: int = 20):
+        self.history_size = history_size
+        self._lock = threading.Lock()
+        self._active: Optional[AggregationRun] = None
+        self._future: Optional[Future] = None
+        self._task: Optional[asyncio.Task] = None
+        self._history: "OrderedDict[str, AggregationRun]" = OrderedDict()
+
+    @property
+    def active(self) -> Optional[AggregationRun]:
+        return self._active
+
+    def submit(self, factory: RunFactory, trigger: str) -> Tuple[AggregationRun, Future, bool]:
+        """Начинает запуск в текущем event loop или возвращает уже идущий: (run, future, joined)"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._active is not None:
+                self._active.joined += 1
+                logger.info(f"Aggregation requested by {trigger}, joining run {self._active.job_id}")
+                return self._active, self._future, True
+
+            run = AggregationRun(job_id=uuid.uuid4().hex[:12], trigger=trigger)
+            future: Future = Future()
+            self._active, self._future = run, future
+            self._history[run.job_id] = run
+            while len(self._history) > self.history_size:
+                self._history.popitem(last=False)
+            self._task = loop.create_task(self._execute(run, future, factory))
+
+        logger.info(f"Aggregation run {run.job_id} started by {trigger}")
+        return run, future, False
+
+    async def run(self, factory: RunFactory, trigger: str) -> dict:
+        """Запуск (или присоединение) с ожиданием результата"""
+        _, future, _ = self.submit(factory, trigger)
+        # shield: отмена одного ожидающего не должна отменять общий результат
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    async def _execute(self, run: AggregationRun, future: Future, factory: RunFactory):
+        try:
+            result = await factory(run)
+            run.status = "completed"
+            future.set_result(result)
+        except asyncio.CancelledError:
+            run.status = "failed"
+            run.error = "cancelled"
+            future.cancel()
+            raise
+        except Exception as e:
+            logger.error(f"Aggregation run {run.job_id} failed: {e}")
+            run.status = "failed"
+            run.error = str(e) or type(e).__name__
+            future.set_exception(e)
+        finally:
+            run.stage = "done"
+            run.finished_at = datetime.utcnow().isoformat()
+            with self._lock:
+                self._active = None
+                self._future = None
+                self._task = None
+
+    def get_run(self, job_id: str) -> Optional[AggregationRun]:
+        with self._lock:
+            return self._history.get(job_id)
+
+    def get_latest(self) -> Optional[AggregationRun]:
+        """Активный запуск, иначе последний завершенный"""
+        with self._lock:
+            if self._active is not None:
+                return self._active
+            return next(reversed(self._history.values()), None)
@@ -3,12 +3,22 @@ import base64
 import logging
 import json
 import os
-from datetime import datetime
-from typing import List, Optional
+import random
+import time
+from dataclasses import replace
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 
-from app.xpert.models import SubscriptionSource, AggregatedConfig
+from app.xpert.models import SubscriptionSource, AggregatedConfig, AggregationRun, ChangeSet
 from app.xpert.storage import storage
-from app.xpert.checker import checker
+from app.xpert.checker import checker, FetchResult
+from app.xpert.config_parser import parsed_config_cache
+from app.xpert.probe_engine import probe_engine
+from app.xpert.probe_cache import probe_cache
+from app.xpert.probe_scheduler import probe_scheduler
+from app.xpert.run_manager import AggregationRunManager
+from app.xpert.snapshot import ActiveConfigSnapshot, active_snapshots
+from app.xpert.dns_cache import dns_cache
 from app.xpert.marzban_integration import marzban_integration
 from app.xpert.direct_config_service import direct_config_service
 import config as app_config
@@ -21,8 +31,15 @@ class XpertService:
 
     def __init__(self):
         self.runtime_file = "data/xpert_runtime.json"
+        # Не больше одного запуска агрегации одновременно
+        self.runs = AggregationRunManager()
         self._load_runtime_settings()
 
+    @property
+    def is_updating(self) -> bool:
+        """Идет ли сейчас агрегация (плановые перепроверки в это время пропускаются)"""
+        return self.runs.active is not None
+
     def _load_runtime_settings(self):
         """Загружает runtime-настройки Xpert."""
         try:
@@ -66,14 +83,19 @@ class XpertService:
             raise ValueError("Target IP list cannot be empty")
         app_config.XPERT_TARGET_CHECK_IPS = unique
         checker.target_ips = unique
-        if hasattr(checker, "_target_probe_cache"):
-            checker._target_probe_cache = {"ts": 0.0, "ok": False, "avg_ping": 999.0, "success_count": 0}
         self._save_runtime_settings()
         return unique
     
-    def add_source(self, name: str, url: str, priority: int = 1) -> SubscriptionSource:
+    def add_source(
+        self,
+        name: str,
+        url: str,
+        priority: int = 1,
+        refresh_interval: Optional[int] = None,
+        probe_budget: Optional[int] = None,
+    ) -> SubscriptionSource:
         """Добавление источника подписки"""
-        return storage.add_source(name, url, priority)
+        return storage.add_source(name, url, priority, refresh_interval, probe_budget)
     
     def get_sources(self) -> List[SubscriptionSource]:
         """Получение всех источников"""
@@ -92,103 +114,499 @@ class XpertService:
         deleted = storage.delete_source(source_id)
         if not deleted:
             return False
+        active_snapshots.publish(storage.get_configs())
         # Re-sync with remaining enabled sources so Active Configurations and
         # generated subscriptions are immediately consistent.
         try:
-            loop = asyncio.get_event_loop()
-            if loop.is_running():
-                loop.create_task(self.update_subscription())
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                asyncio.run(self.update_subscription(trigger="delete_source"))
             else:
-                loop.run_until_complete(self.update_subscription())
-        except RuntimeError:
-            asyncio.run(self.update_subscription())
+                self.start_update(trigger="delete_source")
         except Exception as e:
             logger.warning(f"Failed to refresh after deleting source {source_id}: {e}")
         return True
     
     def get_active_configs(self) -> List[AggregatedConfig]:
-        """Получение активных конфигураций"""
-        return storage.get_active_configs()
+        """Получение активных конфигураций (из текущего снимка)"""
+        return list(active_snapshots.get().configs)
+
+    def get_active_snapshot(self) -> ActiveConfigSnapshot:
+        """Текущий снимок активных конфигов без копирования; version подходит как ключ кеша"""
+        return active_snapshots.get()
     
     def get_all_configs(self) -> List[AggregatedConfig]:
         """Получение всех конфигураций"""
         return storage.get_configs()
     
-    async def update_subscription(self) -> dict:
-        """Обновление всех подписок"""
+    def _breaker_allows(self, source: SubscriptionSource, now: datetime) -> bool:
+        """Можно ли запрашивать источник; по истечении backoff breaker переходит в half_open"""
+        if source.breaker_state != "open":
+            return True
+        try:
+            retry_at = datetime.fromisoformat(source.next_attempt_at)
+        except (TypeError, ValueError):
+            retry_at = now
+        if now < retry_at:
+            return False
+        source.breaker_state = "half_open"
+        logger.info(f"Source {source.name}: circuit half-open, sending trial request")
+        return True
+
+    def _record_source_failure(self, source: SubscriptionSource, error: str, now: datetime):
+        """Учет ошибки загрузки; после порога или неудачной пробы breaker открывается"""
+        source.failure_count += 1
+        source.last_error = error[:300]
+        threshold = app_config.XPERT_SOURCE_BREAKER_THRESHOLD
+        if source.breaker_state == "half_open" or source.failure_count >= threshold:
+            backoff = min(
+                app_config.XPERT_SOURCE_BREAKER_MAX_SEC,
+                app_config.XPERT_SOURCE_BREAKER_BASE_SEC * 2 ** max(0, source.failure_count - threshold),
+            )
+            source.breaker_state = "open"
+            source.next_attempt_at = (now + timedelta(seconds=backoff)).isoformat()
+            logger.warning(
+                f"Source {source.name}: circuit open after {source.failure_count} failures, "
+                f"next attempt in {backoff}s"
+            )
+
+    def _record_source_success(self, source: SubscriptionSource):
+        if source.breaker_state != "closed" or source.failure_count:
+            logger.info(f"Source {source.name}: circuit closed")
+        source.breaker_state = "closed"
+        source.failure_count = 0
+        source.next_attempt_at = None
+        source.last_error = None
+
+    def get_refresh_interval(self, source: SubscriptionSource) -> int:
+        """Интервал обновления источника: явный или JOB_SUBSCRIPTION_AGGREGATION_INTERVAL / priority"""
+        if source.refresh_interval:
+            return source.refresh_interval
+        interval = app_config.JOB_SUBSCRIPTION_AGGREGATION_INTERVAL // max(1, source.priority)
+        return max(app_config.XPERT_SOURCE_MIN_REFRESH_SEC, interval)
+
+    def get_probe_budget(self, source: SubscriptionSource) -> int:
+        """Сколько конфигов источника проверяется за одно обновление (0 - без ограничения)"""
+        if source.probe_budget is not None:
+            return max(0, source.probe_budget)
+        return app_config.XPERT_SOURCE_PROBE_BUDGET * max(1, source.priority)
+
+    def _schedule_next_refresh(self, source: SubscriptionSource, now: datetime):
+        # ±10%: источники с одинаковым интервалом со временем расходятся и не загружаются разом
+        interval = self.get_refresh_interval(source) * random.uniform(0.9, 1.1)
+        source.next_refresh_at = (now + timedelta(seconds=interval)).isoformat()
+
+    def get_due_sources(
+        self, sources: Optional[List[SubscriptionSource]] = None, now: Optional[datetime] = None
+    ) -> List[SubscriptionSource]:
+        """Источники, которым пора обновиться; не больше XPERT_SOURCE_MAX_PER_TICK за раз.
+
+        Первыми идут источники с большим priority, затем дольше всех ожидающие.
+        Новые источники (без next_refresh_at) обновляются при ближайшей возможности.
+        """
+        now = now or datetime.utcnow()
+        if sources is None:
+            sources = self.get_enabled_sources()
+        due = []
+        for source in sources:
+            try:
+                due_at = datetime.fromisoformat(source.next_refresh_at)
+            except (TypeError, ValueError):
+                due_at = datetime.min
+            if due_at <= now:
+                due.append((due_at, source))
+        due.sort(key=lambda item: (-item[1].priority, item[0]))
+        limit = app_config.XPERT_SOURCE_MAX_PER_TICK
+        return [source for _, source in (due[:limit] if limit > 0 else due)]
+
+    def has_orphaned_configs(self, sources: Optional[List[SubscriptionSource]] = None) -> bool:
+        """В снимке остались конфиги выключенных или удаленных источников"""
+        if sources is None:
+            sources = self.get_enabled_sources()
+        enabled_ids = {s.id for s in sources}
+        return any(c.source_id not in enabled_ids for c in active_snapshots.get().configs)
+
+    def set_source_schedule(
+        self,
+        source_id: int,
+        priority: Optional[int] = None,
+        refresh_interval: Optional[int] = None,
+        probe_budget: Optional[int] = None,
+    ) -> Optional[SubscriptionSource]:
+        """Приоритет и явные интервал/бюджет источника; None у интервала и бюджета - вывод из priority"""
+        source = next((s for s in storage.get_sources() if s.id == source_id), None)
+        if source is None:
+            return None
+        if priority is not None:
+            source.priority = priority
+        source.refresh_interval = refresh_interval
+        source.probe_budget = probe_budget
+        # Более короткий интервал действует сразу, а не после уже запланированного обновления
+        soonest = datetime.utcnow() + timedelta(seconds=self.get_refresh_interval(source))
+        try:
+            if datetime.fromisoformat(source.next_refresh_at) > soonest:
+                source.next_refresh_at = soonest.isoformat()
+        except (TypeError, ValueError):
+            pass
+        storage.update_source(source)
+        return source
+
+    async def _fetch_source(self, client, source: SubscriptionSource, conditional: bool) -> Optional[FetchResult]:
+        """Загрузка одного источника; условный запрос только если есть что переносить.
+
+        None - источник пропущен открытым breaker'ом.
+        """
+        if not self._breaker_allows(source, datetime.utcnow()):
+            logger.info(f"Source {source.name} skipped: circuit open until {source.next_attempt_at}")
+            return None
+        logger.info(f"Fetching configs from: {source.name} ({source.url})")
+        if not conditional:
+            return await checker.fetch_subscription_conditional(client, source.url)
+        return await checker.fetch_subscription_conditional(
+            client, source.url, etag=source.etag, last_modified=source.last_modified
+        )
+
+    def _is_stale(self, config: AggregatedConfig, now: datetime) -> bool:
+        """Нужна ли повторная проверка конфига по возрасту last_check"""
+        try:
+            checked = datetime.fromisoformat(config.last_check)
+        except (TypeError, ValueError):
+            return True
+        return (now - checked).total_seconds() >= app_config.XPERT_REPROBE_AFTER_SEC
+
+    def _apply_probe_result(self, row: AggregatedConfig, probed: dict):
+        row.protocol = probed["protocol"]
+        row.server = probed["server"]
+        row.port = probed["port"]
+        row.remarks = probed["remarks"]
+        row.ping_ms = probed["ping_ms"]
+        row.ping_p90_ms = probed["ping_p90_ms"]
+        row.jitter_ms = probed["jitter_ms"]
+        row.packet_loss = probed["packet_loss"]
+        row.is_active = probed["is_active"]
+        row.last_check = probed.get("checked_at") or datetime.utcnow().isoformat()
+
+    def _build_change_set(self, previous: List[AggregatedConfig], current: List[AggregatedConfig]) -> ChangeSet:
+        """Сравнение результата запуска с предыдущим состоянием"""
+        previous_by_id = {c.id: c for c in previous}
+        current_ids = {c.id for c in current}
+        change_set = ChangeSet(version=storage.get_change_set().version + 1)
+        for config in current:
+            before = previous_by_id.get(config.id)
+            if before is None:
+                change_set.added.append(config.id)
+            elif before.raw != config.raw or before.is_active != config.is_active:
+                change_set.updated.append(config.id)
+        change_set.removed = [c.id for c in previous if c.id not in current_ids]
+        return change_set
+
+    def get_change_set(self) -> ChangeSet:
+        """Изменения последнего запуска агрегации"""
+        return storage.get_change_set()
+
+    def start_update(self, trigger: str = "api") -> Tuple[AggregationRun, bool]:
+        """Запуск агрегации в фоне или присоединение к идущей: (run, joined)"""
+        run, _, joined = self.runs.submit(self._run_aggregation, trigger)
+        return run, joined
+
+    async def update_subscription(self, trigger: str = "manual") -> dict:
+        """Инкрементальное обновление всех подписок (с ожиданием результата)"""
+        return await self.runs.run(self._run_aggregation, trigger)
+
+    def get_update_run(self, job_id: Optional[str] = None) -> Optional[AggregationRun]:
+        """Прогресс запуска по job_id; без него - активный или последний запуск"""
+        if job_id:
+            return self.runs.get_run(job_id)
+        return self.runs.get_latest()
+
+    async def _run_aggregation(self, run: AggregationRun) -> dict:
+        """Запуск агрегации; перепроверки, идущие в это время, свои результаты не применяют"""
+        probe_scheduler.begin_aggregation()
+        try:
+            return await self._update_subscription(run)
+        finally:
+            probe_scheduler.end_aggregation()
+
+    async def _update_subscription(self, run: AggregationRun) -> dict:
+        started = time.monotonic()
         sources = self.get_enabled_sources()
+        # Плановый запуск обновляет только источники, которым пора; ручной - все
+        refreshing = self.get_due_sources(sources) if run.trigger == "schedule" else sources
+        refreshing_ids = {s.id for s in refreshing}
+        run.sources_total = len(refreshing)
+        previous = storage.get_configs()
+        for config in previous:
+            # Пересчитывается всегда: отпечатки, сохраненные прежним способом, сопоставляются с новыми
+            config.fingerprint = checker.fingerprint(config.raw)
         
         if not sources:
             logger.warning("No enabled sources found")
             # If there are no enabled sources, clear aggregated source configs.
             # Direct Configurations are stored separately and are not touched.
             storage.clear_configs()
+            active_snapshots.publish([])
+            storage.save_change_set(self._build_change_set(previous, []))
+            probe_scheduler.observe([], [])
             return {"active_configs": 0, "total_configs": 0}
         
-        all_configs = []
-        total_configs = 0
-        active_configs = 0
-        config_id = 1
-        
-        for source in sources:
+        previous_by_source: Dict[int, List[AggregatedConfig]] = {}
+        previous_by_key = {}
+        for config in previous:
+            previous_by_source.setdefault(config.source_id, []).append(config)
+            previous_by_key[(config.source_id, config.fingerprint)] = config
+
+        # Все источники загружаются параллельно через один пул соединений,
+        # одновременно прогревается DNS-кеш для уже известных серверов.
+        async def fetch(client, source: SubscriptionSource) -> Optional[FetchResult]:
             try:
-                logger.info(f"Fetching configs from: {source.name} ({source.url})")
-                raw_configs = await checker.fetch_subscription(source.url)
-                logger.info(f"Fetched {len(raw_configs)} raw configs from {source.name}")
-                
-                source.last_fetched = datetime.utcnow().isoformat()
-                source.config_count = len(raw_configs)
-                
-                source_active = 0
-                for raw in raw_configs:
-                    result = checker.process_config(raw)
-                    if result:
-                        config_obj = AggregatedConfig(
-                            id=config_id,
-                            raw=result["raw"],
-                            protocol=result["protocol"],
-                            server=result["server"],
-                            port=result["port"],
-                            remarks=result["remarks"],
-                            source_id=source.id,
-                            ping_ms=result["ping_ms"],
-                            jitter_ms=result["jitter_ms"],
-                            packet_loss=result["packet_loss"],
-                            is_active=result["is_active"],
-                            last_check=datetime.utcnow().isoformat()
-                        )
-                        all_configs.append(config_obj)
-                        config_id += 1
-                        total_configs += 1
-                        if result["is_active"]:
-                            active_configs += 1
-                            source_active += 1
-                
-                source.success_rate = 100.0  # Все конфиги активные
-                storage.update_source(source)
-                
-                logger.info(f"Source {source.name}: {source_active}/{len(raw_configs)} configs added")
-                
-            except Exception as e:
-                logger.error(f"Failed to process source {source.name}: {e}")
-                import traceback
-                logger.error(traceback.format_exc())
+                return await self._fetch_source(client, source, conditional=source.id in previous_by_source)
+            finally:
+                run.sources_fetched += 1
+
+        async with checker.build_http_client() as client:
+            fetched, _ = await asyncio.gather(
+                asyncio.gather(*(fetch(client, s) for s in refreshing), return_exceptions=True),
+                dns_cache.prefetch(
+                    c.server for source_id in refreshing_ids for c in previous_by_source.get(source_id, [])
+                ),
+            )
+        fetched_by_source = dict(zip((s.id for s in refreshing), fetched))
+
+        now = datetime.utcnow()
+        rows_by_source: Dict[int, List[AggregatedConfig]] = {}
+        # Новые, изменившиеся и устаревшие записи; остальные переносятся без проверки.
+        to_probe: List[AggregatedConfig] = []
+        probe_by_source: Dict[int, List[AggregatedConfig]] = {}
+        # Сверх бюджета источника: публикуются с прошлым состоянием, проверяются в следующий раз
+        deferred: List[AggregatedConfig] = []
+        changed_sources = []
+
+        for source in sources:
+            if source.id not in refreshing_ids:
+                # Источнику еще рано обновляться: конфиги переносятся как есть.
+                rows_by_source[source.id] = [replace(c) for c in previous_by_source.get(source.id, [])]
+                continue
+
+            self._schedule_next_refresh(source, now)
+            result = fetched_by_source[source.id]
+            source_probe: List[AggregatedConfig] = []
+            if result is None:
+                # Breaker открыт: источник не запрашивался, его конфиги переносятся как есть.
+                rows = [replace(c) for c in previous_by_source.get(source.id, [])]
+            elif isinstance(result, Exception) or not result.ok:
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to fetch source {source.name}: {result}")
+                    error = str(result) or type(result).__name__
+                else:
+                    error = result.error or "fetch failed"
+                self._record_source_failure(source, error, now)
+                # Недоступный источник не удаляет свои конфиги: они остаются до следующей загрузки.
+                rows = [replace(c) for c in previous_by_source.get(source.id, [])]
                 source.success_rate = 0
+            else:
+                self._record_source_success(source)
+                source.last_fetched = now.isoformat()
+                unchanged = result.not_modified or (
+                    result.content_hash is not None and result.content_hash == source.content_hash
+                )
+                if unchanged and source.id in previous_by_source:
+                    # Фид не изменился: не парсим, переносим прошлые конфиги.
+                    rows = [replace(c) for c in previous_by_source[source.id]]
+                    source.etag = result.etag or source.etag
+                    source.last_modified = result.last_modified or source.last_modified
+                    logger.info(f"Source {source.name} unchanged, kept {len(rows)} configs")
+                else:
+                    logger.info(f"Fetched {len(result.configs)} raw configs from {source.name}")
+                    rows = []
+                    seen = set()
+                    duplicates = 0
+                    for raw in result.configs:
+                        canonical = parsed_config_cache.get(raw).canonical
+                        if canonical in seen:
+                            duplicates += 1
+                            continue
+                        seen.add(canonical)
+                        fingerprint = checker.fingerprint(raw)
+                        before = previous_by_key.get((source.id, fingerprint))
+                        if before is None:
+                            row = AggregatedConfig(raw=raw, source_id=source.id, fingerprint=fingerprint)
+                            source_probe.append(row)
+                        else:
+                            row = replace(before, raw=raw)
+                            if before.raw != raw:
+                                source_probe.append(row)
+                        rows.append(row)
+                    source.config_count = len(rows)
+                    source.duplicate_count = duplicates
+                    source.etag = result.etag
+                    source.last_modified = result.last_modified
+                    source.content_hash = result.content_hash
+                    changed_sources.append(source)
+                source.success_rate = 100.0  # Все конфиги активные
+
+            # После новых и изменившихся - устаревшие, самые давно проверенные первыми
+            probing = {id(c) for c in source_probe}
+            source_probe.extend(sorted(
+                (c for c in rows if id(c) not in probing and self._is_stale(c, now)),
+                key=lambda c: c.last_check or "",
+            ))
+            probe_by_source[source.id] = source_probe
+            rows_by_source[source.id] = rows
+
+        # Копии одного сервера из разных фидов: остается копия источника с большим priority
+        claimed = set()
+        dropped = set()
+        counters_changed = set()
+        for source in sorted(sources, key=lambda s: (-s.priority, s.id)):
+            kept = []
+            for row in rows_by_source[source.id]:
+                canonical = parsed_config_cache.get(row.raw).canonical
+                if canonical in claimed:
+                    dropped.add(id(row))
+                    continue
+                claimed.add(canonical)
+                kept.append(row)
+            cross_duplicates = len(rows_by_source[source.id]) - len(kept)
+            if source.cross_duplicate_count != cross_duplicates:
+                source.cross_duplicate_count = cross_duplicates
+                counters_changed.add(source.id)
+            rows_by_source[source.id] = kept
+        if dropped:
+            logger.info(f"Dropped {len(dropped)} configs duplicated by higher-priority sources")
+
+        for source in refreshing:
+            source_probe = [c for c in probe_by_source[source.id] if id(c) not in dropped]
+            budget = self.get_probe_budget(source)
+            if budget and len(source_probe) > budget:
+                logger.info(f"Source {source.name}: probe budget {budget}, deferred {len(source_probe) - budget}")
+                for row in source_probe[budget:]:
+                    if not row.server:
+                        parsed = parsed_config_cache.get(row.raw)
+                        row.protocol, row.server = parsed.protocol, parsed.host
+                        row.port, row.remarks = parsed.port, parsed.remark
+                    row.last_check = ""
+                deferred.extend(source_probe[budget:])
+                source_probe = source_probe[:budget]
+            to_probe.extend(source_probe)
+
+        def on_probe_progress(done: int, total: int, active: int):
+            run.endpoints_probed, run.endpoints_total, run.endpoints_active = done, total, active
+
+        # Результаты прерванного запуска (рестарт, падение потока) не проверяются повторно.
+        resumed = storage.load_checkpoint(app_config.XPERT_REPROBE_AFTER_SEC)
+        carried = [resumed[c.raw] for c in to_probe if c.raw in resumed]
+        pending = [c for c in to_probe if c.raw not in resumed]
+        for row in to_probe:
+            if row.raw in resumed:
+                self._apply_probe_result(row, resumed[row.raw])
+        if carried:
+            logger.info(f"Resumed {len(carried)} probe results from checkpoint")
+        storage.start_checkpoint(run.job_id, carried)
+
+        checkpoint_buffer: List[dict] = []
+        last_flush = [time.monotonic()]
+
+        def flush_checkpoint():
+            storage.append_checkpoint(checkpoint_buffer)
+            checkpoint_buffer.clear()
+            last_flush[0] = time.monotonic()
+
+        def on_probe_result(index: int, result: dict):
+            checkpoint_buffer.append({**result, "checked_at": datetime.utcnow().isoformat()})
+            if (len(checkpoint_buffer) >= app_config.XPERT_CHECKPOINT_BATCH
+                    or time.monotonic() - last_flush[0] >= 2.0):
+                flush_checkpoint()
+
+        deadline = app_config.XPERT_AGGREGATION_DEADLINE_SEC
+        budget = max(1.0, deadline - (time.monotonic() - started)) if deadline > 0 else None
+
+        run.stage = "probing"
+        run.configs_to_probe = len(pending)
+        probe_results = await probe_engine.process_configs(
+            [c.raw for c in pending],
+            progress=on_probe_progress,
+            on_result=on_probe_result,
+            deadline=budget,
+        )
+        flush_checkpoint()
+        run.stage = "saving"
+
+        unparsed = set()
+        skipped = []
+        for row, probed in zip(pending, probe_results):
+            if not probed:
+                unparsed.add(id(row))
+            elif not probed["probed"]:
+                # Дедлайн: конфиг публикуется с прошлым состоянием и проверяется первым в следующий раз.
+                skipped.append(row)
+                if not row.server:
+                    row.protocol, row.server = probed["protocol"], probed["server"]
+                    row.port, row.remarks = probed["port"], probed["remarks"]
+                row.last_check = ""
+            else:
+                self._apply_probe_result(row, probed)
+        run.skipped_configs = len(skipped)
+        if skipped:
+            logger.warning(f"Aggregation deadline ({deadline}s) reached, {len(skipped)} configs left unprobed")
+
+        all_configs = []
+        for source in sources:
+            rows = [c for c in rows_by_source.get(source.id, []) if id(c) not in unparsed]
+            rows_by_source[source.id] = rows
+            all_configs.extend(rows)
+        for source in sources:
+            if source.id in refreshing_ids or source.id in counters_changed:
                 storage.update_source(source)
-        
+        for source in changed_sources:
+            source_active = len([c for c in rows_by_source[source.id] if c.is_active])
+            logger.info(f"Source {source.name}: {source_active}/{source.config_count} configs added")
+
+        # Стабильные ID: существующие записи сохраняют свой ID, новые получают следующий свободный.
+        new_rows = [c for c in all_configs if not c.id]
+        if new_rows:
+            next_id = storage.reserve_config_ids(
+                len(new_rows), floor=max((c.id for c in previous), default=0) + 1
+            )
+            for offset, config in enumerate(new_rows):
+                config.id = next_id + offset
+
+        change_set = self._build_change_set(previous, all_configs)
+        total_configs = len(all_configs)
+        active_configs = len([c for c in all_configs if c.is_active])
+        run.total_configs, run.active_configs = total_configs, active_configs
+
         storage.save_configs(all_configs)
-        logger.info(f"Subscription update complete: {active_configs}/{total_configs} active configs")
+        active_snapshots.publish(all_configs)
+        storage.save_change_set(change_set)
+        storage.clear_checkpoint()
+        skipped_ids = {id(c) for c in skipped}
+        probe_scheduler.observe(all_configs, [c for c in to_probe if id(c) not in unparsed and id(c) not in skipped_ids])
+        logger.info(
+            f"Subscription update complete: {active_configs}/{total_configs} active configs, "
+            f"probed {len(to_probe) - len(skipped)}, +{len(change_set.added)} -{len(change_set.removed)} "
+            f"~{len(change_set.updated)}"
+        )
         
-        # Синхронизация с Marzban
+        # Синхронизация с Marzban: только добавленные и изменившиеся конфиги
         try:
-            sync_result = marzban_integration.sync_active_configs_to_marzban()
+            sync_result = marzban_integration.sync_changed_configs_to_marzban(change_set)
             logger.info(f"Marzban sync result: {sync_result}")
             # NOTE: do not cleanup hosts globally here.
             # Cleanup removed user-created and non-Xpert hosts unexpectedly.
         except Exception as e:
             logger.error(f"Marzban integration failed: {e}")
         
-        return {"active_configs": active_configs, "total_configs": total_configs}
+        return {
+            "active_configs": active_configs,
+            "total_configs": total_configs,
+            "probed_configs": len(to_probe) - len(skipped),
+            "skipped_configs": len(skipped),
+            "deferred_configs": len(deferred),
+            "duplicates_dropped": len(dropped),
+            "refreshed_sources": len(refreshing),
+            "changes": change_set.to_dict(),
+        }
     
     def generate_subscription(self, format: str = "universal") -> str:
         """Генерация подписки в указанном формате с учетом прямых конфигураций"""
@@ -211,7 +629,16 @@ class XpertService:
     
     def get_stats(self) -> dict:
         """Получение статистики"""
-        stats = storage.get_stats()
+        # Конфиги - из готовой статистики снимка, без загрузки из хранилища
+        snapshot = active_snapshots.get()
+        sources = storage.get_sources()
+        stats = {
+            "total_sources": len(sources),
+            "enabled_sources": sum(1 for s in sources if s.enabled),
+            "total_configs": snapshot.stats.get("total_configs", 0),
+            "active_configs": snapshot.stats.get("active_configs", 0),
+            "avg_ping": snapshot.stats.get("avg_ping", 0),
+        }
         direct_configs = direct_config_service.get_all_configs()
         direct_active = [c for c in direct_configs if c.is_active]
 
@@ -226,6 +653,11 @@ class XpertService:
         total_active = stats.get("active_configs", 0)
         stats["avg_ping"] = weighted_ping_sum / total_active if total_active > 0 else 0
 
+        stats["dns_cache"] = dns_cache.get_stats()
+        stats["probe_scheduler"] = probe_scheduler.get_stats()
+        stats["parse_cache"] = parsed_config_cache.get_stats()
+        stats["snapshot_version"] = snapshot.version
+        stats["probe_cache"] = probe_cache.get_stats()
         stats["target_ips"] = app_config.XPERT_TARGET_CHECK_IPS
         stats["domain"] = app_config.XPERT_DOMAIN
         return stats
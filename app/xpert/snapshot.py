@@ -0,0 +1,92 @@
+"""
+Снимок активных конфигов для читателей (подписки, API)
+Агрегация собирает новый снимок в стороне и подменяет ссылку; читатели не трогают хранилище
+"""
+
+import logging
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from types import MappingProxyType
+from typing import Callable, Iterable, Mapping, Optional, Tuple
+
+from app.xpert.models import AggregatedConfig
+from app.xpert.storage import storage
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class ActiveConfigSnapshot:
+    """Неизменяемый снимок: активные конфиги по возрастанию ping и готовая статистика.
+
+    Конфиги в снимке - собственные копии; менять их нельзя, снимок разделяется всеми читателями.
+    """
+    version: int = 0
+    configs: Tuple[AggregatedConfig, ...] = ()
+    stats: Mapping[str, object] = field(default_factory=lambda: MappingProxyType({}))
+    created_at: str = ""
+
+
+class ActiveConfigSnapshots:
+    """Текущий снимок и его публикация; версия растет монотонно и переживает рестарт"""
+
+    def __init__(self, loader: Callable[[], Iterable[AggregatedConfig]]):
+        # loader - все конфиги из хранилища, для первого снимка после старта
+        self._loader = loader
+        self._current: Optional[ActiveConfigSnapshot] = None
+        self._lock = threading.Lock()
+        self._version = 0
+
+    @staticmethod
+    def _build_stats(configs: Tuple[AggregatedConfig, ...], total: int) -> Mapping[str, object]:
+        protocols = {}
+        for config in configs:
+            protocols[config.protocol] = protocols.get(config.protocol, 0) + 1
+        return MappingProxyType({
+            "total_configs": total,
+            "active_configs": len(configs),
+            "avg_ping": sum(c.ping_ms for c in configs) / len(configs) if configs else 0,
+            "protocols": MappingProxyType(protocols),
+        })
+
+    def publish(self, configs: Iterable[AggregatedConfig]) -> ActiveConfigSnapshot:
+        """Собирает снимок из всех конфигов запуска и атомарно делает его текущим"""
+        total = 0
+        active = []
+        for config in configs:
+            total += 1
+            if config.is_active:
+                active.append(replace(config))
+        active.sort(key=lambda c: c.ping_ms)
+        frozen = tuple(active)
+        stats = self._build_stats(frozen, total)
+
+        with self._lock:
+            # Миллисекунды как нижняя граница: версия не откатывается после рестарта
+            self._version = max(self._version + 1, int(time.time() * 1000))
+            snapshot = ActiveConfigSnapshot(
+                version=self._version,
+                configs=frozen,
+                stats=stats,
+                created_at=datetime.utcnow().isoformat(),
+            )
+            self._current = snapshot
+        logger.debug(f"Published active configs snapshot v{snapshot.version}: {len(frozen)}/{total}")
+        return snapshot
+
+    def get(self) -> ActiveConfigSnapshot:
+        """Текущий снимок без обращения к хранилищу; первый вызов после старта строит его из хранилища"""
+        snapshot = self._current
+        if snapshot is not None:
+            return snapshot
+        try:
+            return self.publish(self._loader())
+        except Exception as e:
+            logger.error(f"Failed to build active configs snapshot: {e}")
+            return ActiveConfigSnapshot()
+
+
+# Глобальный экземпляр снимков
+active_snapshots = ActiveConfigSnapshots(lambda: storage.get_configs())
@@ -0,0 +1,305 @@
+"""
+Табличное хранилище Xpert (SQLAlchemy, по умолчанию SQLite)
+Источники и конфиги в таблицах с индексами; change set, meta и checkpoint остаются файлами
+"""
+
+import logging
+import os
+from dataclasses import fields
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Float,
+    Index,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    and_,
+    create_engine,
+    delete,
+    func,
+    inspect,
+    insert,
+    select,
+    text,
+    update,
+)
+
+from app.xpert.models import AggregatedConfig, SubscriptionSource
+from app.xpert.storage import XpertStorage
+
+logger = logging.getLogger(__name__)
+
+metadata = MetaData()
+
+sources_table = Table(
+    "xpert_sources",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("name", String(255), nullable=False, default=""),
+    Column("url", Text, nullable=False, default=""),
+    Column("enabled", Boolean, nullable=False, default=True, index=True),
+    Column("priority", Integer, nullable=False, default=1),
+    Column("last_fetched", String(64)),
+    Column("config_count", Integer, nullable=False, default=0),
+    Column("success_rate", Float, nullable=False, default=0.0),
+    Column("created_at", String(64)),
+    Column("etag", String(512)),
+    Column("last_modified", String(128)),
+    Column("content_hash", String(128)),
+    Column("breaker_state", String(16), nullable=False, default="closed"),
+    Column("failure_count", Integer, nullable=False, default=0),
+    Column("next_attempt_at", String(64)),
+    Column("last_error", Text),
+    Column("refresh_interval", Integer),
+    Column("probe_budget", Integer),
+    Column("next_refresh_at", String(64)),
+    Column("duplicate_count", Integer, nullable=False, default=0),
+    Column("cross_duplicate_count", Integer, nullable=False, default=0),
+)
+
+configs_table = Table(
+    "xpert_configs",
+    metadata,
+    # Порядок строк как в результате агрегации (аналог порядка в configs.json)
+    Column("position", Integer, primary_key=True),
+    Column("id", Integer, nullable=False, index=True),
+    Column("raw", Text, nullable=False),
+    Column("protocol", String(32), nullable=False, default=""),
+    Column("server", String(255), nullable=False, default=""),
+    Column("port", Integer, nullable=False, default=0),
+    Column("remarks", Text, nullable=False, default=""),
+    Column("source_id", Integer, nullable=False, default=0, index=True),
+    Column("ping_ms", Float, nullable=False, default=999.0, index=True),
+    Column("jitter_ms", Float, nullable=False, default=0.0),
+    Column("packet_loss", Float, nullable=False, default=0.0),
+    Column("is_active", Boolean, nullable=False, default=False, index=True),
+    Column("last_check", String(64), nullable=False, default=""),
+    Column("fingerprint", String(64), nullable=False, default=""),
+    Column("ping_p90_ms", Float, nullable=False, default=999.0),
+    # Путь подписки: WHERE is_active ORDER BY ping_ms
+    Index("ix_xpert_configs_active_ping", "is_active", "ping_ms"),
+)
+
+_SOURCE_FIELDS = [f.name for f in fields(SubscriptionSource)]
+_CONFIG_FIELDS = [f.name for f in fields(AggregatedConfig)]
+
+
+class SqlXpertStorage(XpertStorage):
+    """XpertStorage на таблицах: чтения - индексные запросы, запись - по строкам или одной транзакцией"""
+
+    def __init__(self, db_url: str = ""):
+        super().__init__()
+        if not db_url:
+            db_url = f"sqlite:///{os.path.join(self.data_dir, 'xpert.db')}"
+        elif "://" not in db_url:
+            db_url = f"sqlite:///{db_url}"
+        self.db_url = db_url
+        if db_url.startswith("sqlite"):
+            self.engine = create_engine(db_url, connect_args={"check_same_thread": False})
+        else:
+            self.engine = create_engine(db_url, pool_recycle=3600, pool_timeout=10)
+        self._init_db()
+
+    def _init_db(self):
+        metadata.create_all(self.engine)
+        self._add_missing_columns()
+        if self.engine.dialect.name == "sqlite":
+            with self.engine.begin() as conn:
+                conn.execute(text("PRAGMA journal_mode=WAL"))
+        self._import_json()
+        logger.info(f"Xpert storage tables initialized: {self.db_url}")
+
+    def _add_missing_columns(self):
+        """Новые поля моделей в уже созданных таблицах (ALTER TABLE ADD COLUMN)"""
+        inspector = inspect(self.engine)
+        for table in (sources_table, configs_table):
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                column_type = column.type.compile(dialect=self.engine.dialect)
+                default = column.default.arg if column.default is not None else None
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"
+                if default is not None:
+                    ddl += f" DEFAULT {int(default) if isinstance(default, bool) else repr(default)}"
+                with self.engine.begin() as conn:
+                    conn.execute(text(ddl))
+                logger.info(f"Added column {table.name}.{column.name}")
+
+    def _import_json(self):
+        """Однократный перенос sources.json / configs.json; файлы остаются как резервная копия"""
+        meta = self._load_json_dict(self.meta_file)
+        if meta.get("sql_imported_at"):
+            return
+        sources = [SubscriptionSource.from_dict(d) for d in self._load_json(self.sources_file)]
+        configs = [AggregatedConfig.from_dict(d) for d in self._load_json(self.configs_file)]
+        with self.engine.begin() as conn:
+            has_rows = conn.execute(select(func.count()).select_from(sources_table)).scalar() or conn.execute(
+                select(func.count()).select_from(configs_table)
+            ).scalar()
+            if not has_rows:
+                if sources:
+                    conn.execute(insert(sources_table), [s.to_dict() for s in sources])
+                if configs:
+                    conn.execute(insert(configs_table), [c.to_dict() for c in configs])
+        if sources or configs:
+            logger.info(f"Imported {len(sources)} sources and {len(configs)} configs from JSON")
+        meta["sql_imported_at"] = datetime.utcnow().isoformat()
+        self._save_json(self.meta_file, meta)
+
+    @staticmethod
+    def _source(row) -> SubscriptionSource:
+        data = row._mapping
+        return SubscriptionSource.from_dict({k: data[k] for k in _SOURCE_FIELDS if k in data})
+
+    @staticmethod
+    def _config(row) -> AggregatedConfig:
+        data = row._mapping
+        return AggregatedConfig.from_dict({k: data[k] for k in _CONFIG_FIELDS if k in data})
+
+    # Sources
+    def get_sources(self) -> List[SubscriptionSource]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(sources_table).order_by(sources_table.c.id))
+            return [self._source(r) for r in rows]
+
+    def get_enabled_sources(self) -> List[SubscriptionSource]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(sources_table).where(sources_table.c.enabled.is_(True)).order_by(sources_table.c.id)
+            )
+            return [self._source(r) for r in rows]
+
+    def _get_source(self, conn, source_id: int) -> Optional[SubscriptionSource]:
+        row = conn.execute(select(sources_table).where(sources_table.c.id == source_id)).first()
+        return self._source(row) if row else None
+
+    def add_source(
+        self,
+        name: str,
+        url: str,
+        priority: int = 1,
+        refresh_interval: Optional[int] = None,
+        probe_budget: Optional[int] = None,
+    ) -> SubscriptionSource:
+        with self.engine.begin() as conn:
+            new_id = (conn.execute(select(func.max(sources_table.c.id))).scalar() or 0) + 1
+            source = SubscriptionSource(
+                id=new_id,
+                name=name,
+                url=url,
+                priority=priority,
+                enabled=True,
+                refresh_interval=refresh_interval,
+                probe_budget=probe_budget,
+                created_at=datetime.utcnow().isoformat()
+            )
+            conn.execute(insert(sources_table).values(**source.to_dict()))
+        logger.info(f"Added source: {name}")
+        return source
+
+    def update_source(self, source: SubscriptionSource):
+        values = source.to_dict()
+        values.pop("id")
+        with self.engine.begin() as conn:
+            conn.execute(update(sources_table).where(sources_table.c.id == source.id).values(**values))
+
+    def delete_source(self, source_id: int) -> bool:
+        with self._configs_lock, self.engine.begin() as conn:
+            deleted = conn.execute(delete(sources_table).where(sources_table.c.id == source_id)).rowcount
+            if deleted:
+                # Конфиги удаленного источника уходят в той же транзакции
+                conn.execute(delete(configs_table).where(configs_table.c.source_id == source_id))
+        return bool(deleted)
+
+    def toggle_source(self, source_id: int) -> Optional[SubscriptionSource]:
+        with self.engine.begin() as conn:
+            source = self._get_source(conn, source_id)
+            if source is None:
+                return None
+            source.enabled = not source.enabled
+            values = {"enabled": source.enabled}
+            if source.enabled:
+                # Ручное включение сбрасывает breaker: следующий запуск сразу запросит источник
+                source.breaker_state = "closed"
+                source.failure_count = 0
+                source.next_attempt_at = None
+                values.update(breaker_state="closed", failure_count=0, next_attempt_at=None)
+            conn.execute(update(sources_table).where(sources_table.c.id == source_id).values(**values))
+            return source
+
+    # Configs
+    def get_configs(self) -> List[AggregatedConfig]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(configs_table).order_by(configs_table.c.position))
+            return [self._config(r) for r in rows]
+
+    def get_configs_by_ids(self, ids: Iterable[int]) -> List[AggregatedConfig]:
+        ids = list(set(ids))
+        configs = []
+        with self.engine.connect() as conn:
+            # Пачками: SQLite ограничивает число параметров в запросе
+            for start in range(0, len(ids), 500):
+                rows = conn.execute(select(configs_table).where(configs_table.c.id.in_(ids[start:start + 500])))
+                configs.extend(self._config(r) for r in rows)
+        return configs
+
+    def get_active_configs(self) -> List[AggregatedConfig]:
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(configs_table)
+                .where(configs_table.c.is_active.is_(True))
+                .order_by(configs_table.c.ping_ms, configs_table.c.position)
+            )
+            return [self._config(r) for r in rows]
+
+    def save_configs(self, configs: List[AggregatedConfig]):
+        """Замена всех конфигов одной транзакцией: читатели видят либо старый, либо новый набор"""
+        rows = [c.to_dict() for c in configs]
+        with self._configs_lock, self.engine.begin() as conn:
+            conn.execute(delete(configs_table))
+            if rows:
+                conn.execute(insert(configs_table), rows)
+
+    def update_configs(self, updated: List[AggregatedConfig]) -> List[AggregatedConfig]:
+        """UPDATE по ID; удаленные или изменившиеся за это время конфиги (другой raw) пропускаются"""
+        applied = []
+        with self._configs_lock, self.engine.begin() as conn:
+            for config in updated:
+                values = config.to_dict()
+                values.pop("id")
+                result = conn.execute(
+                    update(configs_table)
+                    .where(and_(configs_table.c.id == config.id, configs_table.c.raw == config.raw))
+                    .values(**values)
+                )
+                if result.rowcount:
+                    applied.append(config)
+        return applied
+
+    def clear_configs(self):
+        with self._configs_lock, self.engine.begin() as conn:
+            conn.execute(delete(configs_table))
+
+    def get_stats(self) -> dict:
+        with self.engine.connect() as conn:
+            total_sources, enabled_sources = conn.execute(
+                select(func.count(), func.coalesce(func.sum(sources_table.c.enabled.cast(Integer)), 0))
+            ).one()
+            total_configs = conn.execute(select(func.count()).select_from(configs_table)).scalar()
+            active_configs, avg_ping = conn.execute(
+                select(func.count(), func.avg(configs_table.c.ping_ms)).where(configs_table.c.is_active.is_(True))
+            ).one()
+        return {
+            "total_sources": total_sources,
+            "enabled_sources": int(enabled_sources),
+            "total_configs": total_configs,
+            "active_configs": active_configs,
+            "avg_ping": float(avg_ping) if active_configs else 0
+        }
@@ -1,10 +1,12 @@
 import json
 import os
 import logging
-from typing import List, Optional
+import threading
+from typing import Dict, Iterable, List, Optional
 from datetime import datetime
 
-from app.xpert.models import SubscriptionSource, AggregatedConfig
+from app.xpert.models import SubscriptionSource, AggregatedConfig, ChangeSet
+import config as app_config
 
 logger = logging.getLogger(__name__)
 
@@ -15,10 +17,18 @@ class XpertStorage:
     """Файловое хранилище для Xpert"""
     
     def __init__(self):
-        self.data_dir = DATA_DIR
+        self._set_data_dir(DATA_DIR)
+        self._ensure_data_dir()
+        # Запись configs.json из агрегации и фонового перепроверщика
+        self._configs_lock = threading.RLock()
+
+    def _set_data_dir(self, data_dir: str):
+        self.data_dir = data_dir
         self.sources_file = os.path.join(self.data_dir, "sources.json")
         self.configs_file = os.path.join(self.data_dir, "configs.json")
-        self._ensure_data_dir()
+        self.meta_file = os.path.join(self.data_dir, "meta.json")
+        self.changes_file = os.path.join(self.data_dir, "changes.json")
+        self.checkpoint_file = os.path.join(self.data_dir, "checkpoint.jsonl")
     
     def _ensure_data_dir(self):
         """Создание директории для данных"""
@@ -26,9 +36,7 @@ class XpertStorage:
             os.makedirs(self.data_dir, exist_ok=True)
         except Exception as e:
             logger.warning(f"Could not create data dir {self.data_dir}: {e}")
-            self.data_dir = "/tmp/xpert"
-            self.sources_file = os.path.join(self.data_dir, "sources.json")
-            self.configs_file = os.path.join(self.data_dir, "configs.json")
+            self._set_data_dir("/tmp/xpert")
             os.makedirs(self.data_dir, exist_ok=True)
     
     def _load_json(self, filepath: str) -> list:
@@ -41,7 +49,11 @@ class XpertStorage:
                 logger.error(f"Failed to load {filepath}: {e}")
         return []
     
-    def _save_json(self, filepath: str, data: list):
+    def _load_json_dict(self, filepath: str) -> dict:
+        data = self._load_json(filepath)
+        return data if isinstance(data, dict) else {}
+
+    def _save_json(self, filepath: str, data):
         """Сохранение JSON файла"""
         try:
             with open(filepath, 'w', encoding='utf-8') as f:
@@ -59,7 +71,14 @@ class XpertStorage:
         """Получение активных источников"""
         return [s for s in self.get_sources() if s.enabled]
     
-    def add_source(self, name: str, url: str, priority: int = 1) -> SubscriptionSource:
+    def add_source(
+        self,
+        name: str,
+        url: str,
+        priority: int = 1,
+        refresh_interval: Optional[int] = None,
+        probe_budget: Optional[int] = None,
+    ) -> SubscriptionSource:
         """Добавление источника"""
         sources = self.get_sources()
         new_id = max([s.id for s in sources], default=0) + 1
@@ -69,6 +88,8 @@ class XpertStorage:
             url=url,
             priority=priority,
             enabled=True,
+            refresh_interval=refresh_interval,
+            probe_budget=probe_budget,
             created_at=datetime.utcnow().isoformat()
         )
         sources.append(source)
@@ -105,6 +126,11 @@ class XpertStorage:
         for source in sources:
             if source.id == source_id:
                 source.enabled = not source.enabled
+                if source.enabled:
+                    # Ручное включение сбрасывает breaker: следующий запуск сразу запросит источник
+                    source.breaker_state = "closed"
+                    source.failure_count = 0
+                    source.next_attempt_at = None
                 self._save_json(self.sources_file, [s.to_dict() for s in sources])
                 return source
         return None
@@ -115,6 +141,11 @@ class XpertStorage:
         data = self._load_json(self.configs_file)
         return [AggregatedConfig.from_dict(d) for d in data]
     
+    def get_configs_by_ids(self, ids: Iterable[int]) -> List[AggregatedConfig]:
+        """Конфиги с указанными ID (удаленные пропускаются)"""
+        wanted = set(ids)
+        return [AggregatedConfig.from_dict(d) for d in self._load_json(self.configs_file) if d.get("id") in wanted]
+
     def get_active_configs(self) -> List[AggregatedConfig]:
         """Получение активных конфигов"""
         configs = self.get_configs()
@@ -123,12 +154,97 @@ class XpertStorage:
     
     def save_configs(self, configs: List[AggregatedConfig]):
         """Сохранение всех конфигов"""
-        self._save_json(self.configs_file, [c.to_dict() for c in configs])
+        with self._configs_lock:
+            self._save_json(self.configs_file, [c.to_dict() for c in configs])
+
+    def update_configs(self, updated: List[AggregatedConfig]) -> List[AggregatedConfig]:
+        """Замена строк по ID; удаленные или изменившиеся за это время конфиги пропускаются"""
+        by_id = {c.id: c for c in updated}
+        with self._configs_lock:
+            configs = self.get_configs()
+            applied = []
+            for i, config in enumerate(configs):
+                if config.id in by_id and by_id[config.id].raw == config.raw:
+                    configs[i] = by_id[config.id]
+                    applied.append(configs[i])
+            if applied:
+                self._save_json(self.configs_file, [c.to_dict() for c in configs])
+        return applied
     
     def clear_configs(self):
         """Очистка конфигов"""
-        self._save_json(self.configs_file, [])
+        with self._configs_lock:
+            self._save_json(self.configs_file, [])
+
+    def reserve_config_ids(self, count: int, floor: int = 1) -> int:
+        """Резервирует count новых ID конфигов; ID никогда не переиспользуются"""
+        meta = self._load_json_dict(self.meta_file)
+        start = max(int(meta.get("next_config_id", 1)), floor)
+        meta["next_config_id"] = start + max(0, count)
+        self._save_json(self.meta_file, meta)
+        return start
+
+    # Change sets
+    def get_change_set(self) -> ChangeSet:
+        """Последний набор изменений агрегации"""
+        data = self._load_json_dict(self.changes_file)
+        return ChangeSet.from_dict(data) if data else ChangeSet()
+
+    def save_change_set(self, change_set: ChangeSet):
+        """Сохранение набора изменений"""
+        self._save_json(self.changes_file, change_set.to_dict())
     
+    # Checkpoint незавершенного запуска: JSONL, первая строка - заголовок, далее результаты проверок
+    def load_checkpoint(self, max_age_sec: float) -> Dict[str, dict]:
+        """Результаты проверок из checkpoint'а (raw -> result) не старше max_age_sec"""
+        if not os.path.exists(self.checkpoint_file):
+            return {}
+        results = {}
+        try:
+            now = datetime.utcnow()
+            with open(self.checkpoint_file, "r", encoding="utf-8") as f:
+                f.readline()  # заголовок
+                for line in f:
+                    try:
+                        result = json.loads(line)
+                    except ValueError:
+                        break  # оборванная последняя строка после аварийной остановки
+                    checked = datetime.fromisoformat(result.get("checked_at", ""))
+                    if (now - checked).total_seconds() <= max_age_sec:
+                        results[result["raw"]] = result
+        except Exception as e:
+            logger.warning(f"Failed to load checkpoint: {e}")
+        return results
+
+    def start_checkpoint(self, job_id: str, carried: List[dict]):
+        """Новый checkpoint с заголовком и перенесенными из прошлого checkpoint'а результатами"""
+        try:
+            with open(self.checkpoint_file, "w", encoding="utf-8") as f:
+                header = {"job_id": job_id, "started_at": datetime.utcnow().isoformat()}
+                f.write(json.dumps(header, ensure_ascii=False) + "\n")
+                for result in carried:
+                    f.write(json.dumps(result, ensure_ascii=False) + "\n")
+        except Exception as e:
+            logger.error(f"Failed to start checkpoint: {e}")
+
+    def append_checkpoint(self, results: List[dict]):
+        """Дописывает пачку результатов проверок"""
+        if not results:
+            return
+        try:
+            with open(self.checkpoint_file, "a", encoding="utf-8") as f:
+                f.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in results))
+        except Exception as e:
+            logger.error(f"Failed to append checkpoint: {e}")
+
+    def clear_checkpoint(self):
+        try:
+            os.remove(self.checkpoint_file)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to remove checkpoint: {e}")
+
     def get_stats(self) -> dict:
         """Получение статистики"""
         sources = self.get_sources()
@@ -144,4 +260,13 @@ class XpertStorage:
         }
 
 
-storage = XpertStorage()
+def _create_storage() -> XpertStorage:
+    """Хранилище по XPERT_STORAGE_BACKEND: sqlite (таблицы) или json (файлы)"""
+    if app_config.XPERT_STORAGE_BACKEND == "json":
+        return XpertStorage()
+    from app.xpert.sql_storage import SqlXpertStorage
+
+    return SqlXpertStorage(app_config.XPERT_STORAGE_DB)
+
+
+storage = _create_storage()
@@ -158,9 +158,56 @@ XPERT_REDIS_URL = config("XPERT_REDIS_URL", default="")
 XPERT_REQUIRE_ACTIVE_STATUS = config("XPERT_REQUIRE_ACTIVE_STATUS", cast=bool, default=True)
 XPERT_USE_DYNAMIC_FILTERING = config("XPERT_USE_DYNAMIC_FILTERING", cast=bool, default=True)
 XPERT_MIN_USERS_FOR_STATS = config("XPERT_MIN_USERS_FOR_STATS", cast=int, default=3)
+XPERT_PING_STATS_FLUSH_SEC = config("XPERT_PING_STATS_FLUSH_SEC", cast=float, default=2.0)
+XPERT_PING_STATS_COMPACT_SEC = config("XPERT_PING_STATS_COMPACT_SEC", cast=int, default=300)
+XPERT_PING_STATS_COMPACT_LINES = config("XPERT_PING_STATS_COMPACT_LINES", cast=int, default=200000)
+XPERT_PING_HEALTH_HALF_LIFE_HOURS = config("XPERT_PING_HEALTH_HALF_LIFE_HOURS", cast=float, default=24.0)
+XPERT_PING_HEALTH_EWMA_ALPHA = config("XPERT_PING_HEALTH_EWMA_ALPHA", cast=float, default=0.2)
+XPERT_PING_HEALTH_MIN_WEIGHT = config("XPERT_PING_HEALTH_MIN_WEIGHT", cast=float, default=0.5)
+XPERT_PING_INGEST_QUEUE_SIZE = config("XPERT_PING_INGEST_QUEUE_SIZE", cast=int, default=50000)
+XPERT_PING_INGEST_BATCH_SIZE = config("XPERT_PING_INGEST_BATCH_SIZE", cast=int, default=1000)
+XPERT_PING_BATCH_MAX_REPORTS = config("XPERT_PING_BATCH_MAX_REPORTS", cast=int, default=500)
+XPERT_PING_BATCH_MAX_BYTES = config("XPERT_PING_BATCH_MAX_BYTES", cast=int, default=262144)
 XPERT_TOP_SERVERS_LIMIT = config("XPERT_TOP_SERVERS_LIMIT", cast=int, default=1000)  # Убираем лимит
 XPERT_USE_COUNTRY_FLAGS = config("XPERT_USE_COUNTRY_FLAGS", cast=bool, default=True)
 JOB_SUBSCRIPTION_AGGREGATION_INTERVAL = config("JOB_SUBSCRIPTION_AGGREGATION_INTERVAL", cast=int, default=3600)
+XPERT_PROBE_TIMEOUT = config("XPERT_PROBE_TIMEOUT", cast=float, default=2.5)
+XPERT_PROBE_CONCURRENCY = config("XPERT_PROBE_CONCURRENCY", cast=int, default=256)
+XPERT_PROBE_MIN_CONCURRENCY = config("XPERT_PROBE_MIN_CONCURRENCY", cast=int, default=16)
+XPERT_PROBE_PER_HOST_LIMIT = config("XPERT_PROBE_PER_HOST_LIMIT", cast=int, default=4)
+XPERT_PROBE_SAMPLES = config("XPERT_PROBE_SAMPLES", cast=int, default=3)
+XPERT_PROBE_SAMPLE_INTERVAL_MS = config("XPERT_PROBE_SAMPLE_INTERVAL_MS", cast=int, default=200)
+XPERT_DIRECT_FLUSH_DELAY_MS = config("XPERT_DIRECT_FLUSH_DELAY_MS", cast=int, default=500)
+XPERT_DIRECT_PING_CONCURRENCY = config("XPERT_DIRECT_PING_CONCURRENCY", cast=int, default=32)
+XPERT_PROBE_CACHE_TTL = config("XPERT_PROBE_CACHE_TTL", cast=int, default=120)
+XPERT_PROBE_CACHE_NEGATIVE_TTL = config("XPERT_PROBE_CACHE_NEGATIVE_TTL", cast=int, default=30)
+XPERT_PROBE_CACHE_SIZE = config("XPERT_PROBE_CACHE_SIZE", cast=int, default=50000)
+XPERT_TARGET_BASELINE_INTERVAL = config("XPERT_TARGET_BASELINE_INTERVAL", cast=int, default=30)
+XPERT_REPROBE_AFTER_SEC = config("XPERT_REPROBE_AFTER_SEC", cast=int, default=1800)
+XPERT_AGGREGATION_DEADLINE_SEC = config("XPERT_AGGREGATION_DEADLINE_SEC", cast=int, default=240)
+XPERT_CHECKPOINT_BATCH = config("XPERT_CHECKPOINT_BATCH", cast=int, default=200)
+XPERT_DNS_TTL = config("XPERT_DNS_TTL", cast=int, default=300)
+XPERT_DNS_NEGATIVE_TTL = config("XPERT_DNS_NEGATIVE_TTL", cast=int, default=60)
+XPERT_DNS_CACHE_SIZE = config("XPERT_DNS_CACHE_SIZE", cast=int, default=50000)
+XPERT_REPROBE_TICK_SEC = config("XPERT_REPROBE_TICK_SEC", cast=int, default=30)
+XPERT_REPROBE_MIN_INTERVAL = config("XPERT_REPROBE_MIN_INTERVAL", cast=int, default=180)
+XPERT_REPROBE_HEALTHY_MAX_INTERVAL = config("XPERT_REPROBE_HEALTHY_MAX_INTERVAL", cast=int, default=900)
+XPERT_REPROBE_DEAD_MAX_INTERVAL = config("XPERT_REPROBE_DEAD_MAX_INTERVAL", cast=int, default=21600)
+XPERT_REPROBE_BATCH = config("XPERT_REPROBE_BATCH", cast=int, default=300)
+XPERT_FEED_MAX_BYTES = config("XPERT_FEED_MAX_BYTES", cast=int, default=16 * 1024 * 1024)
+XPERT_FEED_MAX_LINES = config("XPERT_FEED_MAX_LINES", cast=int, default=50000)
+XPERT_SOURCE_BREAKER_THRESHOLD = config("XPERT_SOURCE_BREAKER_THRESHOLD", cast=int, default=3)
+XPERT_SOURCE_BREAKER_BASE_SEC = config("XPERT_SOURCE_BREAKER_BASE_SEC", cast=int, default=300)
+XPERT_SOURCE_BREAKER_MAX_SEC = config("XPERT_SOURCE_BREAKER_MAX_SEC", cast=int, default=21600)
+# sqlite - таблицы с индексами (XPERT_STORAGE_DB: путь или URL, по умолчанию xpert.db в XPERT_DATA_DIR), json - файлы
+XPERT_STORAGE_BACKEND = config("XPERT_STORAGE_BACKEND", default="sqlite")
+XPERT_STORAGE_DB = config("XPERT_STORAGE_DB", default="")
+XPERT_PARSE_CACHE_SIZE = config("XPERT_PARSE_CACHE_SIZE", cast=int, default=20000)
+# Обновление источников: интервал JOB_SUBSCRIPTION_AGGREGATION_INTERVAL / priority, бюджет XPERT_SOURCE_PROBE_BUDGET * priority
+XPERT_SOURCE_MIN_REFRESH_SEC = config("XPERT_SOURCE_MIN_REFRESH_SEC", cast=int, default=300)
+XPERT_SOURCE_PROBE_BUDGET = config("XPERT_SOURCE_PROBE_BUDGET", cast=int, default=2000)
+XPERT_SOURCE_SCHEDULER_TICK_SEC = config("XPERT_SOURCE_SCHEDULER_TICK_SEC", cast=int, default=60)
+XPERT_SOURCE_MAX_PER_TICK = config("XPERT_SOURCE_MAX_PER_TICK", cast=int, default=4)
 
 # ============================================
 # XPERT PANEL - Traffic Monitoring System
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Офлайн-бенчмарк агрегации Xpert (app/xpert)
+
+Поднимает локальный HTTP-сервер с синтетическими фидами (plain, base64, vmess-heavy)
+и локальные TCP/TLS-слушатели: быстрые, медленные, мертвые (refused / timeout)
+и обрывающие TLS handshake (EOF). Затем гоняет XpertService.update_subscription
+и печатает время, скорость проверок, пиковый RSS и задержки event loop.
+
+Сеть не нужна. Синхронизация с Marzban в замер не входит (подменяется заглушкой).
+
+Пример:
+    python scripts/bench_xpert_aggregation.py --sizes 1000,10000 --variants plain,vmess
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import random
+import resource
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# Данные Xpert бенчмарка - во временной директории, а не в /var/lib/marzban
+DATA_DIR = tempfile.mkdtemp(prefix="xpert-bench-")
+os.environ["XPERT_DATA_DIR"] = DATA_DIR
+
+VARIANTS = ("plain", "base64", "vmess")
+
+# Доля ссылок на каждый тип endpoint'а
+ENDPOINT_MIX = (
+    ("tcp", 0.40),
+    ("tls", 0.25),
+    ("slow_tls", 0.10),
+    ("eof", 0.10),
+    ("refused", 0.10),
+    ("timeout", 0.05),
+)
+TLS_KINDS = {"tls", "slow_tls", "eof", "timeout"}
+
+
+class FeedHandler(BaseHTTPRequestHandler):
+    feeds = {}
+
+    def do_GET(self):
+        body = self.feeds.get(self.path)
+        if body is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class EndpointFarm:
+    """Локальные слушатели разных типов в отдельном потоке со своим event loop.
+
+    Слушатели открыты на 0.0.0.0, чтобы ссылки могли указывать на разные адреса 127.x.y.z:
+    движок ограничивает параллельность на адрес, и один 127.0.0.1 исказил бы замер.
+    """
+
+    def __init__(self, slow_delay: float):
+        self.slow_delay = slow_delay
+        self.ports = {}
+        self._loop = asyncio.new_event_loop()
+        self._servers = []
+        self._sockets = []
+        self._ssl_context = self._build_ssl_context()
+
+    @staticmethod
+    def _build_ssl_context() -> ssl.SSLContext:
+        from app.utils.crypto import generate_certificate
+
+        cert = generate_certificate()
+        cert_dir = tempfile.mkdtemp(prefix="xpert-bench-cert-")
+        cert_file = os.path.join(cert_dir, "cert.pem")
+        key_file = os.path.join(cert_dir, "key.pem")
+        with open(cert_file, "w") as f:
+            f.write(cert["cert"])
+        with open(key_file, "w") as f:
+            f.write(cert["key"])
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(cert_file, key_file)
+        return context
+
+    async def _start(self):
+        async def close_at_once(reader, writer):
+            writer.close()
+
+        async def slow_tls(reader, writer):
+            try:
+                await asyncio.sleep(self.slow_delay)
+                await writer.start_tls(self._ssl_context)
+            except Exception:
+                pass
+            finally:
+                writer.close()
+
+        tcp = await asyncio.start_server(close_at_once, "0.0.0.0", 0, backlog=4096)
+        tls = await asyncio.start_server(close_at_once, "0.0.0.0", 0, ssl=self._ssl_context, backlog=4096)
+        slow = await asyncio.start_server(slow_tls, "0.0.0.0", 0, backlog=4096)
+        # Закрытие сразу после accept: TLS-клиент получает EOF во время handshake
+        eof = await asyncio.start_server(close_at_once, "0.0.0.0", 0, backlog=4096)
+        self._servers = [tcp, tls, slow, eof]
+        for kind, server in zip(("tcp", "tls", "slow_tls", "eof"), self._servers):
+            self.ports[kind] = server.sockets[0].getsockname()[1]
+
+        # timeout: сокет слушает, но accept не вызывается - handshake не завершается никогда
+        stalled = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        stalled.bind(("0.0.0.0", 0))
+        stalled.listen(1)
+        self.ports["timeout"] = stalled.getsockname()[1]
+
+        # refused: порт заняли и сразу освободили
+        closed = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        closed.bind(("0.0.0.0", 0))
+        self.ports["refused"] = closed.getsockname()[1]
+        closed.close()
+        self._sockets = [stalled]
+
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self._loop)
+            self._loop.run_until_complete(self._start())
+            ready.set()
+            self._loop.run_forever()
+
+        threading.Thread(target=run, name="bench-endpoints", daemon=True).start()
+        ready.wait()
+
+    def stop(self):
+        for sock in self._sockets:
+            sock.close()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+def endpoint_host(index: int) -> str:
+    return f"127.{1 + (index >> 16) % 254}.{(index >> 8) & 0xff}.{(index & 0xff) or 1}"
+
+
+def build_feed(lines: int, variant: str, ports: dict, seed: int) -> bytes:
+    """Синтетический фид: ~4 ссылки на endpoint, тип endpoint'а по ENDPOINT_MIX"""
+    rng = random.Random(seed)
+    kinds = [kind for kind, _ in ENDPOINT_MIX]
+    weights = [weight for _, weight in ENDPOINT_MIX]
+    endpoints = max(1, lines // 4)
+    links = []
+    for i in range(lines):
+        kind = rng.choices(kinds, weights)[0]
+        host = endpoint_host(rng.randrange(endpoints))
+        port = ports[kind]
+        tls = kind in TLS_KINDS
+        user_id = str(uuid.UUID(int=rng.getrandbits(128)))
+        if variant == "vmess" and rng.random() < 0.8:
+            data = {
+                "v": "2", "ps": f"bench-{i}", "add": host, "port": str(port), "id": user_id,
+                "aid": "0", "net": "ws", "type": "none", "host": "", "path": f"/{i}",
+                "tls": "tls" if tls else "",
+            }
+            links.append("vmess://" + base64.b64encode(json.dumps(data).encode()).decode())
+        else:
+            security = "tls" if tls else "none"
+            links.append(f"vless://{user_id}@{host}:{port}?encryption=none&security={security}&type=tcp#bench-{i}")
+
+    body = "\n".join(links).encode()
+    if variant == "base64":
+        body = base64.b64encode(body)
+    return body
+
+
+class LoopLagMonitor:
+    """Задержка event loop: насколько позже срабатывает sleep(interval)"""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> dict:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        ordered = sorted(self.samples) or [0.0]
+        return {
+            "max_ms": ordered[-1] * 1000,
+            "p99_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+        }
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss: килобайты в Linux, байты в macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def reset_storage(storage):
+    for source in storage.get_sources():
+        storage.delete_source(source.id)
+    storage.clear_configs()
+    storage.clear_checkpoint()
+
+
+async def run_once(xpert_service, samples: int) -> dict:
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    result = await xpert_service.update_subscription(trigger="bench")
+    wall = time.perf_counter() - started
+    lag = await monitor.stop()
+    run = xpert_service.get_update_run()
+    return {
+        "wall_s": wall,
+        "configs": result["total_configs"],
+        "active": result["active_configs"],
+        "endpoints": run.endpoints_total,
+        "probes_per_s": (run.endpoints_probed * samples) / wall if wall else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "lag_max_ms": lag["max_ms"],
+        "lag_p99_ms": lag["p99_ms"],
+    }
+
+
+async def main(args):
+    import config as app_config
+    from app.xpert.checker import checker
+    from app.xpert.marzban_integration import marzban_integration
+    from app.xpert.probe_engine import probe_engine
+    from app.xpert.service import xpert_service
+    from app.xpert.storage import storage
+
+    # Без внешней сети: baseline до Target IPs не используется, Marzban не трогаем
+    checker.target_ips = []
+    marzban_integration.sync_changed_configs_to_marzban = lambda change_set: {"skipped": "benchmark"}
+    app_config.XPERT_AGGREGATION_DEADLINE_SEC = args.deadline
+    probe_engine.timeout = args.probe_timeout
+    probe_engine.samples = args.samples
+
+    farm = EndpointFarm(slow_delay=args.slow_delay)
+    farm.start()
+
+    http = ThreadingHTTPServer(("127.0.0.1", 0), FeedHandler)
+    threading.Thread(target=http.serve_forever, name="bench-http", daemon=True).start()
+    base_url = f"http://127.0.0.1:{http.server_address[1]}"
+
+    print(f"Data dir: {DATA_DIR}")
+    print(f"Endpoints: {farm.ports}")
+    header = (
+        f"{'scenario':<16}{'run':<6}{'wall s':>9}{'configs':>9}{'active':>8}{'endpoints':>11}"
+        f"{'probes/s':>10}{'rss MB':>9}{'lag max':>9}{'lag p99':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+
+    report = []
+    for size in args.sizes:
+        for variant in args.variants:
+            name = f"{variant}-{size}"
+            path = f"/{name}"
+            FeedHandler.feeds[path] = build_feed(size, variant, farm.ports, seed=args.seed)
+            reset_storage(storage)
+            storage.add_source(name, base_url + path)
+
+            for label in ("cold", "warm"):
+                stats = await run_once(xpert_service, args.samples)
+                report.append({"scenario": name, "run": label, **stats})
+                print(
+                    f"{name:<16}{label:<6}{stats['wall_s']:>9.2f}{stats['configs']:>9}{stats['active']:>8}"
+                    f"{stats['endpoints']:>11}{stats['probes_per_s']:>10.0f}{stats['peak_rss_mb']:>9.0f}"
+                    f"{stats['lag_max_ms']:>9.1f}{stats['lag_p99_ms']:>9.1f}"
+                )
+            del FeedHandler.feeds[path]
+
+    http.shutdown()
+    farm.stop()
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report saved to {args.json}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline benchmark for Xpert subscription aggregation")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        type=lambda v: [int(x) for x in v.split(",") if x])
+    parser.add_argument("--variants", default=",".join(VARIANTS),
+                        type=lambda v: [x for x in v.split(",") if x in VARIANTS])
+    parser.add_argument("--probe-timeout", type=float, default=1.0, help="timeout per probe sample, s")
+    parser.add_argument("--samples", type=int, default=3, help="probe samples per endpoint")
+    parser.add_argument("--slow-delay", type=float, default=0.3, help="handshake delay of slow TLS endpoints, s")
+    parser.add_argument("--deadline", type=int, default=0, help="aggregation deadline, s (0 - unbounded)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.ERROR)
+    if not args.verbose:
+        # Логгеры Xpert пишут INFO на каждый конфиг - в замер это не должно попадать
+        logging.disable(logging.WARNING)
+    asyncio.run(main(args))
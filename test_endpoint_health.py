@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Проверка накопительной статистики endpoint'ов: очистка старых отчетов и подсчет уникальных пользователей
+"""
+
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+# Добавляем путь к app; файлы статистики пишутся во временный каталог
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(ROOT)
+WORK_DIR = tempfile.mkdtemp(prefix="xpert-endpoint-health-")
+os.environ.setdefault("XPERT_DATA_DIR", WORK_DIR)
+os.chdir(WORK_DIR)
+
+from app.xpert.models import EndpointHealth
+from app.xpert.ping_stats import HLL_SPARSE_LIMIT, PingStatsService, _add_user
+
+
+def test_cleanup_rebuilds_aggregates():
+    """После очистки удаленные пользователи не учитываются в агрегате endpoint'а"""
+    print("🔧 Testing cleanup of expired reporters...")
+    service = PingStatsService()
+    service._stop.set()  # фоновая запись не нужна
+    old = (datetime.utcnow() - timedelta(days=10)).isoformat()
+    with service._lock:
+        for user_id in range(4):
+            service._apply("d.example.com", 443, "vless", user_id, 100.0, True, old)
+            service._by_server[("d.example.com", 443, "vless")][user_id].created_at = old
+    service.record_ping("d.example.com", 443, "vless", 42, 60.0, True)
+    service.cleanup_old_stats(days=7)
+
+    health = service.get_server_health("d.example.com", 443, "vless")
+    assert health["unique_users"] == 1 and health["healthy"] is None, f"Purged reporters still counted: {health}"
+    print("✅ Aggregate rebuilt from the remaining reporter")
+
+
+def test_unique_user_estimates():
+    """Оценка уникальных пользователей точна на малых числах и близка на больших"""
+    print("🔧 Testing unique user estimates...")
+    for n in list(range(0, HLL_SPARSE_LIMIT + 1)) + [200, 1000, 5000]:
+        health = EndpointHealth()
+        for user_id in range(n):
+            _add_user(health, user_id)
+            _add_user(health, user_id)  # повторный отчет того же пользователя
+        if n <= HLL_SPARSE_LIMIT:
+            assert health.unique_users == n, f"Estimate for {n} users: {health.unique_users}"
+        else:
+            assert abs(health.unique_users - n) <= n * 0.15, (
+                f"Estimate for {n} users off by more than 15%: {health.unique_users}"
+            )
+        restored = EndpointHealth.from_dict(health.to_dict())
+        assert (restored.unique_users, restored.sparse_users) == (health.unique_users, health.sparse_users), (
+            f"Estimate for {n} users changed after to_dict/from_dict"
+        )
+    print(f"✅ Exact up to {HLL_SPARSE_LIMIT} users, within 15% up to 5000")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Xpert Endpoint Health Test")
+    print("=" * 50)
+
+    tests = [
+        test_cleanup_rebuilds_aggregates,
+        test_unique_user_estimates,
+    ]
+    failed = []
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {e}")
+            failed.append(test.__name__)
+
+    if failed:
+        print(f"\n❌ Failed: {', '.join(failed)}")
+        sys.exit(1)
+    print("\n✅ All endpoint health tests passed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Проверка рейтинга конфигов Xpert: точечный пересчет против построения с нуля
+"""
+
+import os
+import random
+import sys
+import tempfile
+
+# Добавляем путь к app; файлы статистики пишутся во временный каталог
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(ROOT)
+WORK_DIR = tempfile.mkdtemp(prefix="xpert-leaderboard-")
+os.environ.setdefault("XPERT_DATA_DIR", WORK_DIR)
+os.chdir(WORK_DIR)
+
+from app.xpert.leaderboard import ConfigLeaderboard, leaderboard
+from app.xpert.models import AggregatedConfig
+from app.xpert.ping_stats import ping_stats_service
+from app.xpert.snapshot import active_snapshots
+
+
+def test_leaderboard_incremental_matches_rebuild():
+    """Точечный пересчет рейтинга дает тот же порядок, что и построение с нуля"""
+    print("🔧 Testing leaderboard incremental re-ranking...")
+    rng = random.Random(7)
+    configs = [
+        AggregatedConfig(
+            id=i + 1, raw=f"vless://u{i}@e{i % 40}.example.com:443#c{i}", protocol="vless",
+            server=f"e{i % 40}.example.com", port=443, ping_ms=rng.uniform(20, 900),
+            packet_loss=rng.choice([0.0, 0.0, 20.0]), is_active=True,
+        )
+        for i in range(120)
+    ]
+    active_snapshots.publish(configs)
+    leaderboard.get_top(20)
+
+    for round_number in range(30):
+        for _ in range(rng.randint(1, 40)):
+            endpoint = rng.randrange(45)  # часть endpoint'ов вне снимка
+            ping_stats_service.record_ping(
+                f"e{endpoint}.example.com", 443, "vless", rng.randrange(8),
+                rng.uniform(10, 1200), rng.random() > 0.25,
+            )
+        incremental = leaderboard.get_top(20)
+        rebuilt = ConfigLeaderboard(active_snapshots.get, ping_stats_service)
+        expected = rebuilt.get_top(20)
+        assert [c["id"] for c in incremental["configs"]] == [c["id"] for c in expected["configs"]], (
+            f"Incremental top differs from full rebuild in round {round_number}"
+        )
+        assert leaderboard.get_queue(20)["configs"] == rebuilt.get_queue(20)["configs"], (
+            f"Incremental queue differs from full rebuild in round {round_number}"
+        )
+    print("✅ Incremental top and queue match a full rebuild over 30 rounds")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Xpert Leaderboard Test")
+    print("=" * 50)
+
+    tests = [
+        test_leaderboard_incremental_matches_rebuild,
+    ]
+    failed = []
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {e}")
+            failed.append(test.__name__)
+
+    if failed:
+        print(f"\n❌ Failed: {', '.join(failed)}")
+        sys.exit(1)
+    print("\n✅ All leaderboard tests passed!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Проверка хранения статистики пингов Xpert: журнал отчетов и снимок
+"""
+
+import os
+import sys
+import tempfile
+import threading
+
+# Добавляем путь к app; файлы статистики пишутся во временный каталог
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(ROOT)
+WORK_DIR = tempfile.mkdtemp(prefix="xpert-ping-stats-")
+os.environ.setdefault("XPERT_DATA_DIR", WORK_DIR)
+os.chdir(WORK_DIR)
+
+from app.xpert.ping_stats import PingStatsService
+
+
+def _fresh_service() -> PingStatsService:
+    """Новый экземпляр на тех же файлах - как после рестарта"""
+    service = PingStatsService()
+    service._stop.set()  # фоновая запись не нужна, flush/compact вызываются явно
+    return service
+
+
+def _reset_files():
+    for name in ("xpert_ping_stats.json", "xpert_ping_stats.log"):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+def _total_reports(service: PingStatsService) -> int:
+    with service._lock:
+        return sum(s.success_count + s.fail_count for users in service._by_server.values() for s in users.values())
+
+
+def test_log_replay_after_truncated_write():
+    """Оборванная последняя строка журнала не ломает загрузку, целые строки досчитываются"""
+    print("🔧 Testing log replay after a truncated write...")
+    _reset_files()
+    service = _fresh_service()
+    for user_id in range(5):
+        service.record_ping("a.example.com", 443, "vless", user_id, 100.0, True)
+    service.flush()
+    with open(service.log_file, "a") as f:
+        f.write('{"seq":6,"server":"a.example.com","po')
+
+    restored = _fresh_service()
+    assert _total_reports(restored) == 5, f"Replay restored {_total_reports(restored)} reports, expected 5"
+    print("✅ Truncated log line ignored, 5 reports restored")
+
+
+def test_replay_skips_compacted_entries():
+    """Сбой между записью снимка и очисткой журнала не удваивает отчеты"""
+    print("🔧 Testing replay after a crash during compaction...")
+    _reset_files()
+    service = _fresh_service()
+    for user_id in range(3):
+        service.record_ping("b.example.com", 443, "vless", user_id, 80.0, True)
+    service.flush()
+    with open(service.log_file) as f:
+        log_lines = f.read()
+    service.compact()
+    # Журнал "не успел" очиститься: в нем те же отчеты, что уже в снимке, плюс один новый
+    with open(service.log_file, "w") as f:
+        f.write(log_lines)
+    service.record_ping("b.example.com", 443, "vless", 99, 80.0, False)
+    service.flush()
+
+    restored = _fresh_service()
+    assert _total_reports(restored) == 4, f"Expected 4 reports after replay, got {_total_reports(restored)}"
+    print("✅ Entries already in the snapshot skipped, new entry replayed")
+
+
+def test_compaction_under_concurrent_reports():
+    """Отчеты из нескольких потоков во время сворачивания журнала не теряются и не дублируются"""
+    print("🔧 Testing compaction under concurrent record_pings...")
+    _reset_files()
+    service = _fresh_service()
+    threads_count, batches, batch_size = 4, 50, 20
+    done = threading.Event()
+
+    def report(worker: int):
+        for batch in range(batches):
+            service.record_pings([
+                (f"c{i % 7}.example.com", 443, "vless", worker * 1000 + i, 50.0 + i, i % 5 != 0)
+                for i in range(batch_size)
+            ])
+            if batch % 10 == 0:
+                service.flush()
+
+    def compact_loop():
+        while not done.is_set():
+            service.compact()
+
+    compactor = threading.Thread(target=compact_loop)
+    compactor.start()
+    workers = [threading.Thread(target=report, args=(w,)) for w in range(threads_count)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    done.set()
+    compactor.join()
+    service.flush()
+
+    expected = threads_count * batches * batch_size
+    live, restored = _total_reports(service), _total_reports(_fresh_service())
+    assert live == expected and restored == expected, (
+        f"Expected {expected} reports, live {live}, restored {restored}"
+    )
+    print(f"✅ {expected} reports survived concurrent compaction and restart")
+
+
+def main():
+    """Основная функция тестирования"""
+    print("🚀 Xpert Ping Stats Test")
+    print("=" * 50)
+
+    tests = [
+        test_log_replay_after_truncated_write,
+        test_replay_skips_compacted_entries,
+        test_compaction_under_concurrent_reports,
+    ]
+    failed = []
+    for test in tests:
+        try:
+            test()
+        except AssertionError as e:
+            print(f"❌ {e}")
+            failed.append(test.__name__)
+
+    if failed:
+        print(f"\n❌ Failed: {', '.join(failed)}")
+        sys.exit(1)
+    print("\n✅ All ping stats tests passed!")
+
+
+if __name__ == "__main__":
+    main()